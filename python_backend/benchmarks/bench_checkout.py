@@ -0,0 +1,73 @@
+"""
+Database round trips and latency of one checkout (/api/createorder).
+
+Usage, from python_backend/::
+
+    python -m benchmarks.bench_checkout [--lines 10] [--runs 20]
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks.common import QueryCounter, configure_environment, percentile
+
+configure_environment()
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from ecomweb.database.database import create_all_tables, get_async_engine, get_engine  # noqa: E402
+from ecomweb.main import app  # noqa: E402
+
+
+def login(client:TestClient, username:str, role:str) -> dict:
+    client.post("/api/signup", json={
+        "username": username, "password": "secret", "confirm_password": "secret", "role": role,
+        "firstname": username, "lastname": "bench", "email": f"{username}@bench.test",
+    })
+    token = client.post("/api/login", data={"username": username, "password": "secret"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Checkout round-trip benchmark")
+    parser.add_argument("--lines", type=int, default=10, help="cart lines per checkout")
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    create_all_tables()
+    async_engine = get_async_engine()
+    counter = QueryCounter(async_engine.sync_engine if async_engine is not None else get_engine())
+    client = TestClient(app)
+    admin = login(client, "bench-admin", "admin")
+    shopper = login(client, "bench-shopper", "user")
+    for number in range(args.lines):
+        client.post("/addproduct", headers=admin, json={
+            "product_name": f"bench product {number}", "product_description": "benchmark",
+            "product_price": 100 + number, "product_slug": f"bench-product-{number}", "image_id": None,
+        })
+    checkout = {
+        "order_data": {"customer_name": "Bench", "customer_email": "bench@bench.test", "customer_phoneno": "03001234567", "order_status": "pending"},
+        "address_data": {"street_address": "1 Bench Street", "city": "Karachi", "country": "Pakistan"},
+        "payment_data": {"payment_method": "cash on delivery"},
+    }
+
+    round_trips, statements, latencies = [], [], []
+    for _ in range(args.runs):
+        for product_id in range(1, args.lines + 1):
+            client.post("/api/addtocart", params={"product_id": product_id}, headers=shopper,
+                        json={"total_cart_products": 1, "product_total": 100, "product_size": "medium"})
+        counter.reset()
+        start = time.perf_counter()
+        response = client.post("/api/createorder", headers=shopper, json=checkout)
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+        round_trips.append(counter.round_trips)
+        statements.append(counter.statements)
+
+    print(f"checkout with {args.lines} cart lines, {args.runs} runs")
+    print(f"  round trips per checkout: {statistics.mean(round_trips):.1f} ({statistics.mean(statements):.1f} statements + commits)")
+    print(f"  latency ms: p50 {percentile(latencies, 0.5):.2f}  p95 {percentile(latencies, 0.95):.2f}  max {max(latencies):.2f}")
+
+
+if __name__ == "__main__":
+    main()
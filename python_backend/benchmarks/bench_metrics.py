@@ -0,0 +1,100 @@
+"""
+Overhead of the request metrics: MetricsMiddleware per request, the query
+counting engine events per query, and rendering /metrics.
+
+Usage, from python_backend/::
+
+    python -m benchmarks.bench_metrics [--runs 20000] [--routes 40]
+
+The middleware is timed around an ASGI app that answers at once, so the
+difference with and without it is the middleware alone. Queries run
+against an in-memory SQLite database.
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import configure_environment, percentile
+
+configure_environment()
+
+from sqlalchemy import create_engine, text  # noqa: E402
+
+from ecomweb.database.telemetry import QueryStats, current_query_stats, instrument_queries  # noqa: E402
+from ecomweb.metrics.metrics import RequestMetrics  # noqa: E402
+from ecomweb.middlewares.middleware import MetricsMiddleware  # noqa: E402
+
+
+class Route:
+    path = "/api/products/{product_id}"
+
+
+async def endpoint(scope, receive, send) -> None:
+    scope["route"] = Route
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def measure_app(app, runs:int) -> list[float]:
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def run() -> list[float]:
+        samples = []
+        for _ in range(runs):
+            scope = {"type": "http", "method": "GET", "path": "/api/products/1"}
+            start = time.perf_counter()
+            await app(scope, receive, send)
+            samples.append((time.perf_counter() - start) * 1_000_000)
+        return samples
+
+    return asyncio.run(run())
+
+
+def measure_queries(instrumented:bool, runs:int) -> list[float]:
+    engine = create_engine("sqlite://")
+    if instrumented:
+        instrument_queries(engine)
+    samples = []
+    with engine.connect() as connection:
+        token = current_query_stats.set(QueryStats())
+        for _ in range(runs):
+            start = time.perf_counter()
+            connection.execute(text("SELECT 1")).scalar()
+            samples.append((time.perf_counter() - start) * 1_000_000)
+        current_query_stats.reset(token)
+    return samples
+
+
+def report(name:str, before:list[float], after:list[float]) -> None:
+    p50_before, p50_after = percentile(before, 0.5), percentile(after, 0.5)
+    print(f"  {name:<24} without p50 {p50_before:7.2f} us  with p50 {p50_after:7.2f} us  (+{p50_after - p50_before:.2f} us)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Request metrics overhead benchmark")
+    parser.add_argument("--runs", type=int, default=20000)
+    parser.add_argument("--routes", type=int, default=40, help="routes with recorded requests when rendering /metrics")
+    args = parser.parse_args()
+
+    metrics = RequestMetrics()
+    print(f"metrics overhead, {args.runs} runs")
+    report("request", measure_app(endpoint, args.runs), measure_app(MetricsMiddleware(endpoint, metrics), args.runs))
+    report("query", measure_queries(False, args.runs), measure_queries(True, args.runs))
+
+    for number in range(args.routes):
+        for status in (200, 404, 500):
+            metrics.record("GET", f"/route/{number}", status, 0.01 * (number % 7), 1000 * number, number % 5, 0.001)
+    renders = []
+    for _ in range(100):
+        start = time.perf_counter()
+        body = metrics.render()
+        renders.append((time.perf_counter() - start) * 1000)
+    print(f"  render /metrics ({args.routes} routes, {len(body)} bytes): p50 {percentile(renders, 0.5):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
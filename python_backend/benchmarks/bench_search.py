@@ -0,0 +1,85 @@
+"""
+Latency of /api/search against fetching the whole catalog for client-side filtering.
+
+Usage, from python_backend/::
+
+    python -m benchmarks.bench_search [--products 5000] [--runs 200]
+
+Runs against SQLite (the in-process search index) unless BENCH_DATABASE_URL
+points at a migrated PostgreSQL database.
+"""
+import argparse
+import random
+import time
+
+from benchmarks.common import configure_environment, percentile
+
+configure_environment()
+
+from fastapi.testclient import TestClient  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from ecomweb.database.database import create_all_tables, get_engine  # noqa: E402
+from ecomweb.main import app  # noqa: E402
+from ecomweb.model.model import Product  # noqa: E402
+
+WORDS = ["red", "blue", "green", "black", "leather", "cotton", "denim", "wool", "running", "hiking", "casual",
+         "classic", "slim", "oversized", "shoes", "jacket", "socks", "wallet", "shirt", "trousers", "scarf", "boots"]
+
+QUERIES = {
+    "full text": {"q": "leather boots"},
+    "typo": {"q": "lether jaket"},
+    "prefix": {"q": "run sh", "prefix": "true"},
+}
+
+
+def seed(count:int) -> None:
+    rng = random.Random(42)
+    rows = []
+    for number in range(count):
+        words = rng.sample(WORDS, 3)
+        rows.append({
+            "product_name": f"{' '.join(words).title()} {number}",
+            "product_description": " ".join(rng.choices(WORDS, k=12)),
+            "product_price": rng.randint(100, 10000),
+            "product_slug": f"{'-'.join(words)}-{number}",
+        })
+    with get_engine().begin() as connection:
+        connection.execute(insert(Product), rows)
+
+
+def timed(client:TestClient, runs:int, path:str, params:dict | None = None) -> tuple[list[float], int]:
+    latencies = []
+    size = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(path, params=params)
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+        size = len(response.content)
+    return latencies, size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Product search benchmark")
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args()
+
+    create_all_tables()
+    seed(args.products)
+    client = TestClient(app)
+
+    start = time.perf_counter()
+    client.get("/api/search", params={"q": "warm up"}).raise_for_status()
+    print(f"search over {args.products} products, {args.runs} runs")
+    print(f"  first search (builds the index if needed): {(time.perf_counter() - start) * 1000:.1f} ms")
+    for name, params in QUERIES.items():
+        latencies, size = timed(client, args.runs, "/api/search", params)
+        print(f"  {name:<10} p50 {percentile(latencies, 0.5):6.2f} ms  p95 {percentile(latencies, 0.95):6.2f} ms  {size} bytes")
+    latencies, size = timed(client, max(1, args.runs // 10), "/api/getproducts")
+    print(f"  full catalog for client-side filtering: p50 {percentile(latencies, 0.5):.2f} ms  {size} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Per-request serialization cost of the listing endpoints, before and after
+the precompiled serializers.
+
+Usage, from python_backend/::
+
+    python -m benchmarks.bench_serialization [--lines 50] [--products 500] [--runs 500]
+
+The rows are loaded from the database once; only turning them into response
+bytes is timed. "before" replays what the endpoints used to do: build dicts
+from (Cart, Product) tuples and let FastAPI encode them with
+jsonable_encoder, or validate list[Product] through the response_model;
+both rendered by JSONResponse. "after" is json_response().
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import configure_environment, percentile
+
+configure_environment()
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_response_field  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+from sqlmodel import Session, select  # noqa: E402
+
+from ecomweb.database.database import create_all_tables, get_engine  # noqa: E402
+from ecomweb.model.model import Cart, CartProductRead, Product, Size, User, UserRole  # noqa: E402
+from ecomweb.serialization.serialization import json_response  # noqa: E402
+from ecomweb.service.service import service_get_product_from_cart  # noqa: E402
+
+
+def seed(session:Session, lines:int, products:int) -> User:
+    user = User(username="bench", password="x", confirm_password="x", role=UserRole.user, firstname="b", lastname="b", email="bench@bench.test")
+    session.add(user)
+    session.commit()
+    session.execute(insert(Product), [
+        {"product_name": f"Product {number}", "product_description": "A product used by the serialization benchmark",
+         "product_price": 100 + number, "product_slug": f"product-{number}"}
+        for number in range(products)
+    ])
+    session.execute(insert(Cart), [
+        {"user_id": user.user_id, "product_id": number + 1, "total_cart_products": 2, "product_total": 200, "product_size": Size.MEDIUM}
+        for number in range(lines)
+    ])
+    session.commit()
+    return user
+
+
+def cart_before(rows) -> bytes:
+    response = [
+        {
+            "cart_id": cart.cart_id,
+            "total_cart_products": cart.total_cart_products,
+            "product_total": cart.product_total,
+            "product_size": cart.product_size,
+            "product_id": product.product_id,
+            "product_name": product.product_name,
+            "product_description": product.product_description,
+            "product_price": product.product_price,
+            "product_slug": product.product_slug,
+            "image_id": product.image_id
+        }
+        for cart, product in rows
+    ]
+    return JSONResponse(jsonable_encoder(response)).body
+
+
+def measure(fn, runs:int) -> list[float]:
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1_000_000)
+    return samples
+
+
+def report(name:str, before:list[float], after:list[float]) -> None:
+    p50_before, p50_after = percentile(before, 0.5), percentile(after, 0.5)
+    print(f"  {name:<28} before p50 {p50_before:8.1f} us  after p50 {p50_after:8.1f} us  ({p50_before / p50_after:.1f}x)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Listing serialization benchmark")
+    parser.add_argument("--lines", type=int, default=50, help="cart lines")
+    parser.add_argument("--products", type=int, default=500, help="products in the product listing")
+    parser.add_argument("--runs", type=int, default=500)
+    args = parser.parse_args()
+
+    create_all_tables()
+    with Session(get_engine()) as session:
+        user = seed(session, args.lines, args.products)
+        cart_tuples = session.exec(select(Cart, Product).join(Product, Cart.product_id == Product.product_id).where(Cart.user_id == user.user_id)).all()
+        cart_rows = service_get_product_from_cart(session, user)
+        products = session.exec(select(Product)).all()
+
+    product_field = create_response_field("Response_get_products", list[Product])
+
+    async def products_before() -> bytes:
+        content = await serialize_response(field=product_field, response_content=products, is_coroutine=True)
+        return JSONResponse(content).body
+
+    loop = asyncio.new_event_loop()
+    assert cart_before(cart_tuples) == json_response(list[CartProductRead], cart_rows).body
+    print(f"serialization per request, {args.runs} runs")
+    report(f"cart listing ({args.lines} lines)",
+           measure(lambda: cart_before(cart_tuples), args.runs),
+           measure(lambda: json_response(list[CartProductRead], cart_rows), args.runs))
+    report(f"product listing ({args.products})",
+           measure(lambda: loop.run_until_complete(products_before()), args.runs // 10 or 1),
+           measure(lambda: json_response(list[Product], products), args.runs // 10 or 1))
+    loop.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Cold start of a worker: from a fresh interpreter to the first served request.
+
+Usage, from python_backend/::
+
+    python -m benchmarks.bench_startup [--runs 5] [--budget-ms 600]
+
+Every run starts a new Python process that imports the framework, imports
+ecomweb.main, builds an app with create_app(), runs the lifespan startup (the
+schema version check) and serves one /api/catalog request. The phases are
+reported separately. The benchmark exits non-zero when the median time the
+app itself takes, from importing ecomweb.main to the first response
+("app_ready"), is over the budget. Importing fastapi and sqlmodel comes
+before that and is reported but not budgeted: the app does not control it.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import configure_environment
+
+configure_environment()
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child process. httpx is imported before the clock starts: it is
+# only the benchmark's client, not part of the worker.
+CHILD = """
+import asyncio, json, time
+import httpx
+start = time.perf_counter()
+import fastapi, sqlmodel
+framework = time.perf_counter()
+from ecomweb.main import create_app
+imported = time.perf_counter()
+app = create_app()
+built = time.perf_counter()
+
+async def serve():
+    async with app.router.lifespan_context(app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            response = await client.get("/api/catalog")
+        response.raise_for_status()
+        return started, time.perf_counter()
+
+started, served = asyncio.run(serve())
+print(json.dumps({
+    "framework_import": framework - start,
+    "app_import": imported - framework,
+    "create_app": built - imported,
+    "lifespan_startup": started - built,
+    "first_request": served - started,
+    "app_ready": served - framework,
+    "ready": served - start,
+}))
+"""
+
+PHASES = ["framework_import", "app_import", "create_app", "lifespan_startup", "first_request", "app_ready", "ready"]
+
+
+def migrate() -> None:
+    """
+    Bring the benchmark database to the alembic head, and make sure that head
+    is the revision the app checks for at startup.
+    """
+    from alembic import command
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    from ecomweb.database.database import SCHEMA_REVISION
+
+    config = Config(os.path.join(BACKEND_DIR, "alembic.ini"))
+    head = ScriptDirectory.from_config(config).get_current_head()
+    if head != SCHEMA_REVISION:
+        sys.exit(f"SCHEMA_REVISION is {SCHEMA_REVISION} but the alembic head is {head}")
+    command.upgrade(config, "head")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Worker cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=600, help="budget for the median time from importing the app to the first response")
+    args = parser.parse_args()
+
+    migrate()
+    samples = {phase: [] for phase in PHASES + ["process"]}
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, "-c", CHILD], cwd=BACKEND_DIR, env=os.environ, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            sys.exit(result.stderr)
+        for phase, seconds in json.loads(result.stdout).items():
+            samples[phase].append(seconds * 1000)
+        samples["process"].append(elapsed * 1000)
+
+    print(f"worker cold start, {args.runs} runs (median / max ms)")
+    for phase, values in samples.items():
+        print(f"  {phase:<18} {statistics.median(values):8.1f} {max(values):8.1f}")
+    app_ready = statistics.median(samples["app_ready"])
+    if app_ready > args.budget_ms:
+        print(f"FAIL: app ready in {app_ready:.1f} ms, budget {args.budget_ms:.0f} ms")
+        sys.exit(1)
+    print(f"OK: app ready in {app_ready:.1f} ms, budget {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Shared setup for the benchmarks in this directory.
+
+Benchmarks run the app in-process. Call configure_environment() before
+importing anything from ecomweb so the settings pick up the benchmark
+database (a throwaway SQLite file unless BENCH_DATABASE_URL is set).
+"""
+import os
+import tempfile
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def configure_environment(**overrides:str) -> str:
+    """
+    Point the settings at a benchmark database and return its url.
+    """
+    workdir = tempfile.mkdtemp(prefix="ecomweb-bench-")
+    database_url = os.environ.get("BENCH_DATABASE_URL") or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    defaults = {
+        "DATABASE_URL": database_url,
+        "SECRET_KEY": "benchmark-secret",
+        "ALGORITHM": "HS256",
+        "ACCESS_TOKEN_EXPIRE_MINUTES": "60",
+        "REFRESH_TOKEN_EXPIRE_MINUTES": "600",
+        # The cheapest bcrypt cost: benchmarks measure the app, not bcrypt.
+        "BCRYPT_ROUNDS": "4",
+        "IMAGE_STORE_PATH": os.path.join(workdir, "images"),
+    }
+    defaults.update(overrides)
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    return os.environ["DATABASE_URL"]
+
+
+class QueryCounter:
+    """
+    Counts database round trips: every statement sent (an executemany
+    counts once) plus every COMMIT.
+    """
+
+    def __init__(self, engine:Engine):
+        self.statements = 0
+        self.commits = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+        event.listen(engine, "commit", self._on_commit)
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+    def _on_commit(self, conn):
+        self.commits += 1
+
+    @property
+    def round_trips(self) -> int:
+        return self.statements + self.commits
+
+    def reset(self) -> None:
+        self.statements = 0
+        self.commits = 0
+
+
+def percentile(samples:list[float], fraction:float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
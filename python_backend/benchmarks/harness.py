@@ -0,0 +1,283 @@
+"""
+End-to-end benchmark of the shopping flows, with baselines to compare against.
+
+Usage, from python_backend/::
+
+    python -m benchmarks.harness [--users 20] [--concurrency 10] [--rounds 3] [--products 200]
+                                 [--save baseline.json] [--compare baseline.json] [--tolerance 0.25]
+
+Needs the packages of requirements-dev.txt (``pip install -r requirements-dev.txt``).
+
+Drives the ASGI app in-process through httpx, lifespan included, against a
+throwaway SQLite database, or the database of BENCH_DATABASE_URL (e.g. a
+local PostgreSQL; missing tables are created and every run uses names of
+its own, so the database can be reused). Set ASYNC_DATABASE=1 to bench the
+async sessions.
+
+Every virtual user goes through the phases below in order; a phase runs
+its requests for all users, --concurrency at a time, and --rounds times per
+user where it says so:
+
+    signup, login, catalog (pages, rounds), addtocart (rounds; every other
+    one adds to a line already in the cart), cart listing, cart update,
+    checkout (with an Idempotency-Key), order detail (rounds)
+
+Each phase reports p50/p95/p99 latency, throughput and the database queries
+(statements) and round trips (statements and commits) per request.
+--save writes the results as JSON. --compare reads such a file, prints the
+changes and exits with status 1 if a phase got slower than --tolerance
+allows or runs more queries per request than in the baseline.
+
+Latencies under concurrency are noisy, on SQLite above all, where writers
+queue for the database lock; compare runs of the same settings on the same
+machine, and use --concurrency 1 for the steadiest numbers.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+from typing import Awaitable, Callable
+
+from benchmarks.common import QueryCounter, configure_environment, percentile
+
+# The tables are created below rather than by alembic.
+configure_environment(DB_SCHEMA_CHECK="off")
+
+import httpx  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+from ecomweb.database.database import create_all_tables, get_async_engine, get_engine  # noqa: E402
+from ecomweb.main import app  # noqa: E402
+from ecomweb.model.model import Product  # noqa: E402
+
+CHECKOUT = {
+    "order_data": {"customer_name": "Bench", "customer_email": "bench@bench.test", "customer_phoneno": "03001234567", "order_status": "pending"},
+    "address_data": {"street_address": "1 Bench Street", "city": "Karachi", "country": "Pakistan"},
+    "payment_data": {"payment_method": "cash on delivery"},
+}
+
+# (metric, a higher value is worse, a change fails the comparison). p99 is
+# only reported: over a few dozen requests per phase it is about the maximum.
+COMPARED = (
+    ("p50_ms", True, True),
+    ("p95_ms", True, True),
+    ("p99_ms", True, False),
+    ("throughput_rps", False, True),
+    ("queries_per_request", True, True),
+)
+
+
+class Shopper:
+    def __init__(self, number:int, run:str):
+        self.number = number
+        self.username = f"bench-{run}-{number}"
+        self.headers:dict = {}
+        self.catalog_cursor:str | None = None
+        self.cart:list[dict] = []
+        self.order_id:int | None = None
+
+
+def seed_products(count:int, run:str) -> list[int]:
+    with get_engine().begin() as connection:
+        return list(connection.execute(insert(Product).returning(Product.product_id), [
+            {"product_name": f"Bench {run} {number}", "product_description": "A product of the benchmark harness",
+             "product_price": 100 + number, "product_slug": f"bench-{run}-{number}"}
+            for number in range(count)
+        ]).scalars())
+
+
+def phases(client:httpx.AsyncClient, product_ids:list[int]) -> list[tuple[str, bool, Callable[[Shopper, int], Awaitable[httpx.Response]]]]:
+    """
+    The phases as (name, run once per round, request for a user and round).
+    """
+    async def signup(shopper:Shopper, round_number:int) -> httpx.Response:
+        return await client.post("/api/signup", json={
+            "username": shopper.username, "password": "secret", "confirm_password": "secret", "role": "user",
+            "firstname": "Bench", "lastname": "Shopper", "email": f"{shopper.username}@bench.test",
+        })
+
+    async def login(shopper:Shopper, round_number:int) -> httpx.Response:
+        response = await client.post("/api/login", data={"username": shopper.username, "password": "secret"})
+        if response.status_code == 200:
+            shopper.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        return response
+
+    async def catalog(shopper:Shopper, round_number:int) -> httpx.Response:
+        params = {"limit": 20}
+        if shopper.catalog_cursor:
+            params["cursor"] = shopper.catalog_cursor
+        response = await client.get("/api/catalog", params=params)
+        if response.status_code == 200:
+            shopper.catalog_cursor = response.json()["next_cursor"]
+        return response
+
+    async def add_to_cart(shopper:Shopper, round_number:int) -> httpx.Response:
+        index = (shopper.number + round_number // 2) % len(product_ids)
+        return await client.post("/api/addtocart", params={"product_id": product_ids[index]}, headers=shopper.headers,
+                                 json={"total_cart_products": 1, "product_total": 100 + index, "product_size": "medium"})
+
+    async def cart(shopper:Shopper, round_number:int) -> httpx.Response:
+        response = await client.get("/api/get-product-from-cart", headers=shopper.headers)
+        if response.status_code == 200:
+            shopper.cart = response.json()
+        return response
+
+    async def update_cart(shopper:Shopper, round_number:int) -> httpx.Response:
+        line = shopper.cart[0]
+        return await client.put("/api/update", headers=shopper.headers,
+                                params={"cart_id": line["cart_id"], "type": "add", "product_price": line["product_price"]})
+
+    async def checkout(shopper:Shopper, round_number:int) -> httpx.Response:
+        response = await client.post("/api/createorder", json=CHECKOUT,
+                                     headers={**shopper.headers, "Idempotency-Key": shopper.username})
+        if response.status_code == 200:
+            shopper.order_id = response.json()["order_id"]
+        return response
+
+    async def order_detail(shopper:Shopper, round_number:int) -> httpx.Response:
+        return await client.get("/api/order-detail", params={"order_id": shopper.order_id}, headers=shopper.headers)
+
+    return [
+        ("signup", False, signup),
+        ("login", False, login),
+        ("catalog", True, catalog),
+        ("addtocart", True, add_to_cart),
+        ("cart", False, cart),
+        ("cart update", False, update_cart),
+        ("checkout", False, checkout),
+        ("order detail", True, order_detail),
+    ]
+
+
+async def run_phase(name:str, shoppers:list[Shopper], rounds:int, request, concurrency:int, counter:QueryCounter) -> dict:
+    """
+    Run ``rounds`` requests per shopper; the rounds of one shopper run one
+    after the other, since each may depend on the previous one.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def shop(shopper:Shopper) -> None:
+        for round_number in range(rounds):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await request(shopper, round_number)
+                latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                raise RuntimeError(f"{name}: {response.status_code} {response.text}")
+
+    counter.reset()
+    start = time.perf_counter()
+    await asyncio.gather(*(shop(shopper) for shopper in shoppers))
+    elapsed = time.perf_counter() - start
+    requests = len(latencies)
+    return {
+        "requests": requests,
+        "p50_ms": round(percentile(latencies, 0.5), 3),
+        "p95_ms": round(percentile(latencies, 0.95), 3),
+        "p99_ms": round(percentile(latencies, 0.99), 3),
+        "throughput_rps": round(requests / elapsed, 1),
+        "queries_per_request": round(counter.statements / requests, 2),
+        "round_trips_per_request": round(counter.round_trips / requests, 2),
+    }
+
+
+async def run(args:argparse.Namespace) -> dict:
+    create_all_tables()
+    run_id = uuid.uuid4().hex[:8]
+    product_ids = seed_products(args.products, run_id)
+    shoppers = [Shopper(number, run_id) for number in range(args.users)]
+    async_engine = get_async_engine()
+    engine = async_engine.sync_engine if async_engine is not None else get_engine()
+    counter = QueryCounter(engine)
+
+    results = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, per_round, request in phases(client, product_ids):
+            results[name] = await run_phase(name, shoppers, args.rounds if per_round else 1, request, args.concurrency, counter)
+    return {
+        "settings": {
+            "database": engine.dialect.name,
+            "async_database": async_engine is not None,
+            "users": args.users,
+            "concurrency": args.concurrency,
+            "rounds": args.rounds,
+            "products": args.products,
+        },
+        "phases": results,
+    }
+
+
+def report(results:dict) -> None:
+    settings = results["settings"]
+    print(f"{settings['users']} users, {settings['concurrency']} at a time, {settings['rounds']} rounds, "
+          f"{settings['database']}{' (async)' if settings['async_database'] else ''}")
+    print(f"  {'phase':<14}{'requests':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'queries':>9}{'trips':>7}")
+    for name, phase in results["phases"].items():
+        print(f"  {name:<14}{phase['requests']:>9}{phase['p50_ms']:>9.2f}{phase['p95_ms']:>9.2f}{phase['p99_ms']:>9.2f}"
+              f"{phase['throughput_rps']:>9.1f}{phase['queries_per_request']:>9.2f}{phase['round_trips_per_request']:>7.2f}")
+
+
+def compare(results:dict, baseline:dict, tolerance:float) -> list[str]:
+    """
+    Print how the results changed from the baseline.
+
+    :return: The regressions: p50/p95 latency or throughput worse than
+        ``tolerance`` allows, or more queries per request.
+    """
+    if results["settings"] != baseline["settings"]:
+        print(f"warning: the baseline ran with different settings: {baseline['settings']}")
+    regressions = []
+    print("  against the baseline:")
+    for name, phase in results["phases"].items():
+        before = baseline["phases"].get(name)
+        if before is None:
+            continue
+        changes = []
+        for metric, higher_is_worse, gated in COMPARED:
+            old, new = before[metric], phase[metric]
+            change = (new - old) / old if old else 0.0
+            changes.append(f"{metric} {change:+.0%}")
+            if metric == "queries_per_request":
+                # Deterministic, so any increase counts.
+                worse = new > old
+            else:
+                worse = change > tolerance if higher_is_worse else change < -tolerance / (1 + tolerance)
+            if gated and worse:
+                regressions.append(f"{name}: {metric} {old} -> {new}")
+        print(f"  {name:<14}" + "  ".join(changes))
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the shopping flows")
+    parser.add_argument("--users", type=int, default=20, help="virtual users")
+    parser.add_argument("--concurrency", type=int, default=10, help="requests in flight at once")
+    parser.add_argument("--rounds", type=int, default=3, help="requests per user in the catalog, addtocart and order detail phases")
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown before a phase counts as regressed")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    report(results)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("regressions:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Moving finished orders to the archive tables.
+
+Delivered and cancelled orders leave order, orderitem, address and payment
+for orderarchive and orderitemarchive, so the tables written by checkout only
+hold orders that are still in progress. A move is a handful of set-based
+statements (INSERT ... SELECT into the archive, then one DELETE per table)
+whatever the number of orders and items, and runs in the caller's
+transaction.
+
+On PostgreSQL the archive tables are partitioned by month of archived_at
+(migration 0005); the partition of a month is created the first time an
+order is archived in it.
+
+Usage, from python_backend/::
+
+    python -m ecomweb.archive.archive [--batch-size 500]
+
+archives every finished order still in the order tables, e.g. those whose
+status was changed outside the API.
+"""
+import argparse
+import threading
+from datetime import datetime
+from typing import Sequence
+
+from sqlalchemy import DateTime, delete, func, insert, literal, text
+from sqlmodel import Session, select
+
+from ecomweb.database.database import get_engine
+from ecomweb.model.model import Address, Order, OrderArchive, OrderItem, OrderItemArchive, OrderStatus, Payment
+from ecomweb.settings.setting import ARCHIVE_BATCH_SIZE
+
+FINISHED_STATUSES = (OrderStatus.CANCELLED, OrderStatus.DELIVERED)
+
+PARTITIONED_TABLES = ("orderarchive", "orderitemarchive")
+
+# (year, month) of the partitions known to exist, so the check runs once a month per worker.
+_known_partitions:set[tuple[int, int]] = set()
+_known_partitions_lock = threading.Lock()
+
+
+def month_bounds(moment:datetime) -> tuple[datetime, datetime]:
+    start = datetime(moment.year, moment.month, 1)
+    end = datetime(moment.year + moment.month // 12, moment.month % 12 + 1, 1)
+    return start, end
+
+
+def partition_name(table:str, start:datetime) -> str:
+    return f"{table}_{start:%Y_%m}"
+
+
+def ensure_partitions(session:Session, archived_at:datetime) -> None:
+    """
+    Create the archive partitions of the month of ``archived_at`` if they do
+    not exist yet. Does nothing on databases other than PostgreSQL.
+    """
+    if session.get_bind().dialect.name != "postgresql":
+        return
+    start, end = month_bounds(archived_at)
+    with _known_partitions_lock:
+        if (start.year, start.month) in _known_partitions:
+            return
+    missing = [
+        table for table in PARTITIONED_TABLES
+        if session.execute(text("SELECT to_regclass(:name)"), {"name": partition_name(table, start)}).scalar() is None
+    ]
+    for table in missing:
+        session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {partition_name(table, start)} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        ))
+    if not missing:
+        # Only remembered once seen committed: a partition created above is
+        # rolled back with the caller's transaction if that fails.
+        with _known_partitions_lock:
+            _known_partitions.add((start.year, start.month))
+
+
+def archive_orders(session:Session, order_ids:Sequence[int], archived_at:datetime | None = None) -> int:
+    """
+    Move the orders ``order_ids`` with their items, address and payment to
+    the archive tables. The caller commits.
+
+    :return: The number of orders moved.
+    """
+    if not order_ids:
+        return 0
+    archived_at = archived_at or datetime.now()
+    ensure_partitions(session, archived_at)
+    archived_at = literal(archived_at, DateTime)
+
+    totals = (
+        select(
+            OrderItem.order_id,
+            func.count(OrderItem.orderitem_id).label("item_count"),
+            func.sum(OrderItem.product_total).label("order_total"),
+        )
+        .where(OrderItem.order_id.in_(order_ids))
+        .group_by(OrderItem.order_id)
+        .subquery()
+    )
+    session.execute(insert(OrderArchive).from_select(
+        [
+            "order_id", "archived_at", "user_id", "customer_name", "customer_email", "customer_phoneno",
+            "order_status", "created_at", "item_count", "order_total",
+            "address_id", "street_address", "city", "country", "payment_id", "payment_method",
+        ],
+        select(
+            Order.order_id, archived_at, Order.user_id, Order.customer_name, Order.customer_email, Order.customer_phoneno,
+            Order.order_status, Order.created_at, func.coalesce(totals.c.item_count, 0), func.coalesce(totals.c.order_total, 0),
+            Address.address_id, Address.street_address, Address.city, Address.country, Payment.payment_id, Payment.payment_method,
+        )
+        .outerjoin(totals, totals.c.order_id == Order.order_id)
+        .outerjoin(Address, Address.order_id == Order.order_id)
+        .outerjoin(Payment, Payment.order_id == Order.order_id)
+        .where(Order.order_id.in_(order_ids)),
+    ))
+    session.execute(insert(OrderItemArchive).from_select(
+        ["orderitem_id", "archived_at", "order_id", "user_id", "product_id", "product_size", "total_cart_products", "product_total"],
+        select(
+            OrderItem.orderitem_id, archived_at, OrderItem.order_id, OrderItem.user_id, OrderItem.product_id,
+            OrderItem.product_size, OrderItem.total_cart_products, OrderItem.product_total,
+        )
+        .where(OrderItem.order_id.in_(order_ids)),
+    ))
+    for model in (OrderItem, Address, Payment):
+        session.execute(delete(model).where(model.order_id.in_(order_ids)))
+    return session.execute(delete(Order).where(Order.order_id.in_(order_ids))).rowcount
+
+
+def archive_finished_orders(session:Session, batch_size:int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Archive every delivered or cancelled order still in the order tables,
+    ``batch_size`` orders per transaction.
+
+    :return: The number of orders moved.
+    """
+    archived = 0
+    while True:
+        order_ids = session.exec(
+            select(Order.order_id).where(Order.order_status.in_(FINISHED_STATUSES)).order_by(Order.order_id).limit(batch_size)
+        ).all()
+        if not order_ids:
+            return archived
+        archived += archive_orders(session, order_ids)
+        session.commit()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move delivered and cancelled orders to the archive tables")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    with Session(get_engine()) as session:
+        archived = archive_finished_orders(session, args.batch_size)
+    print(f"archived {archived} orders")
+
+
+if __name__ == "__main__":
+    main()
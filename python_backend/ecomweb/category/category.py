@@ -0,0 +1,170 @@
+"""
+In-memory index of the categories and their products.
+
+Categories and their membership only change through the admin endpoints, but
+are read on every category page view. The index keeps slug -> category and
+category -> sorted product ids in the worker, so those reads need neither the
+category lookup nor the CategoryProductAssociation join.
+
+It is loaded when the worker starts, updated write-through by the services
+that change categories, and reloaded every CATEGORY_INDEX_TTL_SECONDS by a
+background task of the lifespan, so changes made through other workers show
+up too without a request ever paying for the reload.
+"""
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from typing import Callable, Iterable
+
+from sqlmodel import Session, select
+
+from ecomweb.database.database import open_session, run_db
+from ecomweb.database.telemetry import exempt_from_budget
+from ecomweb.model.model import Category, CategoryProductAssociation
+
+logger = logging.getLogger(__name__)
+
+# Reloads that lost the race against a write-through are retried this often
+# before giving up until the next period.
+RELOAD_ATTEMPTS = 3
+
+
+class CategoryIndex:
+    """
+    slug -> category and category id -> sorted product ids.
+
+    Shared by the request threads of a worker, so every operation takes a lock.
+    """
+
+    def __init__(self, ttl:float):
+        self.ttl = ttl
+        self.built_at:float | None = None
+        # Bumped by every write-through, so a reload that started before one
+        # can tell its snapshot misses it.
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._by_slug:dict[str, Category] = {}
+        self._products:dict[int, list[int]] = {}
+
+    @property
+    def is_built(self) -> bool:
+        return self.built_at is not None
+
+    def build(self, categories:Iterable[Category], associations:Iterable[tuple[int, int]], generation:int | None = None) -> bool:
+        """
+        Replace the index with ``categories`` and their (category_id, product_id) pairs.
+
+        With ``generation``, the generation the index was at when they were
+        read, nothing is replaced if a write-through happened since.
+
+        :return: Whether the index was replaced.
+        """
+        by_slug = {}
+        products:dict[int, list[int]] = {}
+        for category in categories:
+            by_slug[category.category_slug] = category
+            products[category.category_id] = []
+        for category_id, product_id in associations:
+            products.setdefault(category_id, []).append(product_id)
+        for product_ids in products.values():
+            product_ids.sort()
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._by_slug = by_slug
+            self._products = products
+            self.built_at = time.monotonic()
+            return True
+
+    def reload(self, load:Callable[[], tuple[Iterable[Category], Iterable[tuple[int, int]]]], only_if_unbuilt:bool = False) -> None:
+        """
+        Rebuild the index from ``load()``. Concurrent callers wait for the one
+        rebuild instead of each running their own.
+        """
+        with self._build_lock:
+            if only_if_unbuilt and self.is_built:
+                return
+            for _ in range(RELOAD_ATTEMPTS):
+                with self._lock:
+                    generation = self.generation
+                if self.build(*load(), generation=generation):
+                    return
+            logger.warning("Category index reload kept racing with writes, keeping the current index")
+
+    def add_category(self, category:Category) -> None:
+        with self._lock:
+            self.generation += 1
+            self._by_slug[category.category_slug] = category
+            self._products.setdefault(category.category_id, [])
+
+    def add_product(self, category_id:int, product_id:int) -> None:
+        with self._lock:
+            self.generation += 1
+            product_ids = self._products.setdefault(category_id, [])
+            position = bisect.bisect_left(product_ids, product_id)
+            if position == len(product_ids) or product_ids[position] != product_id:
+                product_ids.insert(position, product_id)
+
+    def get_by_slug(self, slug:str) -> Category | None:
+        with self._lock:
+            return self._by_slug.get(slug)
+
+    def product_ids(self, category_id:int, after:int | None = None, limit:int | None = None) -> list[int]:
+        """
+        Return the ids of the products in a category in ascending order,
+        optionally only those above ``after`` and at most ``limit`` of them.
+        """
+        with self._lock:
+            product_ids = self._products.get(category_id, [])
+            start = bisect.bisect_right(product_ids, after) if after is not None else 0
+            end = start + limit if limit is not None else len(product_ids)
+            return product_ids[start:end]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "categories": len(self._by_slug),
+                "memberships": sum(len(product_ids) for product_ids in self._products.values()),
+                "age_seconds": round(time.monotonic() - self.built_at, 3) if self.built_at is not None else None,
+            }
+
+
+def load_category_index(session:Session, index:CategoryIndex, only_if_unbuilt:bool = False) -> None:
+    """
+    Rebuild ``index`` from the database.
+    """
+    def load():
+        categories = session.exec(select(Category)).all()
+        # The index outlives the session; detach what it keeps.
+        for category in categories:
+            session.expunge(category)
+        associations = session.exec(select(CategoryProductAssociation.category_id, CategoryProductAssociation.product_id)).all()
+        return categories, associations
+
+    index.reload(load, only_if_unbuilt)
+
+
+def refresh_category_index(session:Session, index:CategoryIndex) -> None:
+    """
+    Build ``index`` if it was never built, e.g. when the app runs without its
+    lifespan. Requests call this; reloading is left to reload_periodically.
+    """
+    if not index.is_built:
+        with exempt_from_budget():
+            load_category_index(session, index, only_if_unbuilt=True)
+
+
+async def reload_periodically(index:CategoryIndex) -> None:
+    """
+    Reload ``index`` every ``index.ttl`` seconds. Runs as a task of the lifespan.
+    """
+    while True:
+        await asyncio.sleep(index.ttl)
+        try:
+            async with open_session() as session:
+                await run_db(session, load_category_index, index)
+        except Exception:
+            logger.exception("Could not reload the category index")
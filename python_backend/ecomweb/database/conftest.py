@@ -0,0 +1,104 @@
+"""
+Shared setup of the tests in this directory: one throwaway SQLite database
+and one app for the whole session, with QUERY_CHECK=error so every test
+also holds the routes to their query budgets.
+
+Tests that share the database pick usernames of their own. Run from
+python_backend/, after ``pip install -r requirements-dev.txt``::
+
+    python -m pytest
+"""
+import os
+import tempfile
+from typing import Callable
+
+# The settings are read on import, so they go before anything from ecomweb.
+workdir = tempfile.mkdtemp(prefix="ecomweb-test-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'test.db')}",
+    "SECRET_KEY": "test-secret",
+    "ALGORITHM": "HS256",
+    "ACCESS_TOKEN_EXPIRE_MINUTES": "30",
+    "REFRESH_TOKEN_EXPIRE_MINUTES": "600",
+    "BCRYPT_ROUNDS": "4",
+    "IMAGE_STORE_PATH": os.path.join(workdir, "images"),
+    "DB_SCHEMA_CHECK": "off",
+    "QUERY_CHECK": "error",
+})
+
+import pytest  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+from ecomweb.database.database import create_all_tables  # noqa: E402
+from ecomweb.main import app  # noqa: E402
+
+CHECKOUT = {
+    "order_data": {"customer_name": "Test", "customer_email": "test@test.test", "customer_phoneno": "03001234567", "order_status": "pending"},
+    "address_data": {"street_address": "1 Test Street", "city": "Karachi", "country": "Pakistan"},
+    "payment_data": {"payment_method": "cash on delivery"},
+}
+
+
+@pytest.fixture(scope="session")
+def client() -> TestClient:
+    create_all_tables()
+    return TestClient(app)
+
+
+@pytest.fixture(scope="session")
+def signup(client:TestClient) -> Callable[..., dict]:
+    """
+    Sign up and log in a user; returns its Authorization header.
+    """
+    def signup_user(username:str, role:str = "user") -> dict:
+        response = client.post("/api/signup", json={
+            "username": username, "password": "secret", "confirm_password": "secret", "role": role,
+            "firstname": "Test", "lastname": "User", "email": f"{username}@test.test",
+        })
+        assert response.status_code == 200, response.text
+        response = client.post("/api/login", data={"username": username, "password": "secret"})
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return signup_user
+
+
+@pytest.fixture(scope="session")
+def admin(signup) -> dict:
+    return signup("admin", "admin")
+
+
+@pytest.fixture(scope="session")
+def catalog(client:TestClient, admin:dict) -> dict:
+    """
+    Five products, the first three in category "shoes".
+    """
+    for number in range(5):
+        response = client.post("/addproduct", headers=admin, json={
+            "product_name": f"Shoe {number}", "product_description": "A shoe", "product_price": 100 + number,
+            "product_slug": f"shoe-{number}", "image_id": None,
+        })
+        assert response.status_code == 200, response.text
+    product_ids = [product["product_id"] for product in client.get("/api/catalog").json()["items"]]
+    response = client.post("/createcategory", headers=admin,
+                           json={"category_name": "Shoes", "category_description": "Shoes", "category_slug": "shoes"})
+    assert response.status_code == 200, response.text
+    category_id = client.get("/api/getcategory", params={"category_slug": "shoes"}).json()["category_id"]
+    for product_id in product_ids[:3]:
+        response = client.post("/productcategoryassociation", headers=admin, json={"category_id": category_id, "product_id": product_id})
+        assert response.status_code == 200, response.text
+    return {"product_ids": product_ids, "category_id": category_id}
+
+
+@pytest.fixture(scope="session")
+def place_order(client:TestClient, catalog:dict) -> Callable[..., dict]:
+    """
+    Put a product in the cart of a user and check out; returns the order.
+    """
+    def place(headers:dict, product_id:int | None = None) -> dict:
+        response = client.post("/api/addtocart", params={"product_id": product_id or catalog["product_ids"][0]}, headers=headers,
+                               json={"total_cart_products": 1, "product_total": 100, "product_size": "medium"})
+        assert response.status_code == 200, response.text
+        response = client.post("/api/createorder", json=CHECKOUT, headers=headers)
+        assert response.status_code == 200, response.text
+        return response.json()
+    return place
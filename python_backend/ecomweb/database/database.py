@@ -1,24 +1,194 @@
-import os 
-from dotenv import find_dotenv,load_dotenv
-from ecomweb.model.model import *
+import logging
+import threading
+from contextlib import asynccontextmanager
+import ecomweb.model.model  # noqa: F401  registers every table on SQLModel.metadata
 from sqlmodel import create_engine,Session,SQLModel
-from ecomweb.settings.setting import DATABASE_URL
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import inspect,text
+from sqlalchemy.engine import Connection,Engine,make_url
+from sqlalchemy.ext.asyncio import AsyncEngine,create_async_engine
+from starlette.concurrency import run_in_threadpool
+from typing import Any,Callable,TypeVar
+from ecomweb.settings.setting import (DATABASE_URL,ASYNC_DATABASE,ASYNC_DATABASE_URL,DB_ECHO,DB_POOL_SIZE,DB_MAX_OVERFLOW,
+                                     DB_POOL_TIMEOUT,DB_POOL_RECYCLE,DB_POOL_PRE_PING,DB_SSLMODE,DB_SCHEMA_CHECK,SLOW_QUERY_SECONDS)
+from ecomweb.database.telemetry import InstrumentedQueuePool,InstrumentedAsyncQueuePool,instrument_queries
+from ecomweb.database.slowquery import record_slow_queries
 
-conn_str = str(DATABASE_URL)
-engine = create_engine(conn_str,echo=True,pool_recycle=300, connect_args={"sslmode": "require"})
+T = TypeVar("T")
 
+logger = logging.getLogger(__name__)
 
-def get_session():
-    with Session(engine) as session:
-        yield session 
+# The alembic head this code is written against; bump it with every new revision.
+SCHEMA_REVISION = "0008"
+
+# Async drivers used when ASYNC_DATABASE is on and no ASYNC_DATABASE_URL is given.
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+def async_database_url(url:str) -> str:
+    """
+    Swap the sync driver of a database url for its async counterpart.
+    """
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise RuntimeError(f"No async driver configured for {backend!r} databases")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+def engine_options(url:str) -> dict:
+    """
+    Keyword arguments for create_engine/create_async_engine built from the DB_* settings.
+    """
+    url = make_url(url)
+    is_async = url.get_dialect().is_async
+    options = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING, "pool_recycle": DB_POOL_RECYCLE}
+    if url.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if url.database in (None, "", ":memory:"):
+            # In-memory databases live in a single connection; leave SQLAlchemy's pool alone.
+            return options
+    elif DB_SSLMODE:
+        if url.get_driver_name() == "asyncpg":
+            options["connect_args"] = {"ssl": DB_SSLMODE}
+        else:
+            options["connect_args"] = {"sslmode": DB_SSLMODE}
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+    )
+    return options
+
+# Engines are created on first use, so importing the app never touches the database.
+_engine:Engine | None = None
+_async_engine:AsyncEngine | None = None
+_engine_lock = threading.Lock()
+
+def get_engine() -> Engine:
+    """
+    Return the sync engine, creating it on first use.
+    """
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                conn_str = str(DATABASE_URL)
+                _engine = create_engine(conn_str,**engine_options(conn_str))
+                instrument_queries(_engine)
+                if SLOW_QUERY_SECONDS > 0:
+                    record_slow_queries(_engine)
+    return _engine
+
+def get_async_engine() -> AsyncEngine | None:
+    """
+    Return the async engine, creating it on first use, or None when ASYNC_DATABASE is off.
+    """
+    global _async_engine
+    if ASYNC_DATABASE and _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                async_conn_str = str(ASYNC_DATABASE_URL) if ASYNC_DATABASE_URL else async_database_url(str(DATABASE_URL))
+                _async_engine = create_async_engine(async_conn_str,**engine_options(async_conn_str))
+                instrument_queries(_async_engine.sync_engine)
+                if SLOW_QUERY_SECONDS > 0:
+                    record_slow_queries(_async_engine.sync_engine)
+    return _async_engine
+
+async def dispose_engines() -> None:
+    """
+    Close the pooled connections of every engine created so far.
+    """
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
+
+AnySession = Session | AsyncSession
+
+def get_sync_session():
+    with Session(get_engine()) as session:
+        yield session
+
+async def get_async_session():
+    # Objects outlive the greenlet that loaded them, so they must not expire on commit.
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
+
+get_session = get_async_session if ASYNC_DATABASE else get_sync_session
+
+@asynccontextmanager
+async def open_session():
+    """
+    Open a session of the configured kind outside of a request, e.g. for
+    startup tasks; use it with run_db like a request session.
+    """
+    if ASYNC_DATABASE:
+        async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+            yield session
+    else:
+        with Session(get_engine()) as session:
+            yield session
+
+async def run_db(session:AnySession, fn:Callable[..., T], *args:Any, **kwargs:Any) -> T:
+    """
+    Run a sync service function against either kind of session.
+
+    With an AsyncSession the function runs on the event loop through
+    run_sync, so waiting on the database never occupies a thread; with a
+    sync Session it is sent to the threadpool as the sync routes used to be.
+    """
+    if isinstance(session, AsyncSession):
+        return await session.run_sync(lambda sync_session: fn(sync_session, *args, **kwargs))
+    return await run_in_threadpool(fn, session, *args, **kwargs)
+
+def schema_revision(connection:Connection) -> str | None:
+    """
+    Return the alembic revision the database is at, or None if it was never migrated.
+
+    Reads alembic_version directly; importing alembic itself would cost more
+    than the rest of the startup.
+    """
+    if not inspect(connection).has_table("alembic_version"):
+        return None
+    return connection.execute(text("SELECT version_num FROM alembic_version")).scalar()
+
+async def check_schema_version() -> None:
+    """
+    Make sure the database was migrated to SCHEMA_REVISION.
+
+    Depending on DB_SCHEMA_CHECK a mismatch raises ("error"), is logged
+    ("warn", e.g. while a rolling deploy runs old and new code side by side)
+    or the check is skipped ("off").
+    """
+    if DB_SCHEMA_CHECK == "off":
+        return
+    async_engine = get_async_engine()
+    if async_engine is not None:
+        async with async_engine.connect() as connection:
+            revision = await connection.run_sync(schema_revision)
+    else:
+        with get_engine().connect() as connection:
+            revision = schema_revision(connection)
+    if revision == SCHEMA_REVISION:
+        return
+    message = f"Database schema is at revision {revision}, this code expects {SCHEMA_REVISION}; run `alembic upgrade head`."
+    if revision is None:
+        message += " A database created before migrations existed needs `alembic stamp 0001` first."
+    if DB_SCHEMA_CHECK == "warn":
+        logger.warning(message)
+        return
+    raise RuntimeError(message)
 
 def create_all_tables():
-    SQLModel.metadata.create_all(engine)
-    
+    SQLModel.metadata.create_all(get_engine())
+
 
 
 def drop_all_tables():
-    SQLModel.metadata.drop_all(engine)
+    SQLModel.metadata.drop_all(get_engine())
     return "Tables dropped"
 
 
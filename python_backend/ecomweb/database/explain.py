@@ -0,0 +1,102 @@
+"""
+Check that the hot queries of the service layer are served by indexes.
+
+Every statement in HOT_QUERIES is built by the query builders of
+ecomweb.service.service for a lookup done per request. The check runs
+EXPLAIN on each one and fails when the plan reads a whole table::
+
+    alembic upgrade head
+    python -m ecomweb.database.explain
+
+test_explain.py runs the same check on the test database.
+
+On PostgreSQL sequential scans are disabled for the session first, so the
+planner picks an index whenever one exists, even on the near-empty tables of
+a test database; a "Seq Scan" left in the plan means no usable index exists.
+SQLite reports a full table read as "SCAN <table>" without a USING clause.
+"""
+import re
+import sys
+from typing import Callable
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.sql import Executable
+
+from ecomweb.model.model import CatalogSort, OrderItemArchive, Size, User
+from ecomweb.service import service
+
+# The user the per-user queries are built for.
+USER = User(user_id=1, username="username")
+
+# Query name -> statement, built by the service query builders so the
+# check follows the queries the routes actually run.
+HOT_QUERIES:dict[str, Callable[[], Executable]] = {
+    "get_user_by_username": lambda: service.select_user_by_username("username"),
+    "get_catalog_after": lambda: service.select_catalog_page(20, CatalogSort.ID, last_id=1),
+    "get_catalog_by_price": lambda: service.select_catalog_page(20, CatalogSort.PRICE_ASC, last_id=1, last_price=100),
+    "get_catalog_by_price_desc": lambda: service.select_catalog_page(20, CatalogSort.PRICE_DESC, last_id=1, last_price=100),
+    "get_catalog_in_price_range": lambda: service.select_catalog_page(20, CatalogSort.PRICE_ASC, min_price=100, max_price=200),
+    "get_catalog_of_products": lambda: service.select_catalog_page(20, product_ids=[1, 2, 3]),
+    "get_catalog_of_category_by_price": lambda: service.select_catalog_page(20, CatalogSort.PRICE_ASC, last_id=1, last_price=100, category_id=1),
+    "get_catalog_of_category_in_price_range": lambda: service.select_catalog_page(20, min_price=100, max_price=200, category_id=1),
+    "add_to_cart": lambda: service.select_cart_line(USER, 1, Size.SMALL),
+    "get_product_from_cart": lambda: service.select_cart_products(USER),
+    "get_cart_summary": lambda: service.select_cart_summary(USER),
+    "get_order_by_id": lambda: service.select_order(USER, 1),
+    "get_order_history": lambda: service.select_order_history(USER, before=100).limit(21),
+    "get_archived_order_history": lambda: service.select_archived_order_history(USER, before=100).limit(21),
+    "get_order_detail": lambda: service.select_order_detail(USER, 1),
+    "get_archived_order_detail": lambda: service.select_archived_order(USER, 1),
+    "get_orderitem": lambda: service.select_orderitem_products(USER, 1),
+    "get_archived_orderitem": lambda: service.select_orderitem_products(USER, 1, OrderItemArchive),
+    "get_image_by_hash": lambda: service.select_image_by_hash("hash"),
+}
+
+SQLITE_FULL_SCAN = re.compile(r"\bSCAN (?!.*\bUSING\b)")
+
+
+def explain(connection:Connection, statement:Executable) -> list[str]:
+    """
+    Return the plan of ``statement`` as one line per plan node.
+    """
+    compiled = statement.compile(dialect=connection.dialect, compile_kwargs={"literal_binds": True})
+    if connection.dialect.name == "sqlite":
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql(f"EXPLAIN {compiled}").all()
+    return [row[0] for row in rows]
+
+
+def is_sequential_scan(dialect_name:str, plan:list[str]) -> bool:
+    if dialect_name == "sqlite":
+        return any(SQLITE_FULL_SCAN.search(line) for line in plan)
+    return any("Seq Scan" in line for line in plan)
+
+
+def check_hot_queries(connection:Connection) -> dict[str, list[str]]:
+    """
+    Explain every hot query and return the plans that fall back to a
+    sequential scan, keyed by query name.
+    """
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    failures = {}
+    for name, build in HOT_QUERIES.items():
+        plan = explain(connection, build())
+        if is_sequential_scan(connection.dialect.name, plan):
+            failures[name] = plan
+    return failures
+
+
+if __name__ == "__main__":
+    from ecomweb.database.database import get_engine
+
+    with get_engine().begin() as connection:
+        failures = check_hot_queries(connection)
+    for name, plan in failures.items():
+        print(f"{name} falls back to a sequential scan:")
+        for line in plan:
+            print(f"    {line}")
+    if failures:
+        sys.exit(1)
+    print(f"All {len(HOT_QUERIES)} hot queries use an index.")
@@ -0,0 +1,83 @@
+"""
+Checks on the queries a request runs, for development and the test suite.
+
+With QUERY_CHECK set to "warn" or "error", every request records the
+statements it runs (see ecomweb.database.telemetry). Once the request has
+been handled, it is checked for:
+
+- the same statement run QUERY_REPEAT_THRESHOLD times or more, which is a
+  query in a loop (N+1);
+- more queries than the budget its route declares with query_budget().
+
+Queries run under ecomweb.database.telemetry.exempt_from_budget(), i.e.
+filling the worker caches, are left out of both.
+
+Problems are logged and kept in ``violations``. With "error" the request
+fails too: MetricsMiddleware answers 500 instead of the route's response.
+With "off", the default, nothing beyond the query count of the metrics is
+recorded.
+"""
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+from ecomweb.database.telemetry import QueryStats, current_query_stats
+from ecomweb.settings.setting import QUERY_CHECK, QUERY_REPEAT_THRESHOLD
+
+logger = logging.getLogger(__name__)
+
+TRACK_STATEMENTS = QUERY_CHECK != "off"
+FAIL_REQUESTS = QUERY_CHECK == "error"
+
+# The messages of the last requests with problems, newest last.
+violations:deque[str] = deque(maxlen=100)
+
+
+class QueryCheckError(Exception):
+    pass
+
+
+def query_budget(limit:int) -> Callable[[], Awaitable[None]]:
+    """
+    A route dependency declaring that a request to the route runs at most
+    ``limit`` queries::
+
+        @router.get("/api/orders", dependencies=[Depends(query_budget(2))])
+
+    Queries of the dependencies count too, except those filling a cache,
+    e.g. loading the current user into the principal cache.
+    """
+    async def declare_query_budget() -> None:
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.budget = limit
+    return declare_query_budget
+
+
+def query_problems(stats:QueryStats, repeat_threshold:int = QUERY_REPEAT_THRESHOLD) -> list[str]:
+    problems = []
+    counted = stats.queries - stats.exempt
+    if stats.budget is not None and counted > stats.budget:
+        problems.append(f"{counted} queries, over the budget of {stats.budget}")
+    for statement, count in (stats.statements or {}).items():
+        if count >= repeat_threshold:
+            problems.append(f"{count} x {' '.join(statement.split())}")
+    return problems
+
+
+def check_queries(stats:QueryStats, route:str) -> str | None:
+    """
+    Log and record the query problems of a handled request.
+
+    :return: The message describing the problems, None if there are none
+        or QUERY_CHECK is "off". Failing the request is up to the caller.
+    """
+    if QUERY_CHECK == "off":
+        return None
+    problems = query_problems(stats)
+    if not problems:
+        return None
+    message = f"Queries of {route}: " + "; ".join(problems)
+    violations.append(message)
+    logger.warning(message)
+    return message
@@ -0,0 +1,141 @@
+"""
+Slow-query log.
+
+Opt-in with SLOW_QUERY_SECONDS: every query that takes longer is logged and
+kept, newest last, in a ring buffer of the last SLOW_QUERY_LOG_SIZE slow
+queries that /internal/slow-queries dumps. Each entry holds the statement,
+the shape of its parameters (their types, never their values), the duration
+and the ecomweb function that ran it, e.g. a service of
+ecomweb.service.service.
+
+On PostgreSQL a fraction SLOW_QUERY_EXPLAIN_RATE of the slow SELECTs is run
+again under EXPLAIN (ANALYZE, BUFFERS) and the plan kept with the entry.
+The EXPLAIN runs on the same connection, in a savepoint so a failure cannot
+abort the caller's transaction, and delays the request by about the time
+of the query; other statements are never explained, since ANALYZE executes
+them.
+"""
+import logging
+import random
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.engine import Connection, Engine
+
+from ecomweb.settings.setting import SLOW_QUERY_EXPLAIN_RATE, SLOW_QUERY_LOG_SIZE, SLOW_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class SlowQueryLog:
+    """
+    The last ``size`` slow queries.
+    """
+
+    def __init__(self, size:int):
+        self._entries:deque[dict] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, entry:dict) -> None:
+        with self._lock:
+            self._entries.append(entry)
+
+    def snapshot(self) -> list[dict]:
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_LOG_SIZE)
+
+
+def parameters_shape(parameters, executemany:bool) -> str:
+    """
+    The types of the parameters of a statement, e.g. ``{product_id: int}``
+    or ``500 x (int, str)`` for an executemany.
+    """
+    if executemany:
+        return f"{len(parameters)} x {parameters_shape(parameters[0], False)}" if parameters else "[]"
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{name}: {type(value).__name__}" for name, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+def calling_function() -> str | None:
+    """
+    The innermost ecomweb function on the stack outside ecomweb.database.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("ecomweb.") and not module.startswith("ecomweb.database."):
+            return f"{module}.{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return None
+
+
+def explain(connection:Connection, statement:str, parameters) -> str:
+    """
+    EXPLAIN (ANALYZE, BUFFERS) ``statement`` on a new DBAPI cursor of
+    ``connection``, inside a savepoint.
+    """
+    explain_cursor = connection.connection.cursor()
+    try:
+        explain_cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            explain_cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", parameters)
+            plan = "\n".join(row[0] for row in explain_cursor.fetchall())
+        except Exception as error:
+            explain_cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            plan = f"EXPLAIN failed: {error}"
+        explain_cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    finally:
+        explain_cursor.close()
+
+
+def record_slow_queries(engine:Engine, log:SlowQueryLog = slow_query_log, threshold:float = SLOW_QUERY_SECONDS,
+                        explain_rate:float = SLOW_QUERY_EXPLAIN_RATE) -> None:
+    """
+    Record the queries run on ``engine`` that take longer than ``threshold``
+    seconds into ``log``.
+    """
+    explains = engine.dialect.name == "postgresql" and explain_rate > 0
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        connection.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - connection.info["slow_query_start"].pop()
+        if seconds < threshold:
+            return
+        entry = {
+            "recorded_at": datetime.now().isoformat(),
+            "seconds": round(seconds, 6),
+            "statement": statement,
+            "parameters": parameters_shape(parameters, executemany),
+            "caller": calling_function(),
+            "explain": None,
+        }
+        if (explains and not executemany and statement.lstrip()[:6].upper() == "SELECT"
+                and random.random() < explain_rate):
+            entry["explain"] = explain(connection, statement, parameters)
+        log.add(entry)
+        logger.warning("Slow query, %.1f ms in %s: %s", seconds * 1000, entry["caller"], " ".join(statement.split()))
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # A failed statement never reaches after_cursor_execute.
+        if context.connection is not None and context.connection.info.get("slow_query_start"):
+            context.connection.info["slow_query_start"].pop()
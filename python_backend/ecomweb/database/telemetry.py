@@ -0,0 +1,199 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, Pool, QueuePool
+
+
+class PoolStats:
+    """
+    Counters of one connection pool, updated from pool events.
+
+    Wait time is the time spent inside the pool getting a connection, which
+    only grows above a few microseconds when the pool is exhausted and
+    requests queue for a connection.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.overflow_checkouts = 0
+        self.invalidations = 0
+        self.soft_invalidations = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds:float) -> None:
+        with self._lock:
+            self.wait_seconds_total += seconds
+            if seconds > self.wait_seconds_max:
+                self.wait_seconds_max = seconds
+
+    def increment(self, counter:str) -> None:
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self, pool:Pool) -> dict:
+        with self._lock:
+            stats = {
+                "pool": pool.status(),
+                "connects": self.connects,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "overflow_checkouts": self.overflow_checkouts,
+                "invalidations": self.invalidations,
+                "soft_invalidations": self.soft_invalidations,
+                "timeouts": self.timeouts,
+                "wait_ms_total": round(self.wait_seconds_total * 1000, 3),
+                "wait_ms_avg": round(self.wait_seconds_total * 1000 / self.checkouts, 3) if self.checkouts else 0.0,
+                "wait_ms_max": round(self.wait_seconds_max * 1000, 3),
+            }
+        if isinstance(pool, QueuePool):
+            stats.update(size=pool.size(), checked_in=pool.checkedin(), checked_out=pool.checkedout(), overflow=pool.overflow())
+        return stats
+
+
+class InstrumentedPoolMixin:
+    """
+    Times every connection request made to the pool.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # recreate() hands the listeners of the old pool to the new one.
+        inherited = kwargs.get("_dispatch") is not None
+        super().__init__(*args, **kwargs)
+        if not inherited:
+            self.stats = PoolStats()
+            self._listen(self.stats)
+
+    def _listen(self, stats:PoolStats) -> None:
+        @event.listens_for(self, "connect")
+        def on_connect(dbapi_connection, connection_record):
+            stats.increment("connects")
+
+        @event.listens_for(self, "checkout")
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            stats.increment("checkouts")
+
+        @event.listens_for(self, "checkin")
+        def on_checkin(dbapi_connection, connection_record):
+            stats.increment("checkins")
+
+        @event.listens_for(self, "invalidate")
+        def on_invalidate(dbapi_connection, connection_record, exception):
+            stats.increment("invalidations")
+
+        @event.listens_for(self, "soft_invalidate")
+        def on_soft_invalidate(dbapi_connection, connection_record, exception):
+            stats.increment("soft_invalidations")
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.increment("timeouts")
+            raise
+        finally:
+            self.stats.record_wait(time.perf_counter() - start)
+        if self.overflow() > 0:
+            self.stats.increment("overflow_checkouts")
+        return connection
+
+    def recreate(self):
+        # engine.dispose() swaps in a fresh pool; keep counting into the same stats.
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class InstrumentedQueuePool(InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_stats(pool:Pool) -> dict | None:
+    """
+    Return the counters of an instrumented pool, or None for other pools.
+    """
+    stats = getattr(pool, "stats", None)
+    return stats.snapshot(pool) if stats is not None else None
+
+
+class QueryStats:
+    """
+    Number of queries and time spent in them during one request; with
+    ``track_statements``, also how often each statement ran.
+    """
+
+    __slots__ = ("queries", "seconds", "exempt", "statements", "budget")
+
+    def __init__(self, track_statements:bool = False):
+        self.queries = 0
+        self.seconds = 0.0
+        # Of queries, those run under exempt_from_budget().
+        self.exempt = 0
+        self.statements:dict[str, int] | None = {} if track_statements else None
+        # Most queries the route declared it runs, see ecomweb.database.querycheck.
+        self.budget:int | None = None
+
+
+# Stats of the request being handled. Set by the metrics middleware; the
+# threadpool and run_sync both run the services in a copy of the request's
+# context, so their queries are counted against it.
+current_query_stats:ContextVar[QueryStats | None] = ContextVar("current_query_stats", default=None)
+
+_budget_exempt:ContextVar[bool] = ContextVar("budget_exempt", default=False)
+
+
+@contextmanager
+def exempt_from_budget() -> Iterator[None]:
+    """
+    Run the enclosed queries outside the request's query budget and repeat
+    detection. For filling worker caches (the principal cache, the category
+    and search indexes), whose cost depends on cache age, not on the route,
+    and for reads that repeat per chunk by design, such as the order export.
+    They still count in the metrics.
+    """
+    token = _budget_exempt.set(True)
+    try:
+        yield
+    finally:
+        _budget_exempt.reset(token)
+
+
+def instrument_queries(engine:Engine) -> None:
+    """
+    Count the queries run on ``engine`` and their time into current_query_stats.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        if current_query_stats.get() is not None:
+            connection.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.seconds += time.perf_counter() - connection.info["query_start"].pop()
+            if _budget_exempt.get():
+                stats.exempt += 1
+            elif stats.statements is not None:
+                stats.statements[statement] = stats.statements.get(statement, 0) + 1
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        # A failed statement never reaches after_cursor_execute.
+        if context.connection is not None and context.connection.info.get("query_start"):
+            context.connection.info["query_start"].pop()
@@ -0,0 +1,75 @@
+"""
+Delivered and cancelled orders move to the archive tables, and the order
+history and detail read them from there.
+"""
+from fastapi.testclient import TestClient
+from sqlmodel import Session, select
+
+from ecomweb.archive.archive import archive_finished_orders
+from ecomweb.database.conftest import CHECKOUT
+from ecomweb.database.database import get_engine
+from ecomweb.model.model import Address, Order, OrderArchive, OrderItem, OrderItemArchive, OrderStatus, Payment
+
+
+def ok(response) -> dict | list:
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def place_two_item_order(client:TestClient, headers:dict, catalog:dict) -> dict:
+    for product_id, quantity in zip(catalog["product_ids"][:2], (1, 2)):
+        ok(client.post("/api/addtocart", params={"product_id": product_id}, headers=headers,
+                       json={"total_cart_products": quantity, "product_total": 100 * quantity, "product_size": "medium"}))
+    return ok(client.post("/api/createorder", json=CHECKOUT, headers=headers))
+
+
+def live_rows(session:Session, order_id:int) -> list:
+    return [row for model in (Order, OrderItem, Address, Payment)
+            for row in session.exec(select(model).where(model.order_id == order_id)).all()]
+
+
+def test_finished_order_moves_to_the_archive(client:TestClient, signup, catalog:dict):
+    headers = signup("archiver")
+    order_id = place_two_item_order(client, headers, catalog)["order_id"]
+    detail = ok(client.get("/api/order-detail", params={"order_id": order_id}, headers=headers))
+
+    ok(client.patch("/updateorder", params={"order_id": order_id}, json={"order_status": "delivered"}, headers=headers))
+
+    with Session(get_engine()) as session:
+        assert live_rows(session, order_id) == []
+        archived = session.exec(select(OrderArchive).where(OrderArchive.order_id == order_id)).one()
+        items = session.exec(select(OrderItemArchive).where(OrderItemArchive.order_id == order_id).order_by(OrderItemArchive.orderitem_id)).all()
+    assert archived.order_status == OrderStatus.DELIVERED
+    assert (archived.item_count, archived.order_total) == (2, sum(item["product_total"] for item in detail["items"]))
+    assert (archived.address_id, archived.city) == (detail["address"]["address_id"], "Karachi")
+    assert (archived.payment_id, archived.payment_method) == (detail["payment"]["payment_id"], "cash on delivery")
+    assert [(item.orderitem_id, item.product_id, item.total_cart_products, item.product_total) for item in items] == [
+        (item["orderitem_id"], item["product_id"], item["total_cart_products"], item["product_total"]) for item in detail["items"]
+    ]
+
+    assert ok(client.get("/api/order-detail", params={"order_id": order_id}, headers=headers)) == {**detail, "order_status": "delivered"}
+    history = ok(client.get("/api/orders", headers=headers))["items"]
+    assert [(order["order_id"], order["order_status"], order["item_count"], order["order_total"]) for order in history] == [
+        (order_id, "delivered", 2, archived.order_total)
+    ]
+
+
+def test_archive_finished_orders(client:TestClient, signup, catalog:dict, place_order):
+    headers = signup("archive-batch")
+    kept, cancelled = place_order(headers)["order_id"], place_order(headers)["order_id"]
+    with Session(get_engine()) as session:
+        # Changed outside the API, so nothing archived it yet.
+        order = session.get(Order, cancelled)
+        order.order_status = OrderStatus.CANCELLED
+        session.add(order)
+        session.commit()
+        assert archive_finished_orders(session, batch_size=1) >= 1
+        assert live_rows(session, cancelled) == []
+        assert session.exec(select(OrderArchive.order_status).where(OrderArchive.order_id == cancelled)).one() == OrderStatus.CANCELLED
+        assert session.get(Order, kept) is not None
+
+    # The archived order was the newest one; its id is not handed out again.
+    placed = place_order(headers)["order_id"]
+    assert placed > cancelled
+    history = ok(client.get("/api/orders", headers=headers))["items"]
+    assert [(order["order_id"], order["order_status"]) for order in history] == [(placed, "pending"), (cancelled, "cancelled"), (kept, "pending")]
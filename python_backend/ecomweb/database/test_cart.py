@@ -0,0 +1,29 @@
+"""
+A cart line can only be read, changed or removed by the user it belongs to.
+"""
+from fastapi.testclient import TestClient
+
+
+def test_cart_line_of_another_user_is_missing(client:TestClient, signup, catalog:dict):
+    owner = signup("cart-owner")
+    other = signup("cart-other")
+    response = client.post("/api/addtocart", params={"product_id": catalog["product_ids"][0]}, headers=owner,
+                           json={"total_cart_products": 1, "product_total": 100, "product_size": "medium"})
+    assert response.status_code == 200, response.text
+    cart_id = response.json()["cart_id"]
+
+    response = client.put("/api/update", headers=other, params={"cart_id": cart_id, "type": "add", "product_price": 100})
+    assert response.status_code == 404
+    response = client.delete("/api/delete-cart", headers=other, params={"cart_id": cart_id})
+    assert response.status_code == 404
+
+    cart = client.get("/api/get-product-from-cart", headers=owner).json()
+    assert [(line["cart_id"], line["total_cart_products"]) for line in cart] == [(cart_id, 1)]
+    assert client.get("/api/get-product-from-cart", headers=other).json() == []
+
+
+def test_missing_cart_line(client:TestClient, signup):
+    headers = signup("cart-missing")
+    response = client.delete("/api/delete-cart", headers=headers, params={"cart_id": 999999})
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Cart is missing"}
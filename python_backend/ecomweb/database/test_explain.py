@@ -0,0 +1,20 @@
+"""
+The hot queries of the service layer are served by indexes (see explain.py).
+"""
+from fastapi.testclient import TestClient
+from sqlmodel import select
+
+from ecomweb.database import explain
+from ecomweb.database.database import get_engine
+from ecomweb.model.model import Product
+
+
+def test_hot_queries_use_an_index(client:TestClient):
+    with get_engine().begin() as connection:
+        assert explain.check_hot_queries(connection) == {}
+
+
+def test_full_table_read_is_reported(client:TestClient):
+    with get_engine().begin() as connection:
+        plan = explain.explain(connection, select(Product).where(Product.product_description == "A shoe"))
+        assert explain.is_sequential_scan(connection.dialect.name, plan)
@@ -0,0 +1,45 @@
+"""
+The order export covers archived orders along with the live ones.
+"""
+import csv
+import io
+import json
+
+from fastapi.testclient import TestClient
+
+from ecomweb.database.database import get_engine
+from ecomweb.export import export
+from ecomweb.model.model import ExportFormat
+
+
+def exported_orders(client:TestClient, admin:dict, user_id:int, **params) -> list[dict]:
+    response = client.get("/internal/orders/export", headers=admin, params=params)
+    assert response.status_code == 200, response.text
+    orders = [json.loads(line) for line in response.text.splitlines()]
+    return [order for order in orders if order["user_id"] == user_id]
+
+
+def test_export_includes_archived_orders(client:TestClient, signup, admin:dict, catalog:dict, place_order):
+    headers = signup("exporter")
+    user_id = client.get("/api/me", headers=headers).json()["user_id"]
+    first, second = catalog["product_ids"][:2]
+    orders = [place_order(headers, first), place_order(headers, second), place_order(headers, first)]
+    # Delivering an order moves it to the archive.
+    response = client.patch("/updateorder", params={"order_id": orders[1]["order_id"]}, json={"order_status": "delivered"}, headers=headers)
+    assert response.status_code == 200, response.text
+
+    exported = exported_orders(client, admin, user_id)
+    assert [order["order_id"] for order in exported] == [order["order_id"] for order in orders]
+    assert [order["order_status"] for order in exported] == ["pending", "delivered", "pending"]
+    assert [[item["product_id"] for item in order["items"]] for order in exported] == [[first], [second], [first]]
+    assert exported[1]["city"] == "Karachi" and exported[1]["payment_method"] == "cash on delivery"
+    # In chunks of two orders, chunks mix live and archived orders.
+    chunked = b"".join(export.export_orders(get_engine(), ExportFormat.NDJSON, chunk_orders=2)).decode()
+    assert [order for order in map(json.loads, chunked.splitlines()) if order["user_id"] == user_id] == exported
+
+    delivered = exported_orders(client, admin, user_id, status="delivered")
+    assert [order["order_id"] for order in delivered] == [orders[1]["order_id"]]
+
+    response = client.get("/internal/orders/export", headers=admin, params={"format": "csv", "status": "delivered"})
+    rows = [row for row in csv.DictReader(io.StringIO(response.text)) if row["user_id"] == str(user_id)]
+    assert [(row["order_id"], row["product_id"]) for row in rows] == [(str(orders[1]["order_id"]), str(second))]
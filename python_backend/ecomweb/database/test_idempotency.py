@@ -0,0 +1,83 @@
+"""
+Checkout with an Idempotency-Key: a retry replays the first response, and a
+key only ever places one order.
+"""
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+from ecomweb.database.conftest import CHECKOUT
+from ecomweb.database.database import get_engine
+from ecomweb.idempotency.idempotency import KeyState, claim_key, request_fingerprint
+from ecomweb.model.model import AddressCreate, OrderCreate, PaymentCreate
+
+
+def checkout(client:TestClient, headers:dict, key:str, body:dict = CHECKOUT):
+    return client.post("/api/createorder", json=body, headers={**headers, "Idempotency-Key": key})
+
+
+def add_to_cart(client:TestClient, headers:dict, product_id:int) -> None:
+    response = client.post("/api/addtocart", params={"product_id": product_id}, headers=headers,
+                           json={"total_cart_products": 1, "product_total": 100, "product_size": "medium"})
+    assert response.status_code == 200, response.text
+
+
+def order_count(client:TestClient, headers:dict) -> int:
+    return len(client.get("/api/orders", headers=headers).json()["items"])
+
+
+def test_retry_replays_the_stored_response(client:TestClient, signup, catalog:dict):
+    headers = signup("idem-replay")
+    add_to_cart(client, headers, catalog["product_ids"][0])
+    first = checkout(client, headers, "replay")
+    assert first.status_code == 200, first.text
+    assert "Idempotent-Replayed" not in first.headers
+
+    retry = checkout(client, headers, "replay")
+    assert retry.status_code == 200, retry.text
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+    assert order_count(client, headers) == 1
+
+
+def test_key_in_progress_is_a_conflict(client:TestClient, signup, catalog:dict):
+    headers = signup("idem-busy")
+    user_id = client.get("/api/me", headers=headers).json()["user_id"]
+    fingerprint = request_fingerprint(OrderCreate.model_validate(CHECKOUT["order_data"]),
+                                      AddressCreate.model_validate(CHECKOUT["address_data"]),
+                                      PaymentCreate.model_validate(CHECKOUT["payment_data"]))
+    # The first request has claimed the key and is still placing its order.
+    with Session(get_engine()) as session:
+        state, _ = claim_key(session, user_id, "busy", fingerprint)
+    assert state == KeyState.CLAIMED
+
+    add_to_cart(client, headers, catalog["product_ids"][0])
+    response = checkout(client, headers, "busy")
+    assert response.status_code == 409
+    assert "still being processed" in response.json()["detail"]
+    assert order_count(client, headers) == 0
+
+
+def test_key_reused_for_another_body_is_rejected(client:TestClient, signup, catalog:dict):
+    headers = signup("idem-mismatch")
+    add_to_cart(client, headers, catalog["product_ids"][0])
+    assert checkout(client, headers, "mismatch").status_code == 200
+
+    add_to_cart(client, headers, catalog["product_ids"][1])
+    other = {**CHECKOUT, "address_data": {**CHECKOUT["address_data"], "city": "Lahore"}}
+    response = checkout(client, headers, "mismatch", other)
+    assert response.status_code == 422
+    assert "different request" in response.json()["detail"]
+    assert order_count(client, headers) == 1
+
+
+def test_retry_after_a_failed_checkout_runs_again(client:TestClient, signup, catalog:dict):
+    headers = signup("idem-retry")
+    # The cart is empty, so the checkout fails and gives the key up.
+    response = checkout(client, headers, "retry")
+    assert response.status_code == 404
+
+    add_to_cart(client, headers, catalog["product_ids"][0])
+    response = checkout(client, headers, "retry")
+    assert response.status_code == 200, response.text
+    assert "Idempotent-Replayed" not in response.headers
+    assert order_count(client, headers) == 1
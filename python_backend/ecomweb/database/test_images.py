@@ -0,0 +1,38 @@
+"""
+Uploading an image records its variants within the query budget of the
+upload, and recording them again replaces them.
+"""
+import io
+
+from fastapi.testclient import TestClient
+from sqlmodel import Session, func, select
+
+from ecomweb.database.database import get_engine
+from ecomweb.model.model import ImageVariant
+from ecomweb.service.service import service_add_image_variants
+
+
+def png() -> bytes:
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new("RGB", (800, 600), "red").save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def test_upload_records_the_variants(client:TestClient, admin:dict):
+    response = client.post("/upload-file", files={"file": ("red.png", png(), "image/png")}, headers=admin)
+    assert response.status_code == 200, response.text
+    image_id = response.json()["id"]
+    assert response.json()["variants"] == ["thumbnail", "card", "full"]
+    response = client.get("/api/image", params={"image_id": image_id, "variant": "thumbnail"})
+    assert response.status_code == 200, response.text
+
+    with Session(get_engine()) as session:
+        variants = session.exec(select(ImageVariant).where(ImageVariant.image_id == image_id)).all()
+        session.expunge_all()
+        for variant in variants:
+            variant.size += 1
+        service_add_image_variants(session, variants)
+        sizes = session.exec(select(ImageVariant.size).where(ImageVariant.image_id == image_id).order_by(ImageVariant.variant)).all()
+        assert sizes == [variant.size for variant in sorted(variants, key=lambda variant: variant.variant)]
+        assert session.exec(select(func.count()).select_from(ImageVariant).where(ImageVariant.image_id == image_id)).one() == 3
@@ -0,0 +1,132 @@
+"""
+Drives the budgeted routes with QUERY_CHECK=error (see conftest.py): a route that runs more
+queries than its budget, or a query in a loop, answers 500.
+
+Run from python_backend/::
+
+    python -m pytest ecomweb/database/test_querycheck.py
+"""
+from typing import Annotated
+
+import pytest
+from fastapi import Depends
+from fastapi.testclient import TestClient
+
+from ecomweb.database import querycheck
+from ecomweb.database.conftest import CHECKOUT
+from ecomweb.database.database import AnySession, get_session, run_db
+from ecomweb.main import app
+from ecomweb.service import service
+
+
+@pytest.fixture(scope="module")
+def shopper(signup) -> dict:
+    return signup("shopper")
+
+
+@pytest.fixture(autouse=True)
+def no_violations():
+    querycheck.violations.clear()
+    yield
+    assert list(querycheck.violations) == []
+
+
+def cold_caches() -> None:
+    """
+    Forget what the worker caches hold, as in a worker that just started.
+    """
+    service.principal_cache.clear()
+    service.category_index.built_at = None
+    service.product_search_index.invalidate()
+
+
+def ok(response) -> dict | list:
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def add_to_cart(client:TestClient, headers:dict, product_id:int) -> dict:
+    return ok(client.post("/api/addtocart", params={"product_id": product_id}, headers=headers,
+                          json={"total_cart_products": 1, "product_total": 100, "product_size": "medium"}))
+
+
+@pytest.mark.parametrize("cold", [False, True])
+def test_login(client:TestClient, shopper:dict, cold:bool):
+    if cold:
+        cold_caches()
+    ok(client.post("/api/login", data={"username": "shopper", "password": "secret"}))
+    ok(client.get("/api/me", headers=shopper))
+
+
+@pytest.mark.parametrize("cold", [False, True])
+def test_catalog(client:TestClient, catalog:dict, cold:bool):
+    if cold:
+        cold_caches()
+    page = ok(client.get("/api/catalog", params={"limit": 2}))
+    ok(client.get("/api/catalog", params={"limit": 2, "cursor": page["next_cursor"]}))
+    if cold:
+        cold_caches()
+    page = ok(client.get("/api/catalog", params={"limit": 2, "category_id": catalog["category_id"]}))
+    assert [product["product_id"] for product in page["items"]] == catalog["product_ids"][:2]
+    ok(client.get("/api/catalog", params={"limit": 2, "category_id": catalog["category_id"], "cursor": page["next_cursor"]}))
+    params = {"limit": 2, "category_id": catalog["category_id"], "sort": "price_desc", "min_price": 100}
+    page = ok(client.get("/api/catalog", params=params))
+    last = ok(client.get("/api/catalog", params={**params, "cursor": page["next_cursor"]}))
+    assert [product["product_id"] for product in page["items"] + last["items"]] == catalog["product_ids"][2::-1]
+    assert last["next_cursor"] is None
+    if cold:
+        cold_caches()
+    products = ok(client.get("/api/getproductbycategory", params={"category_id": catalog["category_id"]}))
+    assert len(products) == 3
+
+
+@pytest.mark.parametrize("cold", [False, True])
+def test_search(client:TestClient, catalog:dict, cold:bool):
+    if cold:
+        cold_caches()
+    page = ok(client.get("/api/search", params={"q": "shoe", "limit": 2}))
+    assert page["items"]
+
+
+@pytest.mark.parametrize("cold", [False, True])
+def test_cart_and_checkout(client:TestClient, signup, catalog:dict, cold:bool):
+    headers = signup(f"buyer-{cold}")
+    if cold:
+        cold_caches()
+    first, second = catalog["product_ids"][:2]
+    add_to_cart(client, headers, first)
+    add_to_cart(client, headers, second)
+    # The same product again only adds to its line.
+    add_to_cart(client, headers, first)
+    cart = ok(client.get("/api/get-product-from-cart", headers=headers))
+    assert len(cart) == 2
+    ok(client.get("/api/cart-summary", headers=headers))
+    ok(client.put("/api/update", headers=headers, params={"cart_id": cart[0]["cart_id"], "type": "add", "product_price": 100}))
+    ok(client.delete("/api/delete-cart", headers=headers, params={"cart_id": cart[1]["cart_id"]}))
+
+    order = ok(client.post("/api/createorder", json=CHECKOUT, headers={**headers, "Idempotency-Key": f"checkout-{cold}"}))
+    # A retry gets the same order back.
+    retried = ok(client.post("/api/createorder", json=CHECKOUT, headers={**headers, "Idempotency-Key": f"checkout-{cold}"}))
+    assert retried["order_id"] == order["order_id"]
+    add_to_cart(client, headers, second)
+    ok(client.post("/api/createorder", json=CHECKOUT, headers=headers))
+
+    if cold:
+        cold_caches()
+    orders = ok(client.get("/api/orders", headers=headers))
+    assert len(orders["items"]) == 2
+    detail = ok(client.get("/api/order-detail", params={"order_id": order["order_id"]}, headers=headers))
+    assert detail["order_id"] == order["order_id"]
+
+
+def test_over_budget_fails_the_request(client:TestClient, shopper:dict):
+    @app.get("/test/over-budget", dependencies=[Depends(querycheck.query_budget(0))])
+    async def over_budget(session:Annotated[AnySession, Depends(get_session)]):
+        user = await run_db(session, service.get_user_by_username, "shopper")
+        return {"user_id": user.user_id}
+
+    response = client.get("/test/over-budget")
+    assert response.status_code == 500
+    assert "over the budget of 0" in response.json()["detail"]
+    assert len(querycheck.violations) == 1
+    querycheck.violations.clear()
@@ -0,0 +1,68 @@
+"""
+The in-process search index: reloads that race with write-throughs, and
+searches that never pay for a reload.
+"""
+from fastapi.testclient import TestClient
+
+from ecomweb.main import app
+from ecomweb.model.model import Product
+from ecomweb.search.search import RELOAD_ATTEMPTS, ProductSearchIndex
+from ecomweb.service import service
+
+
+def product(product_id:int, name:str) -> Product:
+    return Product(product_id=product_id, product_name=name, product_description="", product_price=1, product_slug=name.lower())
+
+
+def found(index:ProductSearchIndex, text:str) -> list[int]:
+    return [hit.product_id for hit in index.search(text, 10)]
+
+
+def test_reload_retries_after_a_racing_write():
+    index = ProductSearchIndex(60)
+    index.build([product(1, "Boot")])
+    loads = []
+
+    def load():
+        loads.append(None)
+        if len(loads) == 1:
+            # Added through the API while the snapshot was being read.
+            index.add_product(product(2, "Sandal"))
+            return [product(1, "Boot")]
+        return [product(1, "Boot"), product(2, "Sandal")]
+
+    index.reload(load)
+    assert len(loads) == 2
+    assert found(index, "sandal") == [2]
+
+
+def test_reload_keeps_the_index_when_writes_keep_racing():
+    index = ProductSearchIndex(60)
+    index.build([product(1, "Boot")])
+
+    def load():
+        index.add_product(product(2, "Sandal"))
+        return []
+
+    index.reload(load)
+    assert index.generation == RELOAD_ATTEMPTS
+    assert found(index, "boot") == [1] and found(index, "sandal") == [2]
+
+
+def test_search_does_not_reload_a_stale_index(client:TestClient, catalog:dict):
+    client.get("/api/search", params={"q": "shoe"})
+    index = service.product_search_index
+    index.built_at -= 10 * index.ttl
+    built_at = index.built_at
+    response = client.get("/api/search", params={"q": "shoe"})
+    assert response.status_code == 200, response.text
+    assert index.built_at == built_at
+
+
+def test_lifespan_loads_the_index(catalog:dict):
+    service.product_search_index.invalidate()
+    with TestClient(app) as client:
+        assert service.product_search_index.is_built
+        response = client.get("/api/search", params={"q": "shoe"})
+        assert response.status_code == 200, response.text
+        assert len(response.json()["items"]) == 5
@@ -0,0 +1,178 @@
+"""
+Streaming export of orders with their items, address and payment.
+
+The export is read in chunks of EXPORT_CHUNK_ORDERS orders, keyed on
+order_id. Each chunk is fetched in its own short transaction through a
+server-side cursor (yield_per), rendered, and the transaction ends before
+the chunk is handed to the client. A slow download therefore never keeps a
+transaction or a cursor open on the database, and memory is bounded by one
+chunk whatever the size of the export.
+
+Orders moved to the archive (ecomweb.archive.archive) are exported with
+the live ones: every query is a UNION ALL of the live tables and the
+archive. An order is in exactly one of the two at any time, so its id keys
+it across both.
+
+NDJSON has one object per order with its items nested; CSV has one line per
+order item, repeating the order columns.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from enum import Enum
+from typing import Iterator
+
+from sqlalchemy import union_all
+from sqlalchemy.engine import Engine
+from sqlalchemy.sql import Select
+from sqlmodel import Session, select
+
+from ecomweb.database.telemetry import exempt_from_budget
+from ecomweb.model.model import (Address, ExportFormat, Order, OrderArchive, OrderItem, OrderItemArchive, OrderStatus,
+                                 Payment)
+from ecomweb.settings.setting import EXPORT_CHUNK_ORDERS, EXPORT_YIELD_PER
+
+ORDER_COLUMNS = (
+    Order.order_id, Order.created_at, Order.order_status, Order.user_id,
+    Order.customer_name, Order.customer_email, Order.customer_phoneno,
+    Address.street_address, Address.city, Address.country,
+    Payment.payment_method,
+)
+
+ITEM_COLUMNS = (
+    OrderItem.orderitem_id, OrderItem.product_id, OrderItem.product_size,
+    OrderItem.total_cart_products, OrderItem.product_total,
+)
+
+ORDER_FIELDS = tuple(column.key for column in ORDER_COLUMNS)
+ITEM_FIELDS = tuple(column.key for column in ITEM_COLUMNS)
+
+# The same columns of the archive, where the address and payment are flattened into the order.
+ARCHIVE_ORDER_COLUMNS = (
+    OrderArchive.order_id, OrderArchive.created_at, OrderArchive.order_status, OrderArchive.user_id,
+    OrderArchive.customer_name, OrderArchive.customer_email, OrderArchive.customer_phoneno,
+    OrderArchive.street_address, OrderArchive.city, OrderArchive.country,
+    OrderArchive.payment_method,
+)
+
+ARCHIVE_ITEM_COLUMNS = (
+    OrderItemArchive.orderitem_id, OrderItemArchive.product_id, OrderItemArchive.product_size,
+    OrderItemArchive.total_cart_products, OrderItemArchive.product_total,
+)
+
+MEDIA_TYPES = {
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.NDJSON: "application/x-ndjson",
+}
+
+
+def plain(value):
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def order_filters(table:type[Order] | type[OrderArchive], created_from:datetime | None, created_to:datetime | None,
+                  status:OrderStatus | None) -> list:
+    filters = []
+    if created_from is not None:
+        filters.append(table.created_at >= created_from)
+    if created_to is not None:
+        filters.append(table.created_at < created_to)
+    if status is not None:
+        filters.append(table.order_status == status)
+    return filters
+
+
+def chunk_ids_statement(live_filters:list, archive_filters:list, after:int, limit:int) -> Select:
+    """
+    The ids of the next ``limit`` orders after ``after``, live or archived.
+    """
+    order_ids = union_all(
+        select(Order.order_id).where(Order.order_id > after, *live_filters),
+        select(OrderArchive.order_id).where(OrderArchive.order_id > after, *archive_filters),
+    ).subquery()
+    return select(order_ids.c.order_id).order_by(order_ids.c.order_id).limit(limit)
+
+
+def chunk_statement(live_filters:list, archive_filters:list, first_id:int, last_id:int) -> Select:
+    """
+    The orders of one chunk joined with their children, one row per item.
+    """
+    live = (
+        select(*ORDER_COLUMNS, *ITEM_COLUMNS)
+        .outerjoin(Address, Address.order_id == Order.order_id)
+        .outerjoin(Payment, Payment.order_id == Order.order_id)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.order_id)
+        .where(Order.order_id >= first_id, Order.order_id <= last_id, *live_filters)
+    )
+    archived = (
+        select(*ARCHIVE_ORDER_COLUMNS, *ARCHIVE_ITEM_COLUMNS)
+        .outerjoin(OrderItemArchive, OrderItemArchive.order_id == OrderArchive.order_id)
+        .where(OrderArchive.order_id >= first_id, OrderArchive.order_id <= last_id, *archive_filters)
+    )
+    rows = union_all(live, archived).subquery()
+    return (
+        select(*rows.c)
+        .order_by(rows.c.order_id, rows.c.orderitem_id)
+        .execution_options(yield_per=EXPORT_YIELD_PER)
+    )
+
+
+def render_csv(rows, header:bool) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(ORDER_FIELDS + ITEM_FIELDS)
+    for row in rows:
+        writer.writerow([plain(value) for value in row])
+    return buffer.getvalue()
+
+
+def render_ndjson(rows) -> str:
+    lines = []
+    order = None
+    for row in rows:
+        if order is None or order["order_id"] != row.order_id:
+            if order is not None:
+                lines.append(json.dumps(order))
+            order = {field: plain(value) for field, value in zip(ORDER_FIELDS, row)}
+            order["items"] = []
+        if row.orderitem_id is not None:
+            order["items"].append({field: plain(value) for field, value in zip(ITEM_FIELDS, row[len(ORDER_FIELDS):])})
+    if order is not None:
+        lines.append(json.dumps(order))
+    return "".join(f"{line}\n" for line in lines)
+
+
+def export_orders(engine:Engine, export_format:ExportFormat, created_from:datetime | None = None,
+                  created_to:datetime | None = None, status:OrderStatus | None = None,
+                  chunk_orders:int = EXPORT_CHUNK_ORDERS) -> Iterator[bytes]:
+    """
+    Yield the export of the matching orders, one encoded chunk at a time.
+
+    The generator opens its own sessions, so it can outlive the request
+    session; give it to a StreamingResponse as is.
+    """
+    live_filters = order_filters(Order, created_from, created_to, status)
+    archive_filters = order_filters(OrderArchive, created_from, created_to, status)
+    if export_format == ExportFormat.CSV:
+        yield render_csv((), header=True).encode()
+    after = 0
+    while True:
+        # One chunk after the other is the design, not a query in a loop.
+        with exempt_from_budget(), Session(engine) as session:
+            order_ids = session.exec(chunk_ids_statement(live_filters, archive_filters, after, chunk_orders)).all()
+            if not order_ids:
+                return
+            rows = session.exec(chunk_statement(live_filters, archive_filters, order_ids[0], order_ids[-1]))
+            if export_format == ExportFormat.CSV:
+                chunk = render_csv(rows, header=False)
+            else:
+                chunk = render_ndjson(rows)
+        # The session, and with it the transaction, is closed before the client gets the chunk.
+        yield chunk.encode()
+        after = order_ids[-1]
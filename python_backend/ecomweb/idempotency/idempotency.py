@@ -0,0 +1,158 @@
+"""
+Idempotency keys for checkout.
+
+A client sends an Idempotency-Key header with /api/createorder and repeats
+it when it retries. The first request claims the key in a short transaction
+of its own, storing a fingerprint of the request body; the checkout then
+stores its response on the key in the same transaction that places the
+order, so an order is never placed without its key being completed.
+
+A retry looks the key up by primary key and, depending on what it finds,
+replays the stored response, is told the first request is still running, or
+is told it reuses the key for a different request. Keys expire after
+IDEMPOTENCY_KEY_TTL_SECONDS; a claim whose request never finished (e.g. the
+worker died) can be taken over after IDEMPOTENCY_LOCK_SECONDS.
+
+Usage, from python_backend/::
+
+    python -m ecomweb.idempotency.idempotency [--batch-size 1000]
+
+deletes the expired keys.
+"""
+import argparse
+import hashlib
+import json
+from datetime import datetime, timedelta
+from enum import Enum
+
+from pydantic import BaseModel
+from sqlalchemy import delete, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+
+from ecomweb.database.database import get_engine
+from ecomweb.model.model import IdempotencyKey
+from ecomweb.settings.setting import IDEMPOTENCY_KEY_TTL_SECONDS, IDEMPOTENCY_LOCK_SECONDS
+
+
+class KeyState(str, Enum):
+    # The key is ours; run the request and complete it.
+    CLAIMED = "claimed"
+    # Another request with this key has not finished yet.
+    IN_PROGRESS = "in_progress"
+    # The key was used for a request with a different body.
+    MISMATCH = "mismatch"
+    # The request already ran; replay the stored response.
+    COMPLETED = "completed"
+
+
+def request_fingerprint(*parts:BaseModel) -> str:
+    """
+    Hash of the request body, to tell a retry from a different request
+    reusing its key.
+    """
+    body = json.dumps([part.model_dump(mode="json") for part in parts], sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def claim_key(session:Session, user_id:int, key:str, fingerprint:str) -> tuple[KeyState, IdempotencyKey | None]:
+    """
+    Claim ``key`` for a request of ``user_id`` and commit the claim.
+
+    :return: The state of the key, with the key itself when it is CLAIMED or COMPLETED.
+    """
+    now = datetime.now()
+    record = session.get(IdempotencyKey, (user_id, key))
+    if record is not None and record.expires_at <= now:
+        session.execute(delete(IdempotencyKey).where(
+            IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.expires_at <= now
+        ))
+        session.commit()
+        record = None
+    if record is None:
+        record = IdempotencyKey(user_id=user_id, key=key, fingerprint=fingerprint, created_at=now,
+                                expires_at=now + timedelta(seconds=IDEMPOTENCY_KEY_TTL_SECONDS))
+        session.add(record)
+        try:
+            session.commit()
+            return KeyState.CLAIMED, record
+        except IntegrityError:
+            # A concurrent request claimed it first.
+            session.rollback()
+            record = session.get(IdempotencyKey, (user_id, key), populate_existing=True)
+            if record is None:
+                return KeyState.IN_PROGRESS, None
+    if record.fingerprint != fingerprint:
+        return KeyState.MISMATCH, None
+    if record.response is not None:
+        return KeyState.COMPLETED, record
+    stale = now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+    if record.created_at < stale:
+        # The request that claimed the key never finished; take the claim over
+        # unless another retry just did.
+        taken = session.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.user_id == user_id, IdempotencyKey.key == key,
+                   IdempotencyKey.response.is_(None), IdempotencyKey.created_at < stale)
+            .values(created_at=now)
+        ).rowcount
+        session.commit()
+        if taken:
+            session.refresh(record)
+            return KeyState.CLAIMED, record
+    return KeyState.IN_PROGRESS, None
+
+
+def complete_key(session:Session, record:IdempotencyKey, response:str) -> None:
+    """
+    Store the response on a claimed key. The caller commits, together with
+    the work the response describes.
+    """
+    record.response = response
+    session.add(record)
+
+
+def release_key(session:Session, record:IdempotencyKey) -> None:
+    """
+    Give up a claimed key after its request failed, so a retry runs again.
+    """
+    user_id, key = record.user_id, record.key
+    session.rollback()
+    session.execute(delete(IdempotencyKey).where(
+        IdempotencyKey.user_id == user_id, IdempotencyKey.key == key, IdempotencyKey.response.is_(None)
+    ))
+    session.commit()
+
+
+def purge_expired_keys(session:Session, batch_size:int = 1000) -> int:
+    """
+    Delete the expired keys, ``batch_size`` per transaction.
+
+    :return: The number of keys deleted.
+    """
+    purged = 0
+    while True:
+        expired = session.exec(
+            select(IdempotencyKey.user_id, IdempotencyKey.key)
+            .where(IdempotencyKey.expires_at <= datetime.now())
+            .limit(batch_size)
+        ).all()
+        if not expired:
+            return purged
+        session.execute(delete(IdempotencyKey).where(tuple_(IdempotencyKey.user_id, IdempotencyKey.key).in_(expired)))
+        session.commit()
+        purged += len(expired)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Delete expired idempotency keys")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    with Session(get_engine()) as session:
+        purged = purge_expired_keys(session, args.batch_size)
+    print(f"purged {purged} idempotency keys")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Bulk product import from CSV or NDJSON.
+
+Usage, from python_backend/::
+
+    python -m ecomweb.importer.importer products.csv [--format csv] [--batch-size 1000]
+
+Rows are read from the file as a stream, validated against ProductCreate and
+written in batches of IMPORT_BATCH_SIZE, each batch in its own transaction.
+Products are matched by product_name (unique since migration 0002): rows
+with a known name update that product, the others insert a new one.
+
+On PostgreSQL with psycopg2 a batch is COPYed into a temporary table and
+merged with a single INSERT ... ON CONFLICT; other databases look up the
+batch's names with one query and use a bulk insert and a bulk update.
+
+The CSV header (or the NDJSON keys) must name the ProductCreate fields:
+product_name, product_description, product_price, product_slug and,
+optionally, image_id.
+"""
+import argparse
+import csv
+import io
+import json
+from typing import IO, Iterable, Iterator
+
+from pydantic import ValidationError
+from sqlalchemy import insert, text, update
+from sqlmodel import Session, select
+
+from ecomweb.database.database import get_engine
+from ecomweb.model.model import Image, ImportFormat, Product, ProductCreate, ProductImportError, ProductImportReport
+from ecomweb.settings.setting import IMPORT_BATCH_SIZE, IMPORT_MAX_ERRORS
+
+COLUMNS = ("product_name", "product_description", "product_price", "product_slug", "image_id")
+
+FORMAT_SUFFIXES = {
+    ".csv": ImportFormat.CSV,
+    ".ndjson": ImportFormat.NDJSON,
+    ".jsonl": ImportFormat.NDJSON,
+}
+
+FORMAT_CONTENT_TYPES = {
+    "text/csv": ImportFormat.CSV,
+    "application/x-ndjson": ImportFormat.NDJSON,
+    "application/jsonl": ImportFormat.NDJSON,
+}
+
+
+def import_format_for(filename:str | None, content_type:str | None) -> ImportFormat | None:
+    """
+    Guess the format of an upload from its file name, then its content type.
+    """
+    for suffix, import_format in FORMAT_SUFFIXES.items():
+        if filename and filename.lower().endswith(suffix):
+            return import_format
+    return FORMAT_CONTENT_TYPES.get((content_type or "").split(";")[0].strip())
+
+
+def read_records(file:IO[bytes], import_format:ImportFormat) -> Iterator[tuple[int, dict | None, str | None]]:
+    """
+    Yield (line, record, error) for every row of ``file``, one row at a time.
+    """
+    lines = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        if import_format == ImportFormat.CSV:
+            reader = csv.DictReader(lines)
+            for record in reader:
+                if None in record:
+                    yield reader.line_num, None, "more fields than the header"
+                    continue
+                # An empty image_id cell means the product has no image.
+                if record.get("image_id") == "":
+                    del record["image_id"]
+                yield reader.line_num, record, None
+        else:
+            for line_number, line in enumerate(lines, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_number, None, f"invalid JSON: {e.msg}"
+                    continue
+                if not isinstance(record, dict):
+                    yield line_number, None, "expected a JSON object"
+                    continue
+                yield line_number, record, None
+    finally:
+        # Leave closing the file to its owner.
+        lines.detach()
+
+
+def validation_error(e:ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+
+
+def batches(items:Iterable, size:int) -> Iterator[list]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def upsert_products(session:Session, products:list[ProductCreate]) -> tuple[int, int]:
+    """
+    Insert or update ``products`` by name and return (inserted, updated).
+    Names must be unique within ``products``.
+    """
+    names = [product.product_name for product in products]
+    existing = dict(session.exec(select(Product.product_name, Product.product_id).where(Product.product_name.in_(names))).all())
+    inserts = [product.model_dump(include=set(COLUMNS)) for product in products if product.product_name not in existing]
+    updates = [{"product_id": existing[product.product_name], **product.model_dump(include=set(COLUMNS))}
+               for product in products if product.product_name in existing]
+    if inserts:
+        session.execute(insert(Product), inserts)
+    if updates:
+        session.execute(update(Product), updates)
+    return len(inserts), len(updates)
+
+
+def copy_upsert_products(session:Session, products:list[ProductCreate]) -> tuple[int, int]:
+    """
+    PostgreSQL version of upsert_products: COPY the batch into a temporary
+    table and merge it with one INSERT ... ON CONFLICT.
+    """
+    session.execute(text(
+        "CREATE TEMPORARY TABLE IF NOT EXISTS product_import ("
+        "product_name varchar, product_description varchar, product_price integer, product_slug varchar, image_id integer"
+        ") ON COMMIT DELETE ROWS"
+    ))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for product in products:
+        writer.writerow([getattr(product, column) for column in COLUMNS])
+    buffer.seek(0)
+    cursor = session.connection().connection.cursor()
+    try:
+        # FORCE_NOT_NULL: an empty text cell is an empty string; only image_id can be NULL.
+        cursor.copy_expert(
+            f"COPY product_import ({', '.join(COLUMNS)}) FROM STDIN "
+            "WITH (FORMAT csv, FORCE_NOT_NULL (product_name, product_description, product_slug))",
+            buffer,
+        )
+    finally:
+        cursor.close()
+    inserted = session.execute(text(
+        f"INSERT INTO product ({', '.join(COLUMNS)}) SELECT {', '.join(COLUMNS)} FROM product_import "
+        "ON CONFLICT (product_name) DO UPDATE SET "
+        + ", ".join(f"{column} = EXCLUDED.{column}" for column in COLUMNS[1:])
+        # xmax is 0 for a freshly inserted row version.
+        + " RETURNING (xmax = 0)"
+    )).scalars().all()
+    return sum(inserted), len(inserted) - sum(inserted)
+
+
+def import_products(session:Session, file:IO[bytes], import_format:ImportFormat, batch_size:int = IMPORT_BATCH_SIZE) -> ProductImportReport:
+    """
+    Import the products of ``file`` and report what happened to its rows.
+
+    Every batch is committed on its own, so an interrupted import keeps the
+    batches before the failure; importing the same file again is safe.
+    """
+    dialect = session.get_bind().dialect
+    upsert = copy_upsert_products if dialect.name == "postgresql" and dialect.driver == "psycopg2" else upsert_products
+    report = ProductImportReport()
+
+    def reject(line:int, error:str) -> None:
+        report.rejected += 1
+        if len(report.errors) < IMPORT_MAX_ERRORS:
+            report.errors.append(ProductImportError(line=line, error=error))
+
+    for batch in batches(read_records(file, import_format), batch_size):
+        valid:dict[str, tuple[int, ProductCreate]] = {}
+        for line, record, error in batch:
+            if error is None:
+                record.setdefault("image_id", None)
+                try:
+                    product = ProductCreate.model_validate(record)
+                except ValidationError as e:
+                    error = validation_error(e)
+            if error is not None:
+                reject(line, error)
+                continue
+            # The last row for a name wins, as if the rows were imported one by one.
+            if product.product_name in valid:
+                reject(valid[product.product_name][0], f"superseded by line {line}")
+            valid[product.product_name] = (line, product)
+
+        image_ids = {product.image_id for _, product in valid.values() if product.image_id is not None}
+        if image_ids:
+            known_image_ids = set(session.exec(select(Image.id).where(Image.id.in_(image_ids))).all())
+            for name, (line, product) in list(valid.items()):
+                if product.image_id is not None and product.image_id not in known_image_ids:
+                    reject(line, f"image_id: image {product.image_id} does not exist")
+                    del valid[name]
+
+        if valid:
+            inserted, updated = upsert(session, [product for _, product in valid.values()])
+            session.commit()
+            report.inserted += inserted
+            report.updated += updated
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import products from a CSV or NDJSON file")
+    parser.add_argument("path")
+    parser.add_argument("--format", type=ImportFormat, choices=list(ImportFormat), default=None)
+    parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    import_format = args.format or import_format_for(args.path, None)
+    if import_format is None:
+        parser.error("cannot tell the format from the file name, pass --format")
+    with open(args.path, "rb") as file, Session(get_engine()) as session:
+        report = import_products(session, file, import_format, args.batch_size)
+    print(report.model_dump_json(indent=2))
+
+
+if __name__ == "__main__":
+    main()
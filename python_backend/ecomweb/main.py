@@ -1,36 +1,73 @@
-from fastapi import FastAPI,Depends,UploadFile,File,Request,Response
+import asyncio
+import logging
+from fastapi import APIRouter,FastAPI,Depends,UploadFile,File,Header,Request,Response,Query
 from fastapi.middleware.cors import CORSMiddleware
-from ecomweb.database.database import create_all_tables,get_session 
-from ecomweb.model.model import *
-from ecomweb.service.service import *
-from contextlib import asynccontextmanager
+from fastapi.responses import StreamingResponse
+from fastapi.security import OAuth2PasswordRequestForm
+from ecomweb.database.database import check_schema_version,dispose_engines,get_session,open_session,run_db,AnySession,get_async_engine,get_engine
+from ecomweb.database.querycheck import query_budget
+from ecomweb.database.slowquery import slow_query_log
+from ecomweb.database.telemetry import pool_stats
+from ecomweb.model.model import (AddressCreate,Cart,CartCreate,CartProductRead,CartRead,CartSummary,CatalogSort,Category,CategoryCreate,
+                                 CategoryProductAssociation,CategoryRead,ExportFormat,Image,ImageVariant,ImageVariantName,ImportFormat,Order,OrderCreate,OrderDetail,OrderHistoryPage,OrderRead,
+                                 OrderItemProductRead,OrderStatus,OrderUpdate,PaymentCreate,Product,ProductCreate,ProductImportReport,ProductPage,ProductRead,ProductSearchPage,Token,User,UserCreate,
+                                 UserRead,UserUpdate)
+from ecomweb.service.service import (authenticate_user,category_index,product_search_index,create_access_token,create_refresh_token,get_all_products,
+                                     get_current_user,get_hash_password,get_product_by_id,isadmin,product_add,
+                                     service_add_image,service_add_to_cart,service_create_category,service_create_order,service_create_order_idempotent,
+                                     service_create_productsubcategoryassociation,service_delete_cart,service_delete_order,
+                                     service_delete_order_item,service_delete_payment,service_delete_user,service_get_address,
+                                     service_get_cart_summary,service_get_catalog,service_get_category,service_get_image,
+                                     service_get_image_by_hash,service_get_order_by_id,service_get_order_detail,service_get_order_history,service_get_orderitem,
+                                     service_get_product_from_cart,service_get_product_from_category,service_import_products,service_logout_user,
+                                     service_search_products,service_signup,service_update_cart,service_update_order,service_update_user)
+from ecomweb.category.category import load_category_index,reload_periodically as reload_category_index_periodically
+from ecomweb.search.search import load_search_index,reload_periodically as reload_search_index_periodically
+from ecomweb.importer.importer import import_format_for
+from ecomweb.export.export import MEDIA_TYPES,export_orders
+from ecomweb.idempotency.idempotency import request_fingerprint
 from sqlmodel import Session
+from contextlib import asynccontextmanager
 from typing import Annotated
 from fastapi import HTTPException
-from datetime import timedelta
-from ecomweb.settings.setting import *
-from ecomweb.middlewares.middleware import authorize
-import io
-from fastapi.responses import StreamingResponse
+from datetime import datetime,timedelta
+from ecomweb.settings.setting import (ACCESS_TOKEN_EXPIRE_MINUTES,CATALOG_MAX_PAGE_SIZE,CATALOG_PAGE_SIZE,IMAGE_FALLBACK_CACHE_CONTROL,IMAGE_MAX_UPLOAD_BYTES,
+                                     ORDER_HISTORY_MAX_PAGE_SIZE,ORDER_HISTORY_PAGE_SIZE,REFRESH_TOKEN_EXPIRE_MINUTES,SEARCH_MAX_OFFSET)
+from starlette.concurrency import run_in_threadpool
+from ecomweb.middlewares.middleware import BodySizeLimitMiddleware,MetricsMiddleware
+from ecomweb.metrics.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE,request_metrics
+from ecomweb.storage.storage import cached_image_response,get_image_store,image_cache,image_response,receive_upload
+from ecomweb.storage.derivatives import create_image_variants,shutdown_executor,variant_for_width
+from ecomweb.security import security
+from ecomweb.serialization.serialization import FastJSONResponse,json_response
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    print("Creating tables..")
-    create_all_tables()
+    # Tables are created by `alembic upgrade head`; a worker only checks it is on the right revision.
+    await check_schema_version()
+    async with open_session() as session:
+        await run_db(session,load_category_index,category_index)
+        await run_db(session,load_search_index,product_search_index)
+    reloaders = [asyncio.create_task(reload_category_index_periodically(category_index))]
+    if product_search_index.is_built:
+        # Not built when the database does the searching itself.
+        reloaders.append(asyncio.create_task(reload_search_index_periodically(product_search_index)))
     yield
-    
-app = FastAPI(lifespan=lifespan,title="ecommerce api with sqlmodel",version="0.1.0")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.post("/api/signup",response_model=UserRead,tags=["USER"])
-def signup_users(session:Annotated[Session,Depends(get_session)],user_data:UserCreate) -> User:
+    for reloader in reloaders:
+        reloader.cancel()
+    shutdown_executor()
+    security.shutdown_executor()
+    await dispose_engines()
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Room for the multipart boundaries and part headers around the image itself.
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+
+@router.post("/api/signup",response_model=UserRead,tags=["USER"])
+async def signup_users(session:Annotated[AnySession,Depends(get_session)],user_data:UserCreate) -> User:
     """
         This function is used to signup a new user.
 
@@ -41,13 +78,16 @@ def signup_users(session:Annotated[Session,Depends(get_session)],user_data:UserC
         returns:
             The newly created user object.
     """
-    user_data.password = get_hash_password(user_data.password)
-    user_data.confirm_password = get_hash_password(user_data.confirm_password)
+    # When both passwords are the same, both columns hold the same hash, so bcrypt only runs once.
+    same_password = user_data.password == user_data.confirm_password
+    user_data.password = await get_hash_password(user_data.password)
+    user_data.confirm_password = user_data.password if same_password else await get_hash_password(user_data.confirm_password)
     user = User.model_validate(user_data)
-    return service_signup(session,user)
+    return await run_db(session,service_signup,user)
 
-@app.post("/api/login",response_model=Token,tags=["USER"])
-def login_user(request:Response,session:Annotated[Session,Depends(get_session)],form_data:OAuth2PasswordRequestForm = Depends()):
+# The worst case: rehashing an outdated password hash.
+@router.post("/api/login",response_model=Token,tags=["USER"],dependencies=[Depends(query_budget(4))])
+async def login_user(request:Response,session:Annotated[AnySession,Depends(get_session)],form_data:OAuth2PasswordRequestForm = Depends()):
     """
         This function is used to login a user.
 
@@ -58,7 +98,7 @@ def login_user(request:Response,session:Annotated[Session,Depends(get_session)],
         returns:
             The access token and refresh token.
     """
-    user = authenticate_user(session,form_data.username,form_data.password)
+    user = await authenticate_user(session,form_data.username,form_data.password)
     if user is None:
         raise HTTPException(
             status_code=401,
@@ -75,201 +115,367 @@ def login_user(request:Response,session:Annotated[Session,Depends(get_session)],
     request.set_cookie(key="refresh_token",value=refresh_token)
     return Token(access_token=access_token,refresh_token=refresh_token,expires_in=access_token_expire_time,token_type="bearer")
 
-@app.get("/logout/{user_id}",tags=["USER"])
-def logout_user(response:Response,request:Request,session:Annotated[Session,Depends(get_session)],user:Annotated[User,Depends(get_current_user)],):
-    user_loggedout = service_logout_user(session,user.user_id,response,request)
+@router.get("/logout/{user_id}",tags=["USER"])
+async def logout_user(response:Response,request:Request,session:Annotated[AnySession,Depends(get_session)],user:Annotated[User,Depends(get_current_user)],):
+    user_loggedout = await run_db(session,service_logout_user,user.user_id,response,request)
     return user_loggedout
 
-@app.patch("/updateuser",tags=["USER"])
-def update_user(session:Annotated[Session,Depends(get_session)],user_update:UserUpdate,user:Annotated[User,Depends(get_current_user)]):
-    user = get_user_by_id(session,user.user_id)
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
+@router.patch("/updateuser",tags=["USER"])
+async def update_user(session:Annotated[AnySession,Depends(get_session)],user_update:UserUpdate,user:Annotated[User,Depends(get_current_user)]):
     user_data = user_update.model_dump(exclude_unset = True)
-    user.sqlmodel_update(user_data)
-    session.add(user)
-    session.commit()
-    session.refresh(user)
+    return await run_db(session,service_update_user,user.user_id,user_data)
+
+@router.delete("/deleteuser",tags=["USER"])
+async def delete_user(session:Annotated[AnySession, Depends(get_session)], user_id:int):
+    return await run_db(session,service_delete_user,user_id)
+
+@router.get("/api/me",dependencies=[Depends(query_budget(0))])
+async def get_user(user:User = Depends(get_current_user)):
     return user
 
-@app.delete("/deleteuser",tags=["USER"])
-def delete_user(session:Annotated[Session, Depends(get_session)], user_id:int):
-    user = get_user_by_id(session, user_id)
-    if user is None:
-        raise HTTPException(status_code=404, detail="User not found")
-    session.delete(user)
-    session.commit()
+@router.post("/upload-file", tags=["Image"])
+async def get_file(file: Annotated[UploadFile, File(title="Product Image")], session: Annotated[AnySession, Depends(get_session)], user: Annotated[User, Depends(get_current_user)]):
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
+    store = get_image_store()
+    upload = await receive_upload(file, store)
+    try:
+        # Identical bytes were uploaded before: reuse that image instead of storing a copy.
+        existing_image = await run_db(session, service_get_image_by_hash, upload.content_hash)
+        if existing_image:
+            upload.abort()
+            return {"id": existing_image.id, "filename": existing_image.filename, "duplicate": True}
+        content_hash = upload.commit()
+        image = Image(
+            filename=file.filename,
+            content_type=file.content_type,
+            content_hash=content_hash,
+            size=upload.size
+        )
+        image = await run_db(session, service_add_image, image)
+    except Exception as e:
+        upload.abort()
+        logger.exception("Could not save uploaded image %s", file.filename)
+        raise HTTPException(status_code=500, detail="An error occurred while saving the image.") from e
+    # Read before the variants are committed: that expires image, and reloading
+    # it here would query the database from the event loop.
+    image_id, filename = image.id, image.filename
+    variants = await create_image_variants(session, image)
+    return {"id": image_id, "filename": filename, "variants": [variant.variant for variant in variants]}
+
+@router.get("/api/image", tags=["Image"])
+async def read_image(image_id: int, request: Request, session: Annotated[AnySession, Depends(get_session)], variant: ImageVariantName | None = None, width: Annotated[int | None, Query(gt=0)] = None):
+    variant_name = variant.value if variant else (variant_for_width(width) if width else None)
+    cache_key = (image_id, variant_name)
+    response = cached_image_response(cache_key, request.headers)
+    if response is not None:
+        return response
+
+    image = await run_db(session, service_get_image, image_id, variant_name)
+    if variant_name and not isinstance(image, ImageVariant):
+        # The variant is not rendered yet: serve the original for now, but
+        # neither cache it nor let clients keep it under the variant's URL.
+        return await run_in_threadpool(image_response, image, None, request.headers, IMAGE_FALLBACK_CACHE_CONTROL)
+    return await run_in_threadpool(image_response, image, cache_key, request.headers)
+
+@router.get("/internal/image-cache", tags=["Image"])
+async def get_image_cache_stats(user:Annotated[User,Depends(isadmin)]):
+    return image_cache.stats()
+
+
+@router.get("/internal/category-index",tags=["CATEGORY"])
+async def get_category_index_stats(user:Annotated[User,Depends(isadmin)]):
+    return category_index.stats()
+
+@router.get("/internal/pool",tags=["INTERNAL"])
+async def get_pool_stats(user:Annotated[User,Depends(isadmin)]):
+    async_engine = get_async_engine()
     return {
-        "message":"User deleted"
+        "sync": pool_stats(get_engine().pool) if async_engine is None else None,
+        "async": pool_stats(async_engine.sync_engine.pool) if async_engine is not None else None,
     }
 
-@app.get("/api/me")
-def get_user(user:User = Depends(get_current_user)):
-    return user
+@router.get("/internal/slow-queries",tags=["INTERNAL"])
+async def get_slow_queries(user:Annotated[User,Depends(isadmin)],clear:bool = False):
+    """
+        This function is used to dump the slow-query log (SLOW_QUERY_SECONDS).
 
-@app.post("/upload-file", tags=["Image"])
-async def get_file(file: Annotated[UploadFile, File(title="Product Image")], session: Annotated[Session, Depends(get_session)], user: Annotated[User, Depends(get_current_user)]):
-    if file.content_type.startswith("image/"):
-        try:
-            image_data = await file.read()
-            image = Image(
-                filename=file.filename,
-                content_type=file.content_type,
-                image_data=image_data
-            )
-            session.add(image)
-            session.commit()
-            session.refresh(image)
-            return {"id": image.id, "filename": image.filename}
-        except Exception as e:
-            raise HTTPException(status_code=500, detail="An error occurred while saving the image.")
-    else:
-        raise HTTPException(status_code=400, detail="Invalid file type. Only images are allowed.")
+        arguments:
+            clear: Empty the log after reading it.
 
-@app.get("/api/image", tags=["Image"])
-def read_image(image_id: int, session: Annotated[Session, Depends(get_session)]):
-    image = session.get(Image, image_id)
-    if not image:
-        raise HTTPException(status_code=404, detail="Image not found")
-    
-    return StreamingResponse(io.BytesIO(image.image_data), media_type=image.content_type)
+        returns:
+            The last slow queries, oldest first, with their duration, parameter types, calling function and sampled EXPLAIN plan.
+    """
+    entries = slow_query_log.snapshot()
+    if clear:
+        slow_query_log.clear()
+    return entries
 
+@router.get("/metrics",tags=["INTERNAL"])
+async def get_metrics():
+    """
+        This function is used to expose the request metrics to Prometheus.
 
-@app.post("/addproduct",response_model=ProductRead,tags=["PRODUCT"])
-def add_product(session:Annotated[Session, Depends(get_session)], product_data:ProductCreate,user:Annotated[User,Depends(isadmin)]):
+        returns:
+            Latency, status, response size and database histograms per route, in the Prometheus text format.
+    """
+    return Response(content=request_metrics.render(),media_type=METRICS_CONTENT_TYPE)
+
+@router.post("/addproduct",response_model=ProductRead,tags=["PRODUCT"])
+async def add_product(session:Annotated[AnySession, Depends(get_session)], product_data:ProductCreate,user:Annotated[User,Depends(isadmin)]):
     product_info = Product.model_validate(product_data)
-    product = product_add(session, product_info,user)
+    product = await run_db(session,product_add,product_info,user)
     return product
 
-@app.get("/api/getproduct",response_model=Product,tags=["PRODUCT"])
-def get_product_from_id(session:Annotated[Session, Depends(get_session)], product_id:int):
-    product = get_product_by_id(session,product_id)
+@router.post("/internal/products/import",response_model=ProductImportReport,tags=["PRODUCT"])
+async def import_products_file(file:Annotated[UploadFile, File(title="CSV or NDJSON product file")], user:Annotated[User,Depends(isadmin)], format:ImportFormat | None = None):
+    """
+        This function is used to add or update products in bulk.
+
+        arguments:
+            file: A CSV file with a header row, or NDJSON with one product per line.
+            format: csv or ndjson; guessed from the file name or content type when left out.
+
+        returns:
+            The number of inserted, updated and rejected rows, with the errors of the first rejected ones.
+    """
+    import_format = format or import_format_for(file.filename, file.content_type)
+    if import_format is None:
+        raise HTTPException(status_code=400, detail="Unknown file format, pass format=csv or format=ndjson.")
+    # The upload is spooled to disk and read back in batches. The import
+    # always uses a sync session: COPY needs the psycopg2 connection, and a
+    # long import should not run on the event loop.
+    with Session(get_engine()) as session:
+        return await run_in_threadpool(service_import_products, session, file.file, import_format)
+
+@router.get("/api/getproduct",response_model=Product,tags=["PRODUCT"])
+async def get_product_from_id(session:Annotated[AnySession, Depends(get_session)], product_id:int):
+    product = await run_db(session,get_product_by_id,product_id)
     return product  
 
-@app.get("/api/getproducts",response_model=list[Product],tags=["PRODUCT"])
-def get_products(session:Annotated[Session, Depends(get_session)]):
-    product = get_all_products(session)
-    return product
+@router.get("/api/getproducts",response_model=list[Product],tags=["PRODUCT"])
+async def get_products(session:Annotated[AnySession, Depends(get_session)]):
+    product = await run_db(session,get_all_products)
+    return json_response(list[Product],product)
+
+@router.get("/api/catalog",response_model=ProductPage,tags=["PRODUCT"],dependencies=[Depends(query_budget(1))])
+async def get_catalog(session:Annotated[AnySession, Depends(get_session)], cursor:str | None = None, limit:Annotated[int, Query(ge=1, le=CATALOG_MAX_PAGE_SIZE)] = CATALOG_PAGE_SIZE, sort:CatalogSort = CatalogSort.ID, min_price:Annotated[int | None, Query(ge=0)] = None, max_price:Annotated[int | None, Query(ge=0)] = None, category_id:int | None = None):
+    """
+        This function is used to page through the product catalog.
+
+        arguments:
+            session: The database session.
+            cursor: The next_cursor returned with the previous page.
+            limit: The number of products per page.
+            sort: id, price_asc or price_desc.
+            min_price: The lowest price to include.
+            max_price: The highest price to include.
+            category_id: Only list products of this category.
+
+        returns:
+            The products of the page and the cursor of the next page.
+    """
+    page = await run_db(session,service_get_catalog,limit,cursor,sort,min_price,max_price,category_id)
+    return json_response(ProductPage,page)
+
+@router.get("/api/search",response_model=ProductSearchPage,tags=["PRODUCT"],dependencies=[Depends(query_budget(1))])
+async def search_products(session:Annotated[AnySession, Depends(get_session)], q:Annotated[str, Query(min_length=1, max_length=200)], limit:Annotated[int, Query(ge=1, le=CATALOG_MAX_PAGE_SIZE)] = CATALOG_PAGE_SIZE, offset:Annotated[int, Query(ge=0, le=SEARCH_MAX_OFFSET)] = 0, prefix:bool = False):
+    """
+        This function is used to search the products.
+
+        arguments:
+            session: The database session.
+            q: The search text, matched against name, slug and description.
+            limit: The number of products per page.
+            offset: The number of best matches to skip, next_offset of the previous page.
+            prefix: Match every word as a prefix, for autocomplete.
+
+        returns:
+            The matching products, best first, with their score and the offset of the next page.
+    """
+    page = await run_db(session,service_search_products,q,limit,offset,prefix)
+    return json_response(ProductSearchPage,page)
 
-@app.post("/createcategory",response_model=CategoryRead,tags=["CATEGORY"])
-def create_category(session:Annotated[Session,Depends(get_session)],category_data:CategoryCreate,user:Annotated[User,Depends(isadmin)]):
+@router.post("/createcategory",response_model=CategoryRead,tags=["CATEGORY"])
+async def create_category(session:Annotated[AnySession,Depends(get_session)],category_data:CategoryCreate,user:Annotated[User,Depends(isadmin)]):
     category_info = Category.model_validate(category_data)
-    category = service_create_category(session, category_info)
+    category = await run_db(session,service_create_category,category_info)
     return category
 
 
-@app.post("/productcategoryassociation",response_model=CategoryProductAssociation,tags=["CATEGORY"])
-def create_productsubcategoryassociation(session:Annotated[Session,Depends(get_session)],category_product_association_data:CategoryProductAssociation,user:Annotated[User,Depends(isadmin)]) -> CategoryProductAssociation:
+@router.post("/productcategoryassociation",response_model=CategoryProductAssociation,tags=["CATEGORY"])
+async def create_productsubcategoryassociation(session:Annotated[AnySession,Depends(get_session)],category_product_association_data:CategoryProductAssociation,user:Annotated[User,Depends(isadmin)]) -> CategoryProductAssociation:
     category_product_association_info = CategoryProductAssociation.model_validate(category_product_association_data)
-    category_product_association = service_create_productsubcategoryassociation(session, category_product_association_info) 
+    category_product_association = await run_db(session,service_create_productsubcategoryassociation,category_product_association_info)
     return category_product_association
 
-@app.get("/api/getproductbycategory",response_model=list[Product],tags=["CATEGORY"])
-def get_product_from_category(session:Annotated[Session,Depends(get_session)],category_id):
-    return service_get_product_from_category(session,category_id)
+@router.get("/api/getproductbycategory",response_model=list[Product],tags=["CATEGORY"],dependencies=[Depends(query_budget(1))])
+async def get_product_from_category(session:Annotated[AnySession,Depends(get_session)],category_id:int):
+    products = await run_db(session,service_get_product_from_category,category_id)
+    return json_response(list[Product],products)
 
-@app.get("/api/getcategory")
-def get_category(category_slug:str,session:Annotated[Session,Depends(get_session)]):
-    return service_get_category(session=session,category_slug=category_slug)
+@router.get("/api/getcategory")
+async def get_category(category_slug:str,session:Annotated[AnySession,Depends(get_session)]):
+    return await run_db(session,service_get_category,category_slug=category_slug)
 
-@app.post("/api/createorder",tags=["ORDER"])
-def create_order(order_data:OrderCreate,address_data:AddressCreate,payment_data:PaymentCreate,user:Annotated[User , Depends(get_current_user)],session:Annotated[Session, Depends(get_session)]) -> OrderRead:
-    
-    order_info = Order.model_validate(order_data)
-    order = service_create_order(session, order_info,user)
-    service_create_address(session,address_data,order.order_id,user)
-    service_create_payment(session,user,order.order_id,payment_data)
-    return order
+# The worst case: taking over an expired Idempotency-Key.
+@router.post("/api/createorder",tags=["ORDER"],dependencies=[Depends(query_budget(11))])
+async def create_order(order_data:OrderCreate,address_data:AddressCreate,payment_data:PaymentCreate,user:Annotated[User , Depends(get_current_user)],session:Annotated[AnySession, Depends(get_session)],idempotency_key:Annotated[str | None, Header(min_length=1, max_length=255)] = None) -> OrderRead:
+    """
+        This function is used to place an order for everything in the user's cart.
 
-@app.patch("/updateorder",tags=["ORDER"])
-def update_order(order_update:OrderUpdate,order_id, user:Annotated[User, Depends(get_current_user)], session:Annotated[Session, Depends(get_session)]):
-    order = service_get_order_by_id(session,order_id,user)
-    if order:
-        order_data = order_update.model_dump(exclude_unset = True)
-        order.sqlmodel_update(order_data)
-        session.add(order)
-        session.commit()
-        session.refresh(order)
-        if order.order_status == "cancelled" or order.order_status == "delivered":
-            return service_order_update(session,user,order_id)
-        return order 
-
-@app.delete("/deleteorder",tags=["ORDER"])
-def delete_order(order_id, user:Annotated[User, Depends(get_current_user)], session:Annotated[Session, Depends(get_session)]):
-    deleted_order = service_delete_order(session,order_id)
+        arguments:
+            idempotency_key: The Idempotency-Key header. A retry with the same key and body
+                gets the response of the first request (marked Idempotent-Replayed) instead
+                of a second order; 409 while the first is still running, 422 if the body differs.
+
+        returns:
+            The placed order.
+    """
+    order_info = Order.model_validate(order_data)
+    if idempotency_key is None:
+        return await run_db(session,service_create_order,order_info,user,address_data,payment_data)
+    fingerprint = request_fingerprint(order_data,address_data,payment_data)
+    body, replayed = await run_db(session,service_create_order_idempotent,order_info,user,address_data,payment_data,idempotency_key,fingerprint)
+    return Response(content=body,media_type="application/json",headers={"Idempotent-Replayed":"true"} if replayed else None)
+
+@router.patch("/updateorder",tags=["ORDER"])
+async def update_order(order_update:OrderUpdate,order_id, user:Annotated[User, Depends(get_current_user)], session:Annotated[AnySession, Depends(get_session)]):
+    order_data = order_update.model_dump(exclude_unset = True)
+    return await run_db(session,service_update_order,order_id,user,order_data)
+
+@router.delete("/deleteorder",tags=["ORDER"])
+async def delete_order(order_id, user:Annotated[User, Depends(get_current_user)], session:Annotated[AnySession, Depends(get_session)]):
+    deleted_order = await run_db(session,service_delete_order,order_id)
     return deleted_order
 
-@app.get("/api/getorder",tags=["ORDER"])
-def get_order_by_id(order_id:int,session:Annotated[Session,Depends(get_session)],user:Annotated[User,Depends(get_current_user)]):
-    order = service_get_order_by_id(session,order_id,user)
+@router.get("/api/getorder",tags=["ORDER"])
+async def get_order_by_id(order_id:int,session:Annotated[AnySession,Depends(get_session)],user:Annotated[User,Depends(get_current_user)]):
+    order = await run_db(session,service_get_order_by_id,order_id,user)
     return order
 
-@app.post("/api/addtocart",response_model=CartRead,tags=["CART"])
-def add_to_cart(product_id:int,cart_info:CartCreate,session:Annotated[Session,Depends(get_session)],user:Annotated[User, Depends(get_current_user)]):
+@router.get("/api/orders",response_model=OrderHistoryPage,tags=["ORDER"],dependencies=[Depends(query_budget(2))])
+async def get_order_history(session:Annotated[AnySession,Depends(get_session)],user:Annotated[User,Depends(get_current_user)],cursor:str | None = None,limit:Annotated[int, Query(ge=1, le=ORDER_HISTORY_MAX_PAGE_SIZE)] = ORDER_HISTORY_PAGE_SIZE):
+    """
+        This function is used to page through the user's orders, newest first.
+
+        arguments:
+            session: The database session.
+            cursor: The next_cursor returned with the previous page.
+            limit: The number of orders per page.
+
+        returns:
+            The orders of the page, with their item count and total, and the cursor of the next page.
+    """
+    page = await run_db(session,service_get_order_history,user,limit,cursor)
+    return json_response(OrderHistoryPage,page)
+
+# The worst case: an archived order, looked up in the live tables first.
+@router.get("/api/order-detail",response_model=OrderDetail,tags=["ORDER"],dependencies=[Depends(query_budget(3))])
+async def get_order_detail(order_id:int,session:Annotated[AnySession,Depends(get_session)],user:Annotated[User,Depends(get_current_user)]):
+    """
+        This function is used to get everything needed to show one order.
+
+        arguments:
+            order_id: The id of the order.
+            session: The database session.
+
+        returns:
+            The order with its items and their products, the address and the payment.
+    """
+    order = await run_db(session,service_get_order_detail,user,order_id)
+    return json_response(OrderDetail,order)
+
+@router.get("/internal/orders/export",tags=["ORDER"])
+async def export_orders_file(user:Annotated[User,Depends(isadmin)], format:ExportFormat = ExportFormat.NDJSON, created_from:datetime | None = None, created_to:datetime | None = None, status:OrderStatus | None = None):
+    """
+        This function is used to export orders with their items, address and payment.
+
+        arguments:
+            format: ndjson (one order per line) or csv (one order item per line).
+            created_from: Only orders placed at or after this time.
+            created_to: Only orders placed before this time.
+            status: Only orders with this status.
+
+        returns:
+            The export, streamed. It is read in chunks with their own sessions,
+            so the request session is not used.
+    """
+    return StreamingResponse(
+        export_orders(get_engine(), format, created_from, created_to, status),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="orders.{format.value}"'},
+    )
+
+@router.post("/api/addtocart",response_model=CartRead,tags=["CART"],dependencies=[Depends(query_budget(4))])
+async def add_to_cart(product_id:int,cart_info:CartCreate,session:Annotated[AnySession,Depends(get_session)],user:Annotated[User, Depends(get_current_user)]):
     cart_data = Cart.model_validate(cart_info)
-    cart = service_add_to_cart(session,cart_data,user,product_id)
+    cart = await run_db(session,service_add_to_cart,cart_data,user,product_id)
     return cart
 
-@app.get("/api/get-product-from-cart",tags=["CART"])
-def get_product_from_cart(session:Annotated[Session,Depends(get_session)],user:Annotated[User, Depends(get_current_user)]):
-    cart_items = service_get_product_from_cart(session, user)
-
-    response = [
-        {
-            "cart_id": cart.cart_id,
-            "total_cart_products": cart.total_cart_products,
-            "product_total": cart.product_total,
-            "product_size": cart.product_size,
-            "product_id": product.product_id,
-            "product_name": product.product_name,
-            "product_description": product.product_description,
-            "product_price": product.product_price,
-            "product_slug": product.product_slug,
-            "image_id": product.image_id  
-        }
-        for cart, product in cart_items
-    ]
-
-    return response
-
-@app.put("/api/update",tags=["CART"])
-def update_cart(cart_id:int,type:str,product_price:int,user:User = Depends(get_current_user),session:Session=Depends(get_session)):
-    return service_update_cart(cart_id,type,user,session,product_price)
-
-@app.delete("/deletepayment",tags=["ORDER"])
-def delete_payment(session:Annotated[Session,Depends(get_session)],order_id:int):
-    return service_delete_payment(session,order_id)
-
-@app.delete("/deleteorderitem",tags=["ORDER"])
-def delete_order_item(session:Annotated[Session,Depends(get_session)],order_id:int):
-    return service_delete_order_item(session,order_id)
-
-@app.delete("/api/delete-cart",tags=["CART"])
-def delete_cart(cart_id:int,session:Session = Depends(get_session),user:User = Depends(get_current_user)):
-    return service_delete_cart(cart_id,session,user)
-
-@app.get("/api/getorderitem")
-def get_orderitem(order_id:int,session:Session = Depends(get_session),user:User = Depends(get_current_user)):
-    orderitems = service_get_orderitem(session,user,order_id)
-    response = [
-        {
-            "orderitem_id": orderitem.orderitem_id,
-            "total_cart_products": orderitem.total_cart_products,
-            "product_total": orderitem.product_total,
-            "product_size": orderitem.product_size,
-            "product_id": product.product_id,
-            "product_name": product.product_name,
-            "product_description": product.product_description,
-            "product_price": product.product_price,
-            "product_slug": product.product_slug,
-            "image_id": product.image_id,
-            "order_id":orderitem.order_id
-        }
-        for orderitem, product in orderitems
-    ]
-
-    return response
-
-@app.get("/api/getaddress")
-def get_address(order_id:int,session:Session = Depends(get_session),user:User = Depends(get_current_user)):
-    return service_get_address(session,user,order_id)
+@router.get("/api/get-product-from-cart",response_model=list[CartProductRead],tags=["CART"],dependencies=[Depends(query_budget(1))])
+async def get_product_from_cart(session:Annotated[AnySession,Depends(get_session)],user:Annotated[User, Depends(get_current_user)]):
+    cart_items = await run_db(session,service_get_product_from_cart,user)
+    return json_response(list[CartProductRead],cart_items)
+
+@router.get("/api/cart-summary",response_model=CartSummary,tags=["CART"],dependencies=[Depends(query_budget(1))])
+async def get_cart_summary(session:Annotated[AnySession,Depends(get_session)],user:Annotated[User, Depends(get_current_user)]):
+    return await run_db(session,service_get_cart_summary,user)
+
+@router.put("/api/update",tags=["CART"],dependencies=[Depends(query_budget(3))])
+async def update_cart(cart_id:int,type:str,product_price:int,user:User = Depends(get_current_user),session:AnySession=Depends(get_session)):
+    return await run_db(session,lambda session: service_update_cart(cart_id,type,user,session,product_price))
+
+@router.delete("/deletepayment",tags=["ORDER"])
+async def delete_payment(session:Annotated[AnySession,Depends(get_session)],order_id:int):
+    return await run_db(session,service_delete_payment,order_id)
+
+@router.delete("/deleteorderitem",tags=["ORDER"])
+async def delete_order_item(session:Annotated[AnySession,Depends(get_session)],order_id:int):
+    return await run_db(session,service_delete_order_item,order_id)
+
+@router.delete("/api/delete-cart",tags=["CART"],dependencies=[Depends(query_budget(2))])
+async def delete_cart(cart_id:int,session:AnySession = Depends(get_session),user:User = Depends(get_current_user)):
+    return await run_db(session,lambda session: service_delete_cart(cart_id,session,user))
+
+@router.get("/api/getorderitem",response_model=list[OrderItemProductRead])
+async def get_orderitem(order_id:int,session:AnySession = Depends(get_session),user:User = Depends(get_current_user)):
+    orderitems = await run_db(session,service_get_orderitem,user,order_id)
+    return json_response(list[OrderItemProductRead],orderitems)
+
+@router.get("/api/getaddress")
+async def get_address(order_id:int,session:AnySession = Depends(get_session),user:User = Depends(get_current_user)):
+    return await run_db(session,service_get_address,user,order_id)
+
+
+def create_app() -> FastAPI:
+    """
+        This function is used to build the application.
+
+        Building it does not connect to the database: engines are created by
+        the first request, or by the schema check when the lifespan starts.
+
+        returns:
+            The FastAPI application, e.g. for `uvicorn --factory ecomweb.main:create_app`.
+    """
+    app = FastAPI(lifespan=lifespan,title="ecommerce api with sqlmodel",version="0.1.0",default_response_class=FastJSONResponse)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(BodySizeLimitMiddleware, limits={"/upload-file": IMAGE_MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES})
+    # Added last so it is the outermost middleware and times everything below it.
+    app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+    app.include_router(router)
+    return app
+
+def __getattr__(name:str):
+    # `uvicorn ecomweb.main:app` still works, but importing this module does
+    # not build an application until one is asked for.
+    if name == "app":
+        app = globals()["app"] = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
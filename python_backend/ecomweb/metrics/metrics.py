@@ -0,0 +1,123 @@
+"""
+Request metrics in the Prometheus text format.
+
+MetricsMiddleware (ecomweb.middlewares.middleware) records, per route
+template and method: request latency, status codes, response sizes, and the
+number and time of the database queries the request ran (counted by the
+engine events of ecomweb.database.telemetry). /metrics renders them.
+
+Metrics are only updated from the event loop, so they need no lock; each
+observation is a dict lookup, a bisect and two additions.
+"""
+import bisect
+from typing import Iterable
+
+# Seconds; the Prometheus client defaults plus finer steps below 5 ms.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+def escape(value:str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names:tuple[str, ...], values:tuple, extra:str = "") -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value:float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name:str, documentation:str, labels:tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values:dict[tuple, float] = {}
+
+    def inc(self, labels:tuple = (), amount:float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, value in self._values.items():
+            yield f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels:tuple = (), amount:float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+
+class Histogram:
+    def __init__(self, name:str, documentation:str, buckets:tuple[float, ...], labels:tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        # labels -> [count per bucket..., count above the last bucket, sum]
+        self._series:dict[tuple, list] = {}
+
+    def observe(self, labels:tuple, value:float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} histogram"
+        for labels, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = 'le="' + (bound if bound == "+Inf" else format_value(bound)) + '"'
+                yield f"{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(series[-1])}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}"
+
+
+class RequestMetrics:
+    """
+    The metrics recorded for every HTTP request.
+    """
+
+    def __init__(self):
+        route = ("method", "route")
+        self.requests = Counter("http_requests_total", "Requests handled, by status code.", route + ("status",))
+        self.in_flight = Gauge("http_requests_in_flight", "Requests being handled.")
+        self.latency = Histogram("http_request_duration_seconds", "Time to handle a request, until the last body chunk was sent.", LATENCY_BUCKETS, route)
+        self.response_size = Histogram("http_response_size_bytes", "Size of the response bodies.", SIZE_BUCKETS, route)
+        self.db_seconds = Histogram("http_request_db_seconds", "Time spent in database queries per request.", LATENCY_BUCKETS, route)
+        self.db_queries = Histogram("http_request_db_queries", "Database queries run per request.", QUERY_BUCKETS, route)
+        self.in_flight.inc((), 0)
+
+    def record(self, method:str, route:str, status:int, seconds:float, size:int, db_queries:int, db_seconds:float) -> None:
+        labels = (method, route)
+        self.requests.inc((method, route, status))
+        self.latency.observe(labels, seconds)
+        self.response_size.observe(labels, size)
+        self.db_queries.observe(labels, db_queries)
+        self.db_seconds.observe(labels, db_seconds)
+
+    def render(self) -> str:
+        lines = []
+        for metric in (self.requests, self.in_flight, self.latency, self.response_size, self.db_seconds, self.db_queries):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+request_metrics = RequestMetrics()
@@ -1,24 +1,140 @@
+import json
+import time
 from fastapi import Request,HTTPException
-from jose import jwt,JWTError
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp,Message,Receive,Scope,Send
+from ecomweb.database.querycheck import FAIL_REQUESTS,TRACK_STATEMENTS,QueryCheckError,check_queries
+from ecomweb.database.telemetry import QueryStats,current_query_stats
+from ecomweb.metrics.metrics import RequestMetrics
 from ecomweb.settings.setting import ALGORITHM,SECRET_KEY
 
 ALGORITHMM = str(ALGORITHM)
 SECRET_KEYY = str(SECRET_KEY)
 
 async def authorize(request:Request,call_back):
+    from jose import jwt,JWTError
     access_token = request.cookies.get("access_token")
     pathname = request.url.path
-    print(access_token,"access_token",ALGORITHMM,"Algorithm",SECRET_KEYY,"secret kry")
     protected_urls = ["/addproduct"]
     if access_token:
         for protected_url in protected_urls:
             if protected_url == pathname:
                 try:
-                    payload = jwt.decode(access_token,SECRET_KEYY,algorithms=[ALGORITHMM])
-                    print(payload)
+                    jwt.decode(access_token,SECRET_KEYY,algorithms=[ALGORITHMM])
 
                 except JWTError:
                     raise HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})
 
     response = await call_back(request)
     return response
+
+
+class BodySizeLimitMiddleware:
+    """
+    Rejects request bodies above a per-path limit with 413.
+
+    A too large Content-Length is refused before anything is read, and
+    bodies without one are cut off as soon as the limit is crossed, so an
+    oversized upload is never spooled to memory or disk.
+    """
+
+    def __init__(self, app:ASGIApp, limits:dict[str,int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope:Scope, receive:Receive, send:Send):
+        limit = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        detail = f"Request body is larger than {limit} bytes."
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": detail}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class MetricsMiddleware:
+    """
+    Records latency, status, response size and database use of every HTTP
+    request into a RequestMetrics, labelled with the route template.
+
+    A pure ASGI middleware: it only looks at the messages passing through
+    send, so streamed responses are neither buffered nor delayed. Requests
+    that match no route share the route label "<unmatched>", so probing
+    random URLs cannot create new series.
+
+    The queries of a request are checked (QUERY_CHECK) when its response
+    starts. In "error" mode a successful response with query problems is
+    replaced by a 500 naming them, and the route's own messages are
+    dropped. Queries run after the start, e.g. while streaming, are checked
+    once the request is done, when the response can only be cut short.
+    """
+
+    def __init__(self, app:ASGIApp, metrics:RequestMetrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope:Scope, receive:Receive, send:Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        size = 0
+        # Queries at the last check, None before the response starts.
+        checked_queries = None
+        replaced = False
+
+        def route_label() -> str:
+            # Set by the router on the scope it was given, i.e. this one.
+            route = scope.get("route")
+            return route.path if route is not None else "<unmatched>"
+
+        async def measured_send(message:Message):
+            nonlocal status, size, checked_queries, replaced
+            if replaced:
+                return
+            if message["type"] == "http.response.start":
+                checked_queries = stats.queries
+                problem = check_queries(stats, f"{scope['method']} {route_label()}") if message["status"] < 400 else None
+                if problem is not None and FAIL_REQUESTS:
+                    replaced = True
+                    body = json.dumps({"detail": problem}).encode()
+                    status, size = 500, len(body)
+                    await send({"type": "http.response.start", "status": 500, "headers": [
+                        (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        stats = QueryStats(TRACK_STATEMENTS)
+        token = current_query_stats.set(stats)
+        self.metrics.in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, measured_send)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.metrics.in_flight.dec()
+            current_query_stats.reset(token)
+            self.metrics.record(scope["method"], route_label(), status, elapsed, size, stats.queries, stats.seconds)
+        if checked_queries is not None and stats.queries > checked_queries and status < 400:
+            problem = check_queries(stats, f"{scope['method']} {route_label()}")
+            if problem is not None and FAIL_REQUESTS:
+                raise QueryCheckError(problem)
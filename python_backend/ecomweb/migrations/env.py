@@ -0,0 +1,70 @@
+"""
+Alembic environment for the ecomweb schema.
+
+Migrations run against the same engine as the application, so DATABASE_URL
+and the DB_* settings apply to them too.
+"""
+import re
+from logging.config import fileConfig
+
+from alembic import context
+from sqlmodel import SQLModel
+
+import ecomweb.model.model  # noqa: F401  registers every table on SQLModel.metadata
+from ecomweb.settings.setting import DATABASE_URL
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = SQLModel.metadata
+
+# Created by raw SQL in PostgreSQL-only revisions and not declared on the
+# models, so autogenerate must not try to drop them.
+UNMANAGED_OBJECTS = {"search_vector", "ix_product_search_vector", "ix_product_name_trgm"}
+
+# Monthly partitions of the archive tables, created as they are needed by
+# ecomweb.archive.archive.
+ARCHIVE_PARTITION = re.compile(r"^(orderarchive|orderitemarchive)_\d{4}_\d{2}$")
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if not reflected or compare_to is not None:
+        return True
+    if type_ == "table" and ARCHIVE_PARTITION.match(name):
+        return False
+    return name not in UNMANAGED_OBJECTS
+
+
+def run_migrations_offline() -> None:
+    context.configure(
+        url=str(DATABASE_URL),
+        target_metadata=target_metadata,
+        include_object=include_object,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        render_as_batch=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    from ecomweb.database.database import get_engine
+
+    with get_engine().connect() as connection:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+            # SQLite cannot ALTER most things in place; batch mode copies the table.
+            render_as_batch=connection.dialect.name == "sqlite",
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,158 @@
+"""initial schema
+
+The schema as create_all_tables() built it before migrations existed, plus
+the image store columns of ``python -m ecomweb.storage.migrate``. A database
+created that way is at this revision once that has run: mark it with
+``alembic stamp 0001`` instead of running this revision, then
+``alembic upgrade head``. Tables and indexes added since, such as the image
+variants of 0007, come from the later revisions.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 20:20:53.412497
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('category',
+    sa.Column('category_name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('category_description', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('category_slug', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('category_id')
+    )
+    op.create_table('image',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('filename', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('content_type', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('content_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('image_data', sa.LargeBinary(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_image_content_hash'), ['content_hash'], unique=False)
+        batch_op.create_index(batch_op.f('ix_image_id'), ['id'], unique=False)
+
+    op.create_table('user',
+    sa.Column('username', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('password', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('role', sa.Enum('admin', 'user', name='userrole'), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('firstname', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('lastname', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('email', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('confirm_password', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('logged_in', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('user_id')
+    )
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_email'), ['email'], unique=True)
+        batch_op.create_index(batch_op.f('ix_user_username'), ['username'], unique=True)
+
+    op.create_table('order',
+    sa.Column('customer_name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('customer_email', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('customer_phoneno', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('order_status', sa.Enum('PENDING', 'CANCELLED', 'DELIVERED', name='orderstatus'), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.user_id'], ),
+    sa.PrimaryKeyConstraint('order_id')
+    )
+    op.create_table('product',
+    sa.Column('product_name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('product_description', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('product_price', sa.Integer(), nullable=False),
+    sa.Column('product_slug', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.Column('image_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['image_id'], ['image.id'], ),
+    sa.PrimaryKeyConstraint('product_id')
+    )
+
+    op.create_table('address',
+    sa.Column('street_address', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('city', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('country', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('address_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('order_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['order_id'], ['order.order_id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.user_id'], ),
+    sa.PrimaryKeyConstraint('address_id')
+    )
+    op.create_table('cart',
+    sa.Column('total_cart_products', sa.Integer(), nullable=False),
+    sa.Column('product_total', sa.Integer(), nullable=False),
+    sa.Column('product_size', sa.Enum('LARGE', 'SMALL', 'MEDIUM', name='size'), nullable=False),
+    sa.Column('cart_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('product_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['product_id'], ['product.product_id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.user_id'], ),
+    sa.PrimaryKeyConstraint('cart_id')
+    )
+    op.create_table('categoryproductassociation',
+    sa.Column('category_id', sa.Integer(), nullable=False),
+    sa.Column('product_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['category_id'], ['category.category_id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['product.product_id'], ),
+    sa.PrimaryKeyConstraint('category_id', 'product_id')
+    )
+    op.create_table('orderitem',
+    sa.Column('total_cart_products', sa.Integer(), nullable=False),
+    sa.Column('product_total', sa.Integer(), nullable=False),
+    sa.Column('product_size', sa.Enum('LARGE', 'SMALL', 'MEDIUM', name='size'), nullable=False),
+    sa.Column('orderitem_id', sa.Integer(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('product_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['order_id'], ['order.order_id'], ),
+    sa.ForeignKeyConstraint(['product_id'], ['product.product_id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.user_id'], ),
+    sa.PrimaryKeyConstraint('orderitem_id')
+    )
+    op.create_table('payment',
+    sa.Column('payment_method', sa.Enum('COD', name='paymentmethod'), nullable=False),
+    sa.Column('payment_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('order_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['order_id'], ['order.order_id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.user_id'], ),
+    sa.PrimaryKeyConstraint('payment_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('payment')
+    op.drop_table('orderitem')
+    op.drop_table('categoryproductassociation')
+    op.drop_table('cart')
+    op.drop_table('address')
+    op.drop_table('product')
+    op.drop_table('order')
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_username'))
+        batch_op.drop_index(batch_op.f('ix_user_email'))
+
+    op.drop_table('user')
+    with op.batch_alter_table('image', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_image_id'))
+        batch_op.drop_index(batch_op.f('ix_image_content_hash'))
+
+    op.drop_table('image')
+    op.drop_table('category')
+    if op.get_bind().dialect.name == "postgresql":
+        for name in ("paymentmethod", "size", "orderstatus", "userrole"):
+            sa.Enum(name=name).drop(op.get_bind(), checkfirst=True)
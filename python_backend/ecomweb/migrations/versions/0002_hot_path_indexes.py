@@ -0,0 +1,46 @@
+"""hot path indexes
+
+Indexes matching the lookups done by ecomweb.service.service: the cart line
+lookup and per-user cart listing, the order children fetched by order_id,
+product and category lookups by name and slug, and the reverse
+product -> categories association.
+
+On PostgreSQL the indexes are built CONCURRENTLY so the tables stay writable
+while they build. The unique indexes fail if duplicate product names or
+category slugs already exist; remove those rows first.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 20:21:12.188496
+"""
+from alembic import op
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+# name, table, columns, unique
+INDEXES = [
+    ("ix_cart_user_product_size", "cart", ["user_id", "product_id", "product_size"], False),
+    ("ix_orderitem_order_id", "orderitem", ["order_id"], False),
+    ("ix_address_order_id", "address", ["order_id"], False),
+    ("ix_payment_order_id", "payment", ["order_id"], False),
+    ("ix_order_user_id_order_id", "order", ["user_id", "order_id"], False),
+    ("ix_product_product_name", "product", ["product_name"], True),
+    ("ix_category_category_slug", "category", ["category_slug"], True),
+    ("ix_categoryproductassociation_product_id", "categoryproductassociation", ["product_id"], False),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    for name, table, columns, unique in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
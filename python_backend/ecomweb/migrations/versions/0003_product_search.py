@@ -0,0 +1,45 @@
+"""product search
+
+PostgreSQL only: a generated tsvector column over the product name (weight
+A), slug (B) and description (C) with a GIN index, and a trigram index on
+product_name for fuzzy matching (pg_trgm). Other databases search with the
+in-process index of ecomweb.search.search, so this revision is a no-op there.
+
+Adding a STORED generated column rewrites the product table once.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 21:02:40.518210
+"""
+from alembic import op
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("""
+        ALTER TABLE product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(product_name, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(product_slug, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(product_description, '')), 'C')
+        ) STORED
+    """)
+    with op.get_context().autocommit_block():
+        op.create_index("ix_product_search_vector", "product", ["search_vector"], postgresql_using="gin", postgresql_concurrently=True)
+        op.create_index("ix_product_name_trgm", "product", ["product_name"], postgresql_using="gin",
+                        postgresql_ops={"product_name": "gin_trgm_ops"}, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+    op.drop_index("ix_product_name_trgm", table_name="product")
+    op.drop_index("ix_product_search_vector", table_name="product")
+    op.drop_column("product", "search_vector")
@@ -0,0 +1,34 @@
+"""order created_at
+
+Records when an order was placed, for the date filters of the order export.
+Orders placed before this revision keep a NULL created_at: there is no
+reliable time to backfill them with. New orders get theirs from the model.
+
+On PostgreSQL adding a nullable column without a default is a catalog-only
+change, and the index is built CONCURRENTLY as in 0002.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 22:14:06.301857
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('order', sa.Column('created_at', sa.DateTime(), nullable=True))
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_order_created_at', 'order', ['created_at'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_order_created_at', table_name='order')
+    with op.batch_alter_table('order') as batch_op:
+        batch_op.drop_column('created_at')
@@ -0,0 +1,74 @@
+"""order archive
+
+Tables for delivered and cancelled orders, which are moved out of order,
+orderitem, address and payment by ecomweb.archive.archive instead of being
+deleted. The order row keeps its address, payment method and totals.
+
+On PostgreSQL both tables are partitioned by month of archived_at; the
+monthly partitions are created by the archiver when it first needs them, so
+this revision creates none. Other databases get plain tables.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 23:02:51.740112
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+# The enum types already exist on PostgreSQL, created with the order tables.
+ORDER_STATUS = postgresql.ENUM('PENDING', 'CANCELLED', 'DELIVERED', name='orderstatus', create_type=False)
+PAYMENT_METHOD = postgresql.ENUM('COD', name='paymentmethod', create_type=False)
+SIZE = postgresql.ENUM('LARGE', 'SMALL', 'MEDIUM', name='size', create_type=False)
+
+
+def upgrade() -> None:
+    op.create_table('orderarchive',
+    sa.Column('customer_name', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('customer_email', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('customer_phoneno', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('order_status', ORDER_STATUS, nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('item_count', sa.Integer(), nullable=False),
+    sa.Column('order_total', sa.Integer(), nullable=False),
+    sa.Column('address_id', sa.Integer(), nullable=True),
+    sa.Column('street_address', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('city', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('country', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('payment_id', sa.Integer(), nullable=True),
+    sa.Column('payment_method', PAYMENT_METHOD, nullable=True),
+    sa.PrimaryKeyConstraint('order_id', 'archived_at'),
+    postgresql_partition_by='RANGE (archived_at)'
+    )
+    op.create_index('ix_orderarchive_user_id_order_id', 'orderarchive', ['user_id', 'order_id'], unique=False)
+    op.create_table('orderitemarchive',
+    sa.Column('total_cart_products', sa.Integer(), nullable=False),
+    sa.Column('product_total', sa.Integer(), nullable=False),
+    sa.Column('product_size', SIZE, nullable=False),
+    sa.Column('orderitem_id', sa.Integer(), nullable=False),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('product_id', sa.Integer(), nullable=True),
+    sa.PrimaryKeyConstraint('orderitem_id', 'archived_at'),
+    postgresql_partition_by='RANGE (archived_at)'
+    )
+    op.create_index('ix_orderitemarchive_order_id', 'orderitemarchive', ['order_id'], unique=False)
+
+
+def downgrade() -> None:
+    # Dropping a partitioned table drops its partitions with it.
+    op.drop_index('ix_orderitemarchive_order_id', table_name='orderitemarchive')
+    op.drop_table('orderitemarchive')
+    op.drop_index('ix_orderarchive_user_id_order_id', table_name='orderarchive')
+    op.drop_table('orderarchive')
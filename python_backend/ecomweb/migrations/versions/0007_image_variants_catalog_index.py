@@ -0,0 +1,47 @@
+"""image variants and catalog index
+
+The image variant table and the (product_price, product_id) index of the
+price-sorted catalog. Both came with the app before migrations existed but
+after the schema of 0001, so a database stamped at 0001 gets them here.
+
+Also lets image.image_data be NULL on SQLite, where
+``python -m ecomweb.storage.migrate`` cannot change that itself; elsewhere
+the column is already nullable and the change is a no-op.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 09:12:40.518362
+"""
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('imagevariant',
+    sa.Column('image_id', sa.Integer(), nullable=False),
+    sa.Column('variant', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('width', sa.Integer(), nullable=False),
+    sa.Column('height', sa.Integer(), nullable=False),
+    sa.Column('content_type', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('content_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['image_id'], ['image.id'], ),
+    sa.PrimaryKeyConstraint('image_id', 'variant')
+    )
+    with op.batch_alter_table('image') as batch_op:
+        batch_op.alter_column('image_data', existing_type=sa.LargeBinary(), nullable=True)
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    with op.get_context().autocommit_block():
+        op.create_index('ix_product_price_id', 'product', ['product_price', 'product_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_product_price_id', table_name='product')
+    op.drop_table('imagevariant')
@@ -0,0 +1,51 @@
+"""never reuse order ids
+
+Orders and their items keep their ids in the archive tables. SQLite hands
+out the ids of deleted rows again unless the table is AUTOINCREMENT, so an
+order placed after the newest order was archived got the archived order's
+id. Recreates order and orderitem as AUTOINCREMENT tables and starts their
+ids after every id in use, archived ones included.
+
+PostgreSQL sequences never go back, so this is a no-op there.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 11:40:07.215930
+"""
+from alembic import op
+
+
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+# table -> (id column, archive table)
+ARCHIVED_TABLES = {
+    "order": ("order_id", "orderarchive"),
+    "orderitem": ("orderitem_id", "orderitemarchive"),
+}
+
+
+def recreate(autoincrement:bool) -> None:
+    for table in ARCHIVED_TABLES:
+        with op.batch_alter_table(table, recreate="always", table_kwargs={"sqlite_autoincrement": autoincrement}):
+            pass
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    recreate(True)
+    for table, (column, archive) in ARCHIVED_TABLES.items():
+        op.execute(f"DELETE FROM sqlite_sequence WHERE name = '{table}'")
+        op.execute(
+            f"INSERT INTO sqlite_sequence (name, seq) SELECT '{table}', coalesce(max(id), 0) FROM "
+            f"(SELECT {column} AS id FROM \"{table}\" UNION ALL SELECT {column} FROM {archive})"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    recreate(False)
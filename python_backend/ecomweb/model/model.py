@@ -1,5 +1,5 @@
 from sqlmodel import Field,SQLModel
-from pydantic import BaseModel
+from sqlalchemy import Index
 from typing import Optional
 from datetime import datetime,timedelta
 from enum import Enum
@@ -67,7 +67,25 @@ class Image(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True, index=True)
     filename: str
     content_type: str
-    image_data: bytes
+    # sha256 of the bytes, which is also the key in the image store.
+    content_hash: Optional[str] = Field(default=None, index=True)
+    size: Optional[int] = None
+    # Legacy inline blob, emptied by ecomweb.storage.migrate.
+    image_data: Optional[bytes] = None
+
+class ImageVariantName(str,Enum):
+    THUMBNAIL:str = "thumbnail"
+    CARD:str = "card"
+    FULL:str = "full"
+
+class ImageVariant(SQLModel, table=True):
+    image_id: int = Field(primary_key=True, foreign_key="image.id")
+    variant: str = Field(primary_key=True)
+    width: int
+    height: int
+    content_type: str
+    content_hash: str
+    size: int
 
 class Size(str,Enum):
     LARGE:str = "large"
@@ -83,6 +101,12 @@ class ProductBase(SQLModel):
     
 
 class Product(ProductBase,table=True):
+    __table_args__ = (
+        # Backs keyset pagination of the catalog when sorted by price.
+        Index("ix_product_price_id","product_price","product_id"),
+        # Product names are checked for duplicates on every insert.
+        Index("ix_product_product_name","product_name",unique=True),
+    )
     product_id:int | None = Field(primary_key=True,default=None)
     image_id: int | None = Field(foreign_key="image.id")
     
@@ -95,12 +119,54 @@ class ProductCreate(ProductBase):
 class ProductRead(ProductBase):
     pass
 
+class CatalogSort(str,Enum):
+    ID:str = "id"
+    PRICE_ASC:str = "price_asc"
+    PRICE_DESC:str = "price_desc"
+
+class ProductPage(SQLModel):
+    items:list[Product]
+    next_cursor:str | None = None
+
+class ProductSearchHit(ProductBase):
+    product_id:int
+    image_id:int | None = None
+    score:float
+
+class ProductSearchPage(SQLModel):
+    items:list[ProductSearchHit]
+    next_offset:int | None = None
+
+class ExportFormat(str,Enum):
+    CSV:str = "csv"
+    NDJSON:str = "ndjson"
+
+class ImportFormat(str,Enum):
+    CSV:str = "csv"
+    NDJSON:str = "ndjson"
+
+class ProductImportError(SQLModel):
+    line:int
+    error:str
+
+class ProductImportReport(SQLModel):
+    inserted:int = 0
+    updated:int = 0
+    rejected:int = 0
+    # Only the first IMPORT_MAX_ERRORS rejected rows are listed.
+    errors:list[ProductImportError] = []
+
 class CartBase(SQLModel):
     total_cart_products:int
     product_total:int
     product_size:Size
 
 class Cart(CartBase,table = True):
+    __table_args__ = (
+        # Serves both the per-user cart listing (leftmost column) and the
+        # line lookup done when adding or updating a cart item.
+        Index("ix_cart_user_product_size","user_id","product_id","product_size"),
+    )
     cart_id:int | None = Field(primary_key=True,default=None)
     user_id:int | None = Field(foreign_key="user.user_id",default=None)
     product_id:int | None = Field(foreign_key="product.product_id",default=None) 
@@ -117,12 +183,34 @@ class CartRead(CartBase):
     product_id:int
 
 
+class CartProductRead(SQLModel):
+    cart_id:int
+    total_cart_products:int
+    product_total:int
+    product_size:Size
+    product_id:int
+    product_name:str
+    product_description:str
+    product_price:int
+    product_slug:str
+    image_id:int | None = None
+
+
+class CartSummary(SQLModel):
+    line_count:int
+    item_count:int
+    subtotal:int
+
+
 class CategoryBase(SQLModel):
     category_name:str
     category_description:str
     category_slug:str
 
 class Category(CategoryBase,table=True):
+    __table_args__ = (
+        Index("ix_category_category_slug","category_slug",unique=True),
+    )
     category_id:int | None = Field(primary_key=True,default=None)
 
 class CategoryCreate(CategoryBase):
@@ -135,6 +223,10 @@ class CategoryRead(CategoryBase):
 
 
 class CategoryProductAssociation(SQLModel,table = True):
+    __table_args__ = (
+        # The primary key covers category -> products; this covers product -> categories.
+        Index("ix_categoryproductassociation_product_id","product_id"),
+    )
     category_id:int | None = Field(primary_key=True,foreign_key="category.category_id",default=None)
     product_id:int | None = Field(primary_key=True,foreign_key="product.product_id",default=None) 
 
@@ -151,9 +243,19 @@ class OrderBase(SQLModel):
 
 
 class Order(OrderBase,table = True):
+    __table_args__ = (
+        # Order listings of one customer.
+        Index("ix_order_user_id_order_id","user_id","order_id"),
+        # Date range filters of the order export.
+        Index("ix_order_created_at","created_at"),
+        # Archived orders keep their ids; SQLite must not hand them out again.
+        {"sqlite_autoincrement":True},
+    )
     order_id:int | None = Field(primary_key=True,default=None)
     user_id:int | None = Field(foreign_key="user.user_id",default=None)
     order_status:OrderStatus
+    # NULL for orders placed before migration 0004.
+    created_at:datetime | None = Field(default_factory=datetime.now)
 
 def format_phone_number(value: str) -> str:
     value = re.sub(r'\D', '', value)
@@ -185,6 +287,17 @@ class OrderUpdate(SQLModel):
 
 class OrderRead(OrderBase):
     order_id:int
+
+class OrderSummary(OrderBase):
+    order_id:int
+    order_status:OrderStatus
+    created_at:datetime | None = None
+    item_count:int
+    order_total:int
+
+class OrderHistoryPage(SQLModel):
+    items:list[OrderSummary]
+    next_cursor:str | None = None
     
 
 
@@ -197,25 +310,45 @@ class AddressBase(SQLModel):
 class Address(AddressBase,table = True):
     address_id:int | None = Field(primary_key=True,default=None)
     user_id:int | None = Field(foreign_key="user.user_id",default=None)
-    order_id:int | None = Field(foreign_key="order.order_id",default=None)
+    order_id:int | None = Field(foreign_key="order.order_id",default=None,index=True)
 
 class AddressCreate(AddressBase):
     pass
 
+class AddressRead(AddressBase):
+    address_id:int
+
 class OrderItemBase(SQLModel):
     total_cart_products:int
     product_total:int
     product_size:Size
 
 class OrderItem(OrderItemBase,table =True):
+    __table_args__ = (
+        # Archived items keep their ids; SQLite must not hand them out again.
+        {"sqlite_autoincrement":True},
+    )
     orderitem_id:int | None = Field(primary_key=True,default=None)
-    order_id:int | None = Field(foreign_key="order.order_id",default=None)
+    order_id:int | None = Field(foreign_key="order.order_id",default=None,index=True)
     user_id:int | None = Field(foreign_key="user.user_id",default=None)
     product_id:int | None = Field(foreign_key="product.product_id",default=None)
 
 class OrderItemCreate(OrderBase):
     pass
 
+class OrderItemProductRead(SQLModel):
+    orderitem_id:int
+    total_cart_products:int
+    product_total:int
+    product_size:Size
+    product_id:int
+    product_name:str
+    product_description:str
+    product_price:int
+    product_slug:str
+    image_id:int | None = None
+    order_id:int
+
 class PaymentMethod(str,Enum):
     COD:str = "cash on delivery"
 
@@ -225,11 +358,69 @@ class PaymentBase(SQLModel):
 class Payment(PaymentBase,table = True):
     payment_id:int | None = Field(primary_key=True,default=None)
     user_id:int | None = Field(foreign_key="user.user_id",default=None)
-    order_id:int | None = Field(foreign_key="order.order_id",default=None)
+    order_id:int | None = Field(foreign_key="order.order_id",default=None,index=True)
 
 class PaymentCreate(PaymentBase):
     pass
 
+class PaymentRead(PaymentBase):
+    payment_id:int
+
+class OrderDetail(OrderBase):
+    order_id:int
+    order_status:OrderStatus
+    created_at:datetime | None = None
+    items:list[OrderItemProductRead]
+    address:AddressRead | None = None
+    payment:PaymentRead | None = None
+
+# Delivered and cancelled orders, moved out of the order tables together with
+# their address, payment and items by ecomweb.archive.archive. On PostgreSQL
+# both tables are partitioned by month of archived_at.
+class OrderArchive(OrderBase,table = True):
+    __table_args__ = (
+        Index("ix_orderarchive_user_id_order_id","user_id","order_id"),
+        {"postgresql_partition_by":"RANGE (archived_at)"},
+    )
+    order_id:int = Field(primary_key=True)
+    archived_at:datetime = Field(primary_key=True)
+    user_id:int | None = None
+    order_status:OrderStatus
+    created_at:datetime | None = None
+    item_count:int
+    order_total:int
+    address_id:int | None = None
+    street_address:str | None = None
+    city:str | None = None
+    country:str | None = None
+    payment_id:int | None = None
+    payment_method:PaymentMethod | None = None
+
+class OrderItemArchive(OrderItemBase,table = True):
+    __table_args__ = (
+        Index("ix_orderitemarchive_order_id","order_id"),
+        {"postgresql_partition_by":"RANGE (archived_at)"},
+    )
+    orderitem_id:int = Field(primary_key=True)
+    archived_at:datetime = Field(primary_key=True)
+    order_id:int
+    user_id:int | None = None
+    product_id:int | None = None
+
+# Idempotency-Key of a checkout. Claimed (response NULL) before the order is
+# placed and completed in the checkout transaction; see ecomweb.idempotency.
+class IdempotencyKey(SQLModel,table = True):
+    __table_args__ = (
+        # Purging expired keys.
+        Index("ix_idempotencykey_expires_at","expires_at"),
+    )
+    user_id:int = Field(primary_key=True)
+    key:str = Field(primary_key=True,max_length=255)
+    fingerprint:str
+    created_at:datetime = Field(default_factory=datetime.now)
+    expires_at:datetime
+    response:str | None = None
+
 class Token(SQLModel):
     access_token:str
     token_type:str
@@ -0,0 +1,320 @@
+"""
+Product search over product_name, product_slug and product_description.
+
+On PostgreSQL the search runs in the database, against the generated
+``product.search_vector`` tsvector column (GIN index) and a trigram index on
+product_name for typo tolerance; both are created by migration 0003.
+
+Other databases use ProductSearchIndex, an inverted index kept in the worker
+process. It ranks the same way in spirit (name matches weigh more than slug
+matches, which weigh more than description matches), supports prefix and
+fuzzy (trigram) matching. It is loaded when the worker starts, updated
+write-through by product_add, and reloaded from the product table every
+SEARCH_INDEX_TTL_SECONDS by a background task of the lifespan, as the
+category index is, so products added through other workers show up too
+without a search ever paying for the reload.
+"""
+import asyncio
+import bisect
+import logging
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+from typing import Callable, Iterable, NamedTuple
+
+from sqlalchemy import func, literal_column, or_
+from sqlalchemy.sql import Select
+from sqlmodel import Session, select
+
+from ecomweb.database.database import open_session, run_db
+from ecomweb.database.telemetry import exempt_from_budget
+from ecomweb.model.model import Product
+from ecomweb.settings.setting import SEARCH_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# Reloads that lost the race against a write-through are retried this often
+# before giving up until the next period.
+RELOAD_ATTEMPTS = 3
+
+# Text search configuration of the search_vector column, see migration 0003.
+SEARCH_CONFIG = "english"
+
+# Field weights, matching the A/B/C weights of search_vector.
+FIELD_WEIGHTS = {
+    "product_name": 1.0,
+    "product_slug": 0.4,
+    "product_description": 0.2,
+}
+
+# Same default as pg_trgm.similarity_threshold.
+SIMILARITY_THRESHOLD = 0.3
+
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text:str) -> list[str]:
+    return TOKEN.findall(text.lower())
+
+
+def trigrams(token:str) -> set[str]:
+    """
+    Trigrams of ``token`` padded the way pg_trgm pads words.
+    """
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(left:set[str], right:set[str]) -> float:
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+class SearchHit(NamedTuple):
+    product_id:int
+    score:float
+
+
+class ProductSearchIndex:
+    """
+    In-process inverted index of the searchable product fields.
+
+    Shared by the request threads of a worker, so every operation takes a
+    lock; a search over a few thousand products takes well under a
+    millisecond, which keeps the lock uncontended.
+    """
+
+    def __init__(self, ttl:float):
+        self.ttl = ttl
+        self.built_at:float | None = None
+        # Bumped by every write-through, so a reload that started before one
+        # can tell its snapshot misses it.
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        # token -> {product_id: weighted term frequency}
+        self._postings:dict[str, dict[int, float]] = {}
+        # product_id -> tokens, so a product can be re-indexed
+        self._documents:dict[int, set[str]] = {}
+        # trigram -> tokens containing it, for typo tolerance
+        self._trigrams:dict[str, set[str]] = defaultdict(set)
+        # Sorted tokens for prefix lookups, rebuilt lazily after changes.
+        self._vocabulary:list[str] | None = None
+
+    @property
+    def is_built(self) -> bool:
+        return self.built_at is not None
+
+    def build(self, products:Iterable[Product], generation:int | None = None) -> bool:
+        """
+        Replace the whole index with ``products``. The new index is built
+        aside, so searches keep running meanwhile.
+
+        With ``generation``, the generation the index was at when they were
+        read, nothing is replaced if a write-through happened since.
+
+        :return: Whether the index was replaced.
+        """
+        fresh = ProductSearchIndex(self.ttl)
+        for product in products:
+            fresh._index(product)
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return False
+            self._postings = fresh._postings
+            self._documents = fresh._documents
+            self._trigrams = fresh._trigrams
+            self._vocabulary = None
+            self.built_at = time.monotonic()
+            return True
+
+    def reload(self, load:Callable[[], Iterable[Product]], only_if_unbuilt:bool = False) -> None:
+        """
+        Rebuild the index from ``load()``. Concurrent callers wait for the one
+        rebuild instead of each running their own.
+        """
+        with self._build_lock:
+            if only_if_unbuilt and self.is_built:
+                return
+            for _ in range(RELOAD_ATTEMPTS):
+                with self._lock:
+                    generation = self.generation
+                if self.build(load(), generation=generation):
+                    return
+            logger.warning("Search index reload kept racing with writes, keeping the current index")
+
+    def invalidate(self) -> None:
+        """
+        Make the next search rebuild the index, e.g. after a bulk change.
+        """
+        with self._lock:
+            self.generation += 1
+            self.built_at = None
+
+    def add_product(self, product:Product) -> None:
+        """
+        Index a new or changed product. Does nothing before the first build.
+        """
+        with self._lock:
+            self.generation += 1
+            if self.built_at is None:
+                return
+            self._index(product)
+            self._vocabulary = None
+
+    def _index(self, product:Product) -> None:
+        for token in self._documents.pop(product.product_id, ()):
+            entries = self._postings.get(token)
+            if entries is not None:
+                entries.pop(product.product_id, None)
+        tokens = set()
+        for field, weight in FIELD_WEIGHTS.items():
+            for token in tokenize(getattr(product, field) or ""):
+                entries = self._postings.get(token)
+                if entries is None:
+                    entries = self._postings[token] = {}
+                    for trigram in trigrams(token):
+                        self._trigrams[trigram].add(token)
+                entries[product.product_id] = entries.get(product.product_id, 0.0) + weight
+                tokens.add(token)
+        self._documents[product.product_id] = tokens
+
+    def _expand(self, term:str, prefix:bool) -> dict[str, float]:
+        """
+        Map ``term`` to the indexed tokens it matches, with a weight for how
+        good the match is: exact, then prefix, then trigram similarity.
+        """
+        matches = {}
+        if self._postings.get(term):
+            matches[term] = 1.0
+        if prefix:
+            if self._vocabulary is None:
+                self._vocabulary = sorted(token for token, entries in self._postings.items() if entries)
+            start = bisect.bisect_left(self._vocabulary, term)
+            for token in self._vocabulary[start:]:
+                if not token.startswith(term):
+                    break
+                matches.setdefault(token, 0.9)
+        if not matches:
+            term_trigrams = trigrams(term)
+            candidates = set()
+            for trigram in term_trigrams:
+                candidates |= self._trigrams.get(trigram, set())
+            for token in candidates:
+                score = similarity(term_trigrams, trigrams(token))
+                if score >= SIMILARITY_THRESHOLD:
+                    matches[token] = score
+        return matches
+
+    def search(self, text:str, limit:int, offset:int = 0, prefix:bool = False) -> list[SearchHit]:
+        """
+        Return the products matching every term of ``text``, best first.
+        """
+        terms = list(dict.fromkeys(tokenize(text)))
+        if not terms:
+            return []
+        with self._lock:
+            total = max(len(self._documents), 1)
+            scores:dict[int, float] | None = None
+            for term in terms:
+                term_scores:dict[int, float] = {}
+                for token, quality in self._expand(term, prefix).items():
+                    entries = self._postings.get(token)
+                    if not entries:
+                        continue
+                    idf = math.log(1 + total / len(entries))
+                    for product_id, frequency in entries.items():
+                        score = quality * idf * frequency
+                        if score > term_scores.get(product_id, 0.0):
+                            term_scores[product_id] = score
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {product_id: score + term_scores[product_id] for product_id, score in scores.items() if product_id in term_scores}
+                if not scores:
+                    return []
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [SearchHit(product_id, round(score, 6)) for product_id, score in ranked[offset:offset + limit]]
+
+
+def prefix_tsquery(text:str) -> str:
+    """
+    Turn ``text`` into a tsquery matching every word as a prefix, e.g.
+    "red sho" -> "red:* & sho:*".
+    """
+    return " & ".join(f"{token}:*" for token in tokenize(text))
+
+
+def postgres_search_statement(text:str, limit:int, offset:int = 0, prefix:bool = False) -> Select:
+    """
+    Build the ranked search query for PostgreSQL.
+
+    Full-text matches use the GIN index on search_vector; in the default mode
+    product names within trigram distance of the query (the ``%`` operator,
+    served by the trigram index) match too, so a typo still finds the product.
+    """
+    vector = literal_column("product.search_vector")
+    if prefix:
+        query = func.to_tsquery(SEARCH_CONFIG, prefix_tsquery(text))
+        matches = vector.op("@@")(query)
+        score = func.ts_rank_cd(vector, query)
+    else:
+        query = func.websearch_to_tsquery(SEARCH_CONFIG, text)
+        matches = or_(vector.op("@@")(query), Product.product_name.op("%")(text))
+        score = func.ts_rank_cd(vector, query) + func.similarity(Product.product_name, text)
+    score = score.label("score")
+    return (
+        select(Product, score)
+        .where(matches)
+        .order_by(score.desc(), Product.product_id)
+        .offset(offset)
+        .limit(limit)
+    )
+
+
+def search_backend(session:Session) -> str:
+    """
+    "postgres" or "memory": SEARCH_BACKEND, with "auto" resolved for the
+    database of ``session``.
+    """
+    if SEARCH_BACKEND != "auto":
+        return SEARCH_BACKEND
+    return "postgres" if session.get_bind().dialect.name == "postgresql" else "memory"
+
+
+def load_search_index(session:Session, index:ProductSearchIndex, only_if_unbuilt:bool = False) -> None:
+    """
+    Rebuild ``index`` from the product table, if the database is searched
+    with it.
+    """
+    if search_backend(session) != "memory":
+        return
+    columns = (Product.product_id, Product.product_name, Product.product_slug, Product.product_description)
+    index.reload(lambda: session.exec(select(*columns)).all(), only_if_unbuilt)
+
+
+def refresh_search_index(session:Session, index:ProductSearchIndex) -> None:
+    """
+    Build ``index`` if it is not built, e.g. when the app runs without its
+    lifespan or after invalidate(). Searches call this; reloading is left to
+    reload_periodically.
+    """
+    if not index.is_built:
+        with exempt_from_budget():
+            load_search_index(session, index, only_if_unbuilt=True)
+
+
+async def reload_periodically(index:ProductSearchIndex) -> None:
+    """
+    Reload ``index`` every ``index.ttl`` seconds. Runs as a task of the lifespan.
+    """
+    while True:
+        await asyncio.sleep(index.ttl)
+        try:
+            async with open_session() as session:
+                await run_db(session, load_search_index, index)
+        except Exception:
+            logger.exception("Could not reload the search index")
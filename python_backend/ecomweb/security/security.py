@@ -0,0 +1,79 @@
+"""
+Password hashing on a dedicated process pool.
+
+bcrypt is deliberately slow, so hashing and verification run in their own
+worker processes. A burst of logins can then only saturate this pool, never
+the threadpool or event loop serving catalog and cart requests. Jobs beyond
+the workers plus PASSWORD_HASH_QUEUE_SIZE are refused with 503 instead of
+queueing without bound.
+"""
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from fastapi import HTTPException
+
+from ecomweb.settings.setting import BCRYPT_ROUNDS, PASSWORD_HASH_QUEUE_SIZE, PASSWORD_HASH_WORKERS
+
+_executor:ProcessPoolExecutor | None = None
+_pending = 0
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+@lru_cache(maxsize=1)
+def get_pwd_context():
+    # Only the worker processes hash, so passlib is never loaded by the web process.
+    from passlib.context import CryptContext
+
+    # min_rounds makes hashes created with a lower cost count as outdated, so
+    # they are upgraded on the next successful login.
+    return CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=BCRYPT_ROUNDS, bcrypt__min_rounds=BCRYPT_ROUNDS)
+
+
+def hash_password_sync(password:str) -> str:
+    return get_pwd_context().hash(password)
+
+
+def verify_and_update_sync(password:str, hashed_password:str) -> tuple[bool, str | None]:
+    return get_pwd_context().verify_and_update(password, hashed_password)
+
+
+async def _run(fn, *args):
+    global _pending
+    if _pending >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE:
+        raise HTTPException(status_code=503, detail="Too many concurrent logins, please retry.", headers={"Retry-After": "1"})
+    _pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(get_executor(), fn, *args)
+    finally:
+        _pending -= 1
+
+
+async def hash_password(password:str) -> str:
+    """
+    Hash ``password`` with bcrypt at the configured cost.
+    """
+    return await _run(hash_password_sync, password)
+
+
+async def verify_password(password:str, hashed_password:str) -> tuple[bool, str | None]:
+    """
+    Check ``password`` against ``hashed_password``.
+
+    Returns whether it matched and, when the stored hash is outdated, a new
+    hash to store in its place.
+    """
+    return await _run(verify_and_update_sync, password, hashed_password)
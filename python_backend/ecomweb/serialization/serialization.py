@@ -0,0 +1,44 @@
+"""
+Fast JSON responses.
+
+FastAPI validates a route's return value against its response_model, turns it
+into plain Python objects and only then encodes it with the stdlib json
+module; routes without a response_model go through jsonable_encoder, which
+walks every value in Python. For the listing endpoints json_response()
+instead validates the rows once with a TypeAdapter compiled the first time
+the type is used and lets pydantic-core write the JSON bytes directly.
+
+Every other route renders through FastJSONResponse, which uses orjson when it
+is installed.
+"""
+from functools import lru_cache
+from typing import Any
+
+from fastapi.responses import JSONResponse, ORJSONResponse, Response
+from pydantic import TypeAdapter
+
+try:
+    import orjson  # noqa: F401
+    FastJSONResponse = ORJSONResponse
+except ImportError:
+    FastJSONResponse = JSONResponse
+
+
+@lru_cache(maxsize=None)
+def get_type_adapter(type_:Any) -> TypeAdapter:
+    """
+    Return the TypeAdapter of ``type_``, building its validator and serializer once.
+    """
+    return TypeAdapter(type_)
+
+
+def json_response(type_:Any, content:Any, status_code:int = 200) -> Response:
+    """
+    Validate ``content`` as ``type_`` and return it as a JSON response.
+
+    ``content`` may hold model instances or any objects with matching
+    attributes, such as the rows of a column select.
+    """
+    adapter = get_type_adapter(type_)
+    body = adapter.dump_json(adapter.validate_python(content, from_attributes=True))
+    return Response(content=body, status_code=status_code, media_type="application/json")
@@ -1,21 +1,50 @@
 from sqlmodel import select,Session
-from ecomweb.model.model import *
-from ecomweb.database.database import get_session
+from sqlalchemy import delete,func,insert,tuple_
+from sqlalchemy.orm import defer
+from ecomweb.model.model import (Address,AddressCreate,AddressRead,Cart,CartSummary,CatalogSort,Category,CategoryProductAssociation,IdempotencyKey,Image,
+                                 ImageVariant,ImportFormat,Order,OrderArchive,OrderDetail,OrderHistoryPage,OrderItem,OrderItemArchive,
+                                 OrderRead,OrderStatus,Payment,PaymentCreate,PaymentRead,Product,ProductImportReport,ProductPage,
+                                 ProductSearchHit,ProductSearchPage,TokenData,User)
+from ecomweb.database.database import get_session,run_db,AnySession
+from ecomweb.database.telemetry import exempt_from_budget
 from fastapi import HTTPException,Depends,Response,Request
-from fastapi.security import OAuth2PasswordBearer,OAuth2PasswordRequestForm
-from fastapi.responses import RedirectResponse
-from ecomweb.settings.setting import ACCESS_TOKEN_EXPIRE_MINUTES,ALGORITHM,SECRET_KEY
-from jose import jwt,JWTError
-from passlib.context import CryptContext
-from typing import Annotated,Any
+from fastapi.security import OAuth2PasswordBearer
+from ecomweb.settings.setting import (ALGORITHM,SECRET_KEY,PRINCIPAL_CACHE_TTL_SECONDS,PRINCIPAL_CACHE_MAX_ENTRIES,
+                                     SEARCH_INDEX_TTL_SECONDS,CATEGORY_INDEX_TTL_SECONDS)
+from ecomweb.cache.cache import TTLCache
+from ecomweb.search.search import ProductSearchIndex,postgres_search_statement,refresh_search_index,search_backend,tokenize
+from ecomweb.category.category import CategoryIndex,refresh_category_index
+from ecomweb.importer.importer import import_products
+from ecomweb.archive.archive import FINISHED_STATUSES,archive_orders
+from ecomweb.idempotency.idempotency import KeyState,claim_key,complete_key,release_key
+from ecomweb.security import security
+from typing import IO,Annotated
 from datetime import datetime, timedelta,timezone
+import base64
+import binascii
+import json
+# jose is imported inside the token functions: it is only needed once
+# requests arrive, so it stays off the worker startup path.
+
 # Services for user
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated="auto")
 SECRET_KEYY = str(SECRET_KEY)
 ALGORITHMM = str(ALGORITHM)
 
 oauth_scheme = OAuth2PasswordBearer(tokenUrl="/api/login")
 
+# Authenticated users by token subject (username), so authenticated requests
+# skip the user lookup. Entries are dropped whenever the user is changed.
+principal_cache = TTLCache(PRINCIPAL_CACHE_MAX_ENTRIES,PRINCIPAL_CACHE_TTL_SECONDS)
+
+def invalidate_principal(username:str) -> None:
+    """
+    This function is used to drop a user from the principal cache after it was changed.
+
+    :param username: The username (token subject) of the user.
+    :type username: str
+    """
+    principal_cache.delete(username)
+
 def service_signup(session:Session,user:User):
     """
     This function is used to create a new user.
@@ -75,6 +104,14 @@ def get_user_by_id(session:Session,user_id:int) -> User:
     if user is None:
         raise HTTPException(status_code=404,detail="user not found!")
     return user
+def select_user_by_username(username:str):
+    """
+    This function is used to build the query of a user by username.
+
+    :rtype: Select
+    """
+    return select(User).where(User.username == username)
+
 def get_user_by_username(session:Session,username:str) -> User:
     """
     This function is used to get a user by username.
@@ -90,42 +127,69 @@ def get_user_by_username(session:Session,username:str) -> User:
     if not username:
         return None
     
-    user = session.exec(select(User).where(User.username == username)).first()
+    user = session.exec(select_user_by_username(username)).first()
     if user is None:
         raise HTTPException(status_code=404, detail="user not found!")
     return user 
 
 
-def verify_password(password, hashed_password) -> bool:
+async def verify_password(password, hashed_password) -> tuple[bool, str | None]:
     """
     This function is used to verify a password against a hashed password.
 
+    The check runs on the password hashing process pool.
+
     :param plain_password: The plain text password to verify.
     :type plain_password: str
     :param hashed_password: The hashed password to compare against.
     :type hashed_password: str
 
-    :return: True if the password matches, False otherwise.
-    :rtype: bool
+    :return: Whether the password matches, and a replacement hash if the stored one is outdated.
+    :rtype: tuple[bool, str | None]
     """
-    return pwd_context.verify(password, hashed_password)
+    return await security.verify_password(password, hashed_password)
 
-def get_hash_password(password) -> str:
+async def get_hash_password(password) -> str:
     """
     This function is used to get the hash password of a plain text password.
 
+    The hash is computed on the password hashing process pool.
+
     :param plain_password: The plain text password to hash.
     :type plain_password: str
 
     :return: The hashed password.
     :rtype: str
     """
-    return pwd_context.hash(password)
+    return await security.hash_password(password)
+
+def service_update_password_hash(session:Session,user_id:int,hashed_password:str) -> None:
+    """
+    This function is used to replace an outdated password hash.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param user_id: The id of the user.
+    :type user_id: int
+    :param hashed_password: The new hash of the same password.
+    :type hashed_password: str
+    """
+    user = get_user_by_id(session,user_id)
+    user.password = hashed_password
+    user.confirm_password = hashed_password
+    session.add(user)
+    session.commit()
+    # The caller still holds this user: reload it here, in the worker, rather
+    # than lazily on the event loop.
+    session.refresh(user)
+    invalidate_principal(user.username)
 
-def authenticate_user(session:Session, username:str, password:str) -> User:
+async def authenticate_user(session:AnySession, username:str, password:str) -> User:
     """
     This function is used to authenticate a user.
 
+    Hashes made with an older bcrypt cost are transparently rehashed.
+
     :param session: An instance of the session object used to interact with the database.
     :type session: Session
     :param username: The username of the user to authenticate.
@@ -136,14 +200,38 @@ def authenticate_user(session:Session, username:str, password:str) -> User:
     :return: The authenticated user object, or None if authentication fails.
     :rtype: User or None
     """
-    user = get_user_by_username(session, username)
+    user = await run_db(session, get_user_by_username, username)
     if not user:
         return None
-    if not verify_password(password, user.password):
+    verified, new_hash = await verify_password(password, user.password)
+    if not verified:
         return None
+    if new_hash:
+        await run_db(session, service_update_password_hash, user.user_id, new_hash)
+    return user
+
+def get_principal(session:Session,username:str) -> User:
+    """
+    This function is used to load the user behind a token for the principal cache.
+
+    The user is detached from the session, so later commits in the request
+    cannot expire the cached copy.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param username: The username (token subject) of the user.
+    :type username: str
+
+    :return: The detached user object.
+    :rtype: User
+    """
+    with exempt_from_budget():
+        user = get_user_by_username(session,username)
+    if user is not None:
+        session.expunge(user)
     return user
 
-def get_current_user(token:Annotated[str,Depends(oauth_scheme)],session:Session = Depends(get_session)) -> User:
+async def get_current_user(token:Annotated[str,Depends(oauth_scheme)],session:AnySession = Depends(get_session)) -> User:
     """
     This function is used to get the current user from a token.
 
@@ -153,6 +241,8 @@ def get_current_user(token:Annotated[str,Depends(oauth_scheme)],session:Session
     :return: The current user object, or None if the token is invalid.
     :rtype: User or None
     """
+    from jose import jwt,JWTError
+
     credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})                 
     try:
         payload = jwt.decode(token,SECRET_KEYY,algorithms=[ALGORITHMM])
@@ -163,9 +253,13 @@ def get_current_user(token:Annotated[str,Depends(oauth_scheme)],session:Session
 
     except JWTError:
         raise credentials_exception
-    user = get_user_by_username(session,token_data.username)
+    user = principal_cache.get(token_data.username)
+    if user is not None:
+        return user
+    user = await run_db(session,get_principal,token_data.username)
     if user is None:
         raise credentials_exception
+    principal_cache.set(token_data.username,user)
     return user
 
 def isadmin(user: User = Depends(get_current_user)):
@@ -185,6 +279,8 @@ def create_access_token(data:dict, expires_delta:int | timedelta | None = None)
     :return: The access token.
     :rtype: str
     """
+    from jose import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
@@ -206,6 +302,8 @@ def create_refresh_token(data:dict, expires_delta:int | timedelta | None = None)
     :return: The refresh token.
     :rtype: str
     """
+    from jose import jwt
+
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
@@ -225,6 +323,8 @@ def validate_refresh_token(session:Session,refresh_token:str) -> TokenData:
     :return: The TokenData object if the token is valid, None otherwise.
     :rtype: TokenData or None
     """
+    from jose import jwt,JWTError
+
     credentials_exception = HTTPException(status_code=401, detail="Could not validate credentials", headers={"WWW-Authenticate": "Bearer"})                 
     try:
         payload = jwt.decode(refresh_token, SECRET_KEYY, algorithms=[ALGORITHMM])
@@ -240,6 +340,51 @@ def validate_refresh_token(session:Session,refresh_token:str) -> TokenData:
         raise credentials_exception
     return user
 
+def service_update_user(session:Session,user_id:int,user_data:dict) -> User:
+    """
+    This function is used to update the fields of a user.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param user_id: The id of the user to update.
+    :type user_id: int
+    :param user_data: The fields to change.
+    :type user_data: dict
+
+    :return: The updated user object.
+    :rtype: User
+    """
+    user = get_user_by_id(session,user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    invalidate_principal(user.username)
+    user.sqlmodel_update(user_data)
+    session.add(user)
+    session.commit()
+    session.refresh(user)
+    invalidate_principal(user.username)
+    return user
+
+def service_delete_user(session:Session,user_id:int):
+    """
+    This function is used to delete a user.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param user_id: The id of the user to delete.
+    :type user_id: int
+    """
+    user = get_user_by_id(session, user_id)
+    if user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    username = user.username
+    session.delete(user)
+    session.commit()
+    invalidate_principal(username)
+    return {
+        "message":"User deleted"
+    }
+
 def service_logout_user(session:Session,user_id:int,response:Response,request:Request):
     user = get_user_by_id(session,user_id)
     if not user:
@@ -253,6 +398,7 @@ def service_logout_user(session:Session,user_id:int,response:Response,request:Re
         
     response.delete_cookie(key="access_token")
     response.delete_cookie(key="refresh_token")
+    invalidate_principal(user.username)
      
     return {"message":"succesfuly loggedout!"}
     
@@ -273,6 +419,184 @@ def get_all_products(session:Session) -> list[Product]:
     products = session.exec(select(Product)).all()
     return products
 
+def encode_cursor(data:dict) -> str:
+    """
+    This function is used to encode a pagination cursor.
+
+    :param data: The keyset values of the last row on the current page.
+    :type data: dict
+
+    :return: An opaque, url safe cursor token.
+    :rtype: str
+    """
+    raw = json.dumps(data,separators=(",",":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor:str) -> dict:
+    """
+    This function is used to decode a pagination cursor created by encode_cursor.
+
+    :param cursor: The cursor token sent by the client.
+    :type cursor: str
+
+    :return: The keyset values stored in the cursor.
+    :rtype: dict
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        data = json.loads(raw)
+    except (binascii.Error,ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor!")
+    if not isinstance(data,dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor!")
+    return data
+
+def select_catalog_page(limit:int, sort:CatalogSort = CatalogSort.ID, last_id:int | None = None, last_price:int | None = None, min_price:int | None = None, max_price:int | None = None, product_ids:list[int] | None = None, category_id:int | None = None):
+    """
+    This function is used to build the query of one catalog page.
+
+    :param limit: The number of products to select.
+    :param last_id: The product_id of the last product of the previous page, if any.
+    :param last_price: The product_price of that product, for the price sorts.
+    :param product_ids: Only select these products.
+    :param category_id: Only select the products of this category, joined through its memberships.
+
+    :return: A select of the products after the position, in the order of ``sort``.
+    :rtype: Select
+    """
+    statement = select(Product)
+    if product_ids is not None:
+        statement = statement.where(Product.product_id.in_(product_ids))
+    if category_id is not None:
+        statement = (
+            statement
+            .join(CategoryProductAssociation, CategoryProductAssociation.product_id == Product.product_id)
+            .where(CategoryProductAssociation.category_id == category_id)
+        )
+    if min_price is not None:
+        statement = statement.where(Product.product_price >= min_price)
+    if max_price is not None:
+        statement = statement.where(Product.product_price <= max_price)
+
+    if last_id is not None:
+        if sort == CatalogSort.ID:
+            statement = statement.where(Product.product_id > last_id)
+        elif sort == CatalogSort.PRICE_ASC:
+            statement = statement.where(tuple_(Product.product_price,Product.product_id) > tuple_(last_price,last_id))
+        else:
+            statement = statement.where(tuple_(Product.product_price,Product.product_id) < tuple_(last_price,last_id))
+
+    if sort == CatalogSort.ID:
+        statement = statement.order_by(Product.product_id)
+    elif sort == CatalogSort.PRICE_ASC:
+        statement = statement.order_by(Product.product_price,Product.product_id)
+    else:
+        statement = statement.order_by(Product.product_price.desc(),Product.product_id.desc())
+    return statement.limit(limit)
+
+def service_get_catalog(session:Session, limit:int, cursor:str | None = None, sort:CatalogSort = CatalogSort.ID, min_price:int | None = None, max_price:int | None = None, category_id:int | None = None) -> ProductPage:
+    """
+    This function is used to get one page of the product catalog.
+
+    Pages are addressed with a keyset cursor on (product_price, product_id) or
+    product_id, so every page is a single index range scan no matter how deep
+    the client has paged.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param limit: The maximum number of products to return.
+    :type limit: int
+    :param cursor: The next_cursor value of the previous page, if any.
+    :type cursor: str | None
+    :param sort: The order of the catalog.
+    :type sort: CatalogSort
+    :param min_price: Only return products costing at least this much.
+    :type min_price: int | None
+    :param max_price: Only return products costing at most this much.
+    :type max_price: int | None
+    :param category_id: Only return products in this category.
+    :type category_id: int | None
+
+    :return: The page of products and the cursor of the following page.
+    :rtype: ProductPage
+    """
+    last_id = last_price = None
+    if cursor:
+        position = decode_cursor(cursor)
+        if position.get("sort") != sort.value:
+            raise HTTPException(status_code=400, detail="Cursor does not match the requested sort!")
+        try:
+            last_id = int(position["id"])
+            last_price = int(position["price"]) if sort != CatalogSort.ID else None
+        except (KeyError,TypeError,ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor!")
+
+    # One extra row tells us whether another page exists without a COUNT(*).
+    if category_id is not None and sort == CatalogSort.ID and min_price is None and max_price is None:
+        # Without price filters an id-sorted page of a category is simply the
+        # next slice of ids of the category index, looked up by primary key.
+        refresh_category_index(session,category_index)
+        product_ids = category_index.product_ids(category_id,after=last_id,limit=limit + 1)
+        statement = select_catalog_page(limit + 1,sort,last_id,product_ids=product_ids)
+    else:
+        # A category is joined rather than bound as every one of its product
+        # ids, so the page stays a keyset range scan of the price index.
+        statement = select_catalog_page(limit + 1,sort,last_id,last_price,min_price,max_price,category_id=category_id)
+    products = session.exec(statement).all()
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        position = {"sort":sort.value,"id":last.product_id}
+        if sort != CatalogSort.ID:
+            position["price"] = last.product_price
+        next_cursor = encode_cursor(position)
+    return ProductPage(items=products,next_cursor=next_cursor)
+
+# Search index of the worker, used when the database has no full-text search.
+product_search_index = ProductSearchIndex(SEARCH_INDEX_TTL_SECONDS)
+
+def service_search_products(session:Session, text:str, limit:int, offset:int = 0, prefix:bool = False) -> ProductSearchPage:
+    """
+    This function is used to search the products by name, slug and description.
+
+    PostgreSQL databases are searched with their full-text and trigram
+    indexes; other databases with the in-process product_search_index.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param text: The search text.
+    :type text: str
+    :param limit: The maximum number of products to return.
+    :type limit: int
+    :param offset: How many of the best matches to skip.
+    :type offset: int
+    :param prefix: Match every word as a prefix, for autocomplete.
+    :type prefix: bool
+
+    :return: The matching products, best first, and the offset of the next page.
+    :rtype: ProductSearchPage
+    """
+    if not tokenize(text):
+        raise HTTPException(status_code=400, detail="Search text must contain a letter or digit!")
+    # One extra row tells us whether another page exists.
+    if search_backend(session) == "postgres":
+        hits = session.exec(postgres_search_statement(text, limit + 1, offset, prefix)).all()
+    else:
+        refresh_search_index(session, product_search_index)
+        found = product_search_index.search(text, limit + 1, offset, prefix)
+        products = {}
+        if found:
+            products = {product.product_id: product for product in session.exec(select(Product).where(Product.product_id.in_([hit.product_id for hit in found]))).all()}
+        hits = [(products[hit.product_id], hit.score) for hit in found if hit.product_id in products]
+
+    next_offset = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_offset = offset + limit
+    items = [ProductSearchHit(**product.model_dump(), score=score) for product, score in hits]
+    return ProductSearchPage(items=items,next_offset=next_offset)
+
 def product_add(session:Session, product:Product,user:User):
     """
 
@@ -285,9 +609,32 @@ def product_add(session:Session, product:Product,user:User):
     session.add(product)
     session.commit()
     session.refresh(product)
+    product_search_index.add_product(product)
     return product
 
+def service_import_products(session:Session, file:IO[bytes], import_format:ImportFormat) -> ProductImportReport:
+    """
+    This function is used to import products in bulk from a CSV or NDJSON file.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param file: The uploaded file, read as a stream.
+    :type file: IO[bytes]
+    :param import_format: The format of the file.
+    :type import_format: ImportFormat
+
+    :return: The number of inserted, updated and rejected rows.
+    :rtype: ProductImportReport
+    """
+    report = import_products(session, file, import_format)
+    # Many products changed at once; rebuild the search index on the next search.
+    product_search_index.invalidate()
+    return report
+
+
 
+# Categories and their products, kept in the worker; see ecomweb.category.category.
+category_index = CategoryIndex(CATEGORY_INDEX_TTL_SECONDS)
 
 def service_create_category(session:Session,category:Category) -> Category:
     """
@@ -299,30 +646,215 @@ def service_create_category(session:Session,category:Category) -> Category:
     session.add(category)
     session.commit()
     session.refresh(category)
+    session.expunge(category)
+    category_index.add_category(category)
     return category
 
+def select_order(user:User,order_id:int):
+    """
+    This function is used to build the query of an order, limited to the user's own orders.
+
+    :rtype: Select
+    """
+    return select(Order).where(Order.order_id == order_id, Order.user_id == user.user_id)
+
 def service_get_order_by_id(session:Session, order_id:int,user:User) -> Order:
     """
 
     """
-    order = session.exec(select(Order).where(Order.order_id == order_id and Order.user_id == user.user_id)).first()
+    order = session.exec(select_order(user,order_id)).first()
     if order is None:
         raise HTTPException(status_code=404, detail="order not found!")
     return order
 
+def select_orderitem_products(user:User,order_id:int,items:type[OrderItem] | type[OrderItemArchive] = OrderItem):
+    """
+    This function is used to build the query of an order's items with their products.
+
+    :param items: OrderItem, or OrderItemArchive for an archived order.
+
+    :return: A select of the OrderItemProductRead columns, limited to the user's own order.
+    :rtype: Select
+    """
+    return (
+        select(
+            items.orderitem_id,items.total_cart_products,items.product_total,items.product_size,
+            Product.product_id,Product.product_name,Product.product_description,Product.product_price,
+            Product.product_slug,Product.image_id,items.order_id,
+        )
+        .join(Product, items.product_id == Product.product_id)
+        .where(items.order_id == order_id, items.user_id == user.user_id)
+        .order_by(items.orderitem_id)
+    )
+
 def service_get_orderitem(session:Session,user:User,order_id:int):
-    orderitems = session.exec(
-        select(OrderItem, Product)
-        .join(Product, OrderItem.product_id == Product.product_id and OrderItem.order_id == order_id)
-        .where(OrderItem.order_id == order_id)
-    ).all()
+    """
+    This function is used to get the items of an order with their products.
+
+    Only the response columns are selected, so no ORM objects are built.
+
+    :return: Rows with the fields of OrderItemProductRead.
+    :rtype: list[Row]
+    """
+    orderitems = session.exec(select_orderitem_products(user,order_id)).all()
     if not orderitems:
-        raise HTTPException(status = 400 ,detail="Could not get Order Items!")
+        raise HTTPException(status_code=400 ,detail="Could not get Order Items!")
     return orderitems
 
+def select_order_history(user:User,before:int | None = None):
+    """
+    This function is used to build the query of a user's live orders, newest
+    first, with the item count and total of each.
+
+    :param before: Only select orders with a lower order_id.
+
+    :return: A select of the OrderHistoryItem columns.
+    :rtype: Select
+    """
+    statement = (
+        select(
+            Order.order_id,Order.customer_name,Order.customer_email,Order.customer_phoneno,Order.order_status,Order.created_at,
+            func.count(OrderItem.orderitem_id).label("item_count"),
+            func.coalesce(func.sum(OrderItem.product_total), 0).label("order_total"),
+        )
+        .outerjoin(OrderItem, OrderItem.order_id == Order.order_id)
+        .where(Order.user_id == user.user_id)
+        .group_by(Order.order_id)
+        .order_by(Order.order_id.desc())
+    )
+    if before is not None:
+        statement = statement.where(Order.order_id < before)
+    return statement
+
+def select_archived_order_history(user:User,before:int | None = None):
+    """
+    This function is used to build the query of a user's archived orders, newest first.
+
+    :param before: Only select orders with a lower order_id.
+
+    :return: A select of the OrderHistoryItem columns.
+    :rtype: Select
+    """
+    statement = (
+        select(
+            OrderArchive.order_id,OrderArchive.customer_name,OrderArchive.customer_email,OrderArchive.customer_phoneno,
+            OrderArchive.order_status,OrderArchive.created_at,OrderArchive.item_count,OrderArchive.order_total,
+        )
+        .where(OrderArchive.user_id == user.user_id)
+        .order_by(OrderArchive.order_id.desc())
+    )
+    if before is not None:
+        statement = statement.where(OrderArchive.order_id < before)
+    return statement
+
+def service_get_order_history(session:Session, user:User, limit:int, cursor:str | None = None) -> OrderHistoryPage:
+    """
+    This function is used to get one page of a user's orders, newest first.
+
+    Pages are addressed with a keyset cursor on order_id, served by the
+    (user_id, order_id) indexes of the order and archive tables; the item
+    count and total of every order on the page come from the same queries.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param user: The owner of the orders.
+    :type user: User
+    :param limit: The maximum number of orders to return.
+    :type limit: int
+    :param cursor: The next_cursor value of the previous page, if any.
+    :type cursor: str | None
+
+    :return: The page of orders and the cursor of the following page.
+    :rtype: OrderHistoryPage
+    """
+    last_id = None
+    if cursor:
+        try:
+            last_id = int(decode_cursor(cursor)["id"])
+        except (KeyError,TypeError,ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor!")
+
+    # One extra row tells us whether another page exists without a COUNT(*).
+    # An order is either in the order tables or in the archive, never both.
+    orders = (session.exec(select_order_history(user,last_id).limit(limit + 1)).all()
+              + session.exec(select_archived_order_history(user,last_id).limit(limit + 1)).all())
+    orders.sort(key=lambda order: order.order_id,reverse=True)
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor({"id":orders[-1].order_id})
+    return OrderHistoryPage.model_validate({"items":orders,"next_cursor":next_cursor},from_attributes=True)
+
+def select_order_detail(user:User,order_id:int):
+    """
+    This function is used to build the query of an order joined with its address and payment.
+
+    :rtype: Select
+    """
+    return (
+        select(Order,Address,Payment)
+        .outerjoin(Address, Address.order_id == Order.order_id)
+        .outerjoin(Payment, Payment.order_id == Order.order_id)
+        .where(Order.order_id == order_id, Order.user_id == user.user_id)
+    )
+
+def service_get_order_detail(session:Session, user:User, order_id:int) -> OrderDetail:
+    """
+    This function is used to get an order with its items, address and payment.
+
+    Two queries whatever the number of items: the order joined with its
+    address and payment, then the items joined with their products. Orders
+    that were delivered or cancelled are read from the archive.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param user: The owner of the order.
+    :type user: User
+    :param order_id: The id of the order.
+    :type order_id: int
+
+    :return: The order and everything needed to show it.
+    :rtype: OrderDetail
+    """
+    row = session.exec(select_order_detail(user,order_id)).first()
+    if row is None:
+        return service_get_archived_order_detail(session,user,order_id)
+    order, address, payment = row
+    items = session.exec(select_orderitem_products(user,order_id)).all()
+    return OrderDetail.model_validate({**order.model_dump(),"items":items,"address":address,"payment":payment},from_attributes=True)
+
+def select_archived_order(user:User,order_id:int):
+    """
+    This function is used to build the query of an archived order, limited to the user's own orders.
+
+    :rtype: Select
+    """
+    return select(OrderArchive).where(OrderArchive.order_id == order_id, OrderArchive.user_id == user.user_id)
+
+def service_get_archived_order_detail(session:Session, user:User, order_id:int) -> OrderDetail:
+    """
+    This function is used to get a delivered or cancelled order from the archive.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param user: The owner of the order.
+    :type user: User
+    :param order_id: The id of the order.
+    :type order_id: int
+
+    :return: The order and everything needed to show it.
+    :rtype: OrderDetail
+    """
+    order = session.exec(select_archived_order(user,order_id)).first()
+    if order is None:
+        raise HTTPException(status_code=404, detail="order not found!")
+    items = session.exec(select_orderitem_products(user,order_id,OrderItemArchive)).all()
+    address = AddressRead.model_validate(order) if order.address_id is not None else None
+    payment = PaymentRead.model_validate(order) if order.payment_id is not None else None
+    return OrderDetail.model_validate({**order.model_dump(),"items":items,"address":address,"payment":payment},from_attributes=True)
+
 def service_create_address(session:Session,address_data:Address,order_id:int,user:User):
     order = service_get_order_by_id(session,order_id,user)
-    print(order)
     if order:
         
         address = Address(order_id=order_id,user_id=user.user_id,street_address=address_data.street_address,city=address_data.city,country=address_data.country)
@@ -364,40 +896,106 @@ def service_create_order_item(session:Session,user:User,order_item_data:Cart,ord
     return orderitem
 
 def service_delete_order_item(session:Session,order_id:int):
-    orderitems = session.exec(select(OrderItem).where(OrderItem.order_id == order_id)).all()
-    for orderitem in orderitems:
-        session.delete(orderitem)
+    session.execute(delete(OrderItem).where(OrderItem.order_id == order_id))
     session.commit()
     return {"message":"Order item deleted!"}
 
-def service_create_order(session:Session, order:Order, user:User) -> Order:
+def service_create_order(session:Session, order:Order, user:User, address_data:AddressCreate, payment_data:PaymentCreate, idempotency_record:IdempotencyKey | None = None) -> OrderRead:
     """
+    This function is used to place an order for everything in the user's cart.
 
+    The order, its items, address and payment are written and the cart is
+    emptied in one transaction with a single commit, so a failed checkout
+    leaves nothing behind. Items are inserted with one executemany and the
+    cart rows with one DELETE, whatever the size of the cart.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param order: The order to place.
+    :type order: Order
+    :param user: The user placing the order.
+    :type user: User
+    :param address_data: The delivery address.
+    :type address_data: AddressCreate
+    :param payment_data: The payment method.
+    :type payment_data: PaymentCreate
+    :param idempotency_record: The claimed Idempotency-Key of the request, completed in the same transaction.
+    :type idempotency_record: IdempotencyKey | None
+
+    :return: The placed order.
+    :rtype: OrderRead
     """
-    existing_order = session.exec(select(Order).where(Order.order_id == order.order_id,Order.user_id == user.user_id)).first()
-    if existing_order:
-        raise HTTPException(status_code=404, detail="order is already present!")
-    carts = session.exec(select(Cart).where(Cart.user_id == user.user_id)).all()
+    carts = service_get_cart_from_user(session,user)
     if not carts:
         raise HTTPException(status_code=404,detail="Cart is Empty!")
-    
+
     order.user_id = user.user_id
     order.order_status = "pending"
     session.add(order)
+    # Assigns order_id without committing.
+    session.flush()
+    session.execute(insert(OrderItem), [
+        {
+            "order_id": order.order_id,
+            "user_id": user.user_id,
+            "product_id": cart.product_id,
+            "product_size": cart.product_size,
+            "product_total": cart.product_total,
+            "total_cart_products": cart.total_cart_products,
+        }
+        for cart in carts
+    ])
+    session.execute(delete(Cart).where(Cart.user_id == user.user_id))
+    session.add(Address(order_id=order.order_id,user_id=user.user_id,street_address=address_data.street_address,city=address_data.city,country=address_data.country))
+    session.add(Payment(order_id=order.order_id,user_id=user.user_id,payment_method=payment_data.payment_method))
+    # Built before the commit expires the order, which would cost a reload.
+    placed_order = OrderRead.model_validate(order)
+    if idempotency_record is not None:
+        complete_key(session,idempotency_record,placed_order.model_dump_json())
     session.commit()
-    session.refresh(order)
-    carts:Cart = service_get_cart_from_user(session,user)
-    for cart in carts:
-        if order:
-            service_create_order_item(session,user,cart,order.order_id)
-    
-    for cart in carts:
-        session.delete(cart)
-        session.commit()  
-    return order 
+    return placed_order
+
+def service_create_order_idempotent(session:Session, order:Order, user:User, address_data:AddressCreate, payment_data:PaymentCreate, idempotency_key:str, fingerprint:str) -> tuple[str,bool]:
+    """
+    This function is used to place an order at most once per Idempotency-Key.
+
+    A retry of a placed order is answered with the stored response after
+    one primary key lookup; see ecomweb.idempotency.idempotency.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param order: The order to place.
+    :type order: Order
+    :param user: The user placing the order.
+    :type user: User
+    :param address_data: The delivery address.
+    :type address_data: AddressCreate
+    :param payment_data: The payment method.
+    :type payment_data: PaymentCreate
+    :param idempotency_key: The Idempotency-Key header of the request.
+    :type idempotency_key: str
+    :param fingerprint: The request_fingerprint of the request body.
+    :type fingerprint: str
+
+    :return: The placed order as JSON, and whether it was replayed from an earlier request.
+    :rtype: tuple[str, bool]
+    """
+    state, record = claim_key(session,user.user_id,idempotency_key,fingerprint)
+    if state == KeyState.COMPLETED:
+        return record.response, True
+    if state == KeyState.IN_PROGRESS:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed!")
+    if state == KeyState.MISMATCH:
+        raise HTTPException(status_code=422, detail="This Idempotency-Key was used for a different request!")
+    try:
+        placed_order = service_create_order(session,order,user,address_data,payment_data,record)
+    except Exception:
+        release_key(session,record)
+        raise
+    return placed_order.model_dump_json(), False
     
 def service_get_address(session:Session,user:User,order_id:int):
-    address = session.exec(select(Address).where(Address.order_id == order_id and Address.user_id == user.user_id)).first()
+    address = session.exec(select(Address).where(Address.order_id == order_id, Address.user_id == user.user_id)).first()
     if not address:
         raise HTTPException(status_code=404,detail="There is no Address!")
     return address  
@@ -410,11 +1008,29 @@ def service_create_productsubcategoryassociation(session:Session,category_produc
     session.add(category_product_association)
     session.commit()
     session.refresh(category_product_association)
+    category_index.add_product(category_product_association.category_id,category_product_association.product_id)
     return category_product_association
     
 def service_get_product_from_category(session:Session,category_id:int):
-    product_category_data = session.exec(select(Product).join(CategoryProductAssociation).where(CategoryProductAssociation.category_id == category_id))
-    return product_category_data 
+    """
+    This function is used to get the products of a category.
+
+    Membership comes from the category index, so this is a primary key
+    lookup of the products instead of a join.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param category_id: The id of the category.
+    :type category_id: int
+
+    :return: The products of the category ordered by id.
+    :rtype: list[Product]
+    """
+    refresh_category_index(session,category_index)
+    product_ids = category_index.product_ids(category_id)
+    if not product_ids:
+        return []
+    return session.exec(select(Product).where(Product.product_id.in_(product_ids)).order_by(Product.product_id)).all()
 
 def service_delete_order(session:Session, order_id:int):
     order = service_get_order_by_id(session, order_id)  
@@ -422,33 +1038,61 @@ def service_delete_order(session:Session, order_id:int):
     session.commit()
     return {"message":"order deleted"}
 
-def service_order_update(session:Session,user:User,order_id:int):
-    order = service_get_order_by_id(session,order_id)
-    if order.order_status == "cancelled":
-        service_delete_address(session,order_id)
-        service_delete_payment(session,order_id)
-        service_delete_order_item(session,order_id)
-        service_delete_order(session,order_id)
-        return {"message":"Order is cancelled"}
-    elif order.order_status == "delivered":
-        service_delete_address(session,order_id)
-        service_delete_payment(session,order_id)
-        service_delete_order_item(session,order_id)
-        service_delete_order(session,order_id)
-        return {"message":"Order is delivered"}
+def service_update_order(session:Session,order_id:int,user:User,order_data:dict):
+    """
+    This function is used to change the status of an order.
+
+    Cancelled and delivered orders are moved to the archive tables together
+    with their address, payment and items, in the same transaction as the
+    status change.
+    """
+    order = service_get_order_by_id(session,order_id,user)
+    order.sqlmodel_update(order_data)
+    session.add(order)
+    if order.order_status in FINISHED_STATUSES:
+        message = {"message":f"Order is {OrderStatus(order.order_status).value}"}
+        # Write the new status before it is copied to the archive.
+        session.flush()
+        archive_orders(session,[order.order_id])
+        session.commit()
+        return message
+    session.commit()
+    session.refresh(order)
+    return order
     
     # return order
 
 
-def service_add_same_product_to_cart(session:Session,user:User,cart_updated_data:Cart):
-    cart_row = session.exec(select(Cart).where(Cart.user_id == user.user_id,Cart.product_id == cart_updated_data.product_id,Cart.product_size == cart_updated_data.product_size)).first()
-    product:Product = session.exec(select(Product).where(Product.product_id == cart_updated_data.product_id)).first() 
-    if cart_row:
-        cart_row.total_cart_products += cart_updated_data.total_cart_products 
-        cart_row.product_total = cart_row.total_cart_products * product.product_price
-        session.add(cart_row)
-        session.commit()
-        return cart_row
+def service_add_same_product_to_cart(session:Session,cart_row:Cart,cart_updated_data:Cart):
+    """
+    This function is used to add more of a product to the cart line that already holds it.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param cart_row: The cart line of the product and size, as loaded by the caller.
+    :type cart_row: Cart
+    :param cart_updated_data: The quantity to add.
+    :type cart_updated_data: Cart
+
+    :return: The updated cart line.
+    :rtype: Cart
+    """
+    product_price = session.exec(select(Product.product_price).where(Product.product_id == cart_row.product_id)).one()
+    cart_row.total_cart_products += cart_updated_data.total_cart_products
+    cart_row.product_total = cart_row.total_cart_products * product_price
+    session.add(cart_row)
+    session.commit()
+    # Reload here, in the worker thread, rather than when the response is serialized on the event loop.
+    session.refresh(cart_row)
+    return cart_row
+
+def select_cart_line(user:User,product_id:int,product_size:str):
+    """
+    This function is used to build the query of the user's cart line of a product and size.
+
+    :rtype: Select
+    """
+    return select(Cart).where(Cart.user_id == user.user_id,Cart.product_id == product_id, Cart.product_size == product_size)
 
 def service_add_to_cart(session:Session,cart_data:Cart,user:User,product_id:int):
     
@@ -457,9 +1101,9 @@ def service_add_to_cart(session:Session,cart_data:Cart,user:User,product_id:int)
     
     cart_data.user_id = user.user_id
     cart_data.product_id = product_id
-    cart = session.exec(select(Cart).where(Cart.user_id == user.user_id,Cart.product_id == product_id, Cart.product_size == cart_data.product_size)).first()
+    cart = session.exec(select_cart_line(user,product_id,cart_data.product_size)).first()
     if cart:
-        return service_add_same_product_to_cart(session,user,cart_data)
+        return service_add_same_product_to_cart(session,cart,cart_data)
     session.add(cart_data)
     session.commit()
     session.refresh(cart_data)
@@ -467,19 +1111,75 @@ def service_add_to_cart(session:Session,cart_data:Cart,user:User,product_id:int)
 
     return cart_data
 
-def service_get_product_from_cart(session:Session,user:User):
-    product_from_cart = session.exec(
-        select(Cart, Product)
+def select_cart_products(user:User):
+    """
+    This function is used to build the query of a user's cart lines with their products.
+
+    :return: A select of the CartProductRead columns.
+    :rtype: Select
+    """
+    return (
+        select(
+            Cart.cart_id,Cart.total_cart_products,Cart.product_total,Cart.product_size,
+            Product.product_id,Product.product_name,Product.product_description,Product.product_price,
+            Product.product_slug,Product.image_id,
+        )
         .join(Product, Cart.product_id == Product.product_id)
         .where(Cart.user_id == user.user_id)
-    ).all()
+    )
+
+def service_get_product_from_cart(session:Session,user:User):
+    """
+    This function is used to get the lines of a user's cart with their products.
+
+    Only the response columns are selected, so no ORM objects are built.
+
+    :return: Rows with the fields of CartProductRead.
+    :rtype: list[Row]
+    """
+    product_from_cart = session.exec(select_cart_products(user)).all()
 
     return product_from_cart
 
+def select_cart_summary(user:User):
+    """
+    This function is used to build the aggregate query of a user's cart totals.
+
+    :return: A select of the line count, item count and subtotal.
+    :rtype: Select
+    """
+    return (
+        select(
+            func.count(Cart.cart_id),
+            func.coalesce(func.sum(Cart.total_cart_products), 0),
+            func.coalesce(func.sum(Cart.total_cart_products * Product.product_price), 0),
+        )
+        .join(Product, Cart.product_id == Product.product_id)
+        .where(Cart.user_id == user.user_id)
+    )
+
+def service_get_cart_summary(session:Session,user:User) -> CartSummary:
+    """
+    This function is used to get the totals of a user's cart with one aggregate query.
+
+    The subtotal is computed from the current product prices rather than
+    the product_total stored on each cart row.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param user: The owner of the cart.
+    :type user: User
+
+    :return: The number of cart lines, the number of items and the subtotal.
+    :rtype: CartSummary
+    """
+    line_count, item_count, subtotal = session.exec(select_cart_summary(user)).one()
+    return CartSummary(line_count=line_count,item_count=item_count,subtotal=subtotal)
+
 def service_update_cart(cart_id:int,type:str,user:User,session:Session,product_price:int):
-    cart = session.exec(select(Cart).where(Cart.cart_id == cart_id and Cart.user_id == user.user_id)).first()
+    cart = session.exec(select(Cart).where(Cart.cart_id == cart_id,Cart.user_id == user.user_id)).first()
     if not cart:
-        raise HTTPException(status="404",detail="Cart is missing")
+        raise HTTPException(status_code=404,detail="Cart is missing")
     if type == "add":
         cart.total_cart_products +=1
         cart.product_total = product_price * cart.total_cart_products
@@ -495,9 +1195,9 @@ def service_update_cart(cart_id:int,type:str,user:User,session:Session,product_p
     
 
 def service_delete_cart(cart_id:int,session:Session,user:User):
-    cart = session.exec(select(Cart).where(Cart.cart_id == cart_id and Cart.user_id == user.user_id)).first()
+    cart = session.exec(select(Cart).where(Cart.cart_id == cart_id,Cart.user_id == user.user_id)).first()
     if not cart:
-        raise HTTPException(status="404",detail="Cart is missing")
+        raise HTTPException(status_code=404,detail="Cart is missing")
     session.delete(cart)
     session.commit()
     return {"message":"cart is removed!"}
@@ -507,7 +1207,87 @@ def service_get_cart_from_user(session:Session,user:User):
     return carts
 
 def service_get_category(session:Session,category_slug:int):
-    category = session.exec(select(Category).where(Category.category_slug == category_slug)).first()
+    """
+    This function is used to get a category by its slug, from the category index.
+    """
+    refresh_category_index(session,category_index)
+    category = category_index.get_by_slug(category_slug)
     if not category:
         raise HTTPException(status_code=404,detail="Could not get category!")
-    return category
\ No newline at end of file
+    return category
+
+def service_get_image(session:Session,image_id:int,variant_name:str | None = None) -> Image | ImageVariant:
+    """
+    This function is used to get the stored image, or one of its variants, to serve.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param image_id: The id of the image.
+    :type image_id: int
+    :param variant_name: The requested variant, if any.
+    :type variant_name: str | None
+
+    :return: The variant when it exists, otherwise the original image.
+    :rtype: ImageVariant or Image
+    """
+    if variant_name:
+        image_variant = session.get(ImageVariant, (image_id, variant_name))
+        if image_variant:
+            return image_variant
+    # The blob column is only loaded for rows that have not been migrated yet.
+    image = session.get(Image, image_id, options=[defer(Image.image_data)])
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    if not image.content_hash:
+        # Legacy row: load the blob here, while the session is usable.
+        session.refresh(image, ["image_data"])
+    return image
+
+def select_image_by_hash(content_hash:str):
+    """
+    This function is used to build the query of the first image stored with a content hash.
+
+    :rtype: Select
+    """
+    return select(Image).where(Image.content_hash == content_hash).order_by(Image.id).limit(1)
+
+def service_get_image_by_hash(session:Session,content_hash:str) -> Image | None:
+    return session.exec(select_image_by_hash(content_hash)).first()
+
+def service_add_image(session:Session,image:Image) -> Image:
+    session.add(image)
+    session.commit()
+    session.refresh(image)
+    return image
+
+def service_add_image_variants(session:Session,variants:list[ImageVariant]) -> list[ImageVariant]:
+    """
+    This function is used to record the rendered variants of images, replacing those already recorded.
+
+    One query finds the variants already recorded, which are merged from the
+    session without querying again; the others are written with one
+    executemany INSERT. The variants passed in are left detached, so their
+    fields can still be read after the commit.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param variants: The rendered variants.
+    :type variants: list[ImageVariant]
+
+    :return: The variants.
+    :rtype: list[ImageVariant]
+    """
+    if not variants:
+        return variants
+    # Held here, as the session only keeps unchanged objects weakly.
+    recorded = {(variant.image_id,variant.variant):variant for variant in session.exec(
+        select(ImageVariant).where(ImageVariant.image_id.in_({variant.image_id for variant in variants}))
+    ).all()}
+    new_variants = [variant.model_dump() for variant in variants if (variant.image_id,variant.variant) not in recorded]
+    if new_variants:
+        session.execute(insert(ImageVariant),new_variants)
+    for variant in variants:
+        if (variant.image_id,variant.variant) in recorded:
+            session.merge(variant)
+    session.commit()
+    return variants
@@ -11,4 +11,53 @@ DATABASE_URL = config("DATABASE_URL",cast=Secret)
 SECRET_KEY = config("SECRET_KEY", cast=Secret)
 ALGORITHM = config("ALGORITHM", cast=Secret)
 ACCESS_TOKEN_EXPIRE_MINUTES = config("ACCESS_TOKEN_EXPIRE_MINUTES", cast=int)
-REFRESH_TOKEN_EXPIRE_MINUTES = config("REFRESH_TOKEN_EXPIRE_MINUTES", cast=int)
\ No newline at end of file
+REFRESH_TOKEN_EXPIRE_MINUTES = config("REFRESH_TOKEN_EXPIRE_MINUTES", cast=int)
+CATALOG_PAGE_SIZE = config("CATALOG_PAGE_SIZE", cast=int, default=24)
+CATALOG_MAX_PAGE_SIZE = config("CATALOG_MAX_PAGE_SIZE", cast=int, default=100)
+IMAGE_STORE_BACKEND = config("IMAGE_STORE_BACKEND", default="local")
+IMAGE_STORE_PATH = config("IMAGE_STORE_PATH", default="media/images")
+IMAGE_CACHE_MAX_BYTES = config("IMAGE_CACHE_MAX_BYTES", cast=int, default=64 * 1024 * 1024)
+IMAGE_CACHE_MAX_ITEM_BYTES = config("IMAGE_CACHE_MAX_ITEM_BYTES", cast=int, default=1024 * 1024)
+IMAGE_CACHE_CONTROL = config("IMAGE_CACHE_CONTROL", default="public, max-age=31536000, immutable")
+# For the original served in place of a variant that is not rendered yet.
+IMAGE_FALLBACK_CACHE_CONTROL = config("IMAGE_FALLBACK_CACHE_CONTROL", default="no-cache")
+IMAGE_VARIANT_FORMAT = config("IMAGE_VARIANT_FORMAT", default="WEBP")
+IMAGE_VARIANT_QUALITY = config("IMAGE_VARIANT_QUALITY", cast=int, default=80)
+IMAGE_WORKERS = config("IMAGE_WORKERS", cast=int, default=2)
+IMAGE_MAX_UPLOAD_BYTES = config("IMAGE_MAX_UPLOAD_BYTES", cast=int, default=10 * 1024 * 1024)
+IMAGE_UPLOAD_CHUNK_BYTES = config("IMAGE_UPLOAD_CHUNK_BYTES", cast=int, default=1024 * 1024)
+ASYNC_DATABASE = config("ASYNC_DATABASE", cast=bool, default=False)
+ASYNC_DATABASE_URL = config("ASYNC_DATABASE_URL", cast=Secret, default=None)
+DB_ECHO = config("DB_ECHO", cast=bool, default=False)
+DB_POOL_SIZE = config("DB_POOL_SIZE", cast=int, default=5)
+DB_MAX_OVERFLOW = config("DB_MAX_OVERFLOW", cast=int, default=10)
+DB_POOL_TIMEOUT = config("DB_POOL_TIMEOUT", cast=float, default=30)
+DB_POOL_RECYCLE = config("DB_POOL_RECYCLE", cast=int, default=300)
+DB_POOL_PRE_PING = config("DB_POOL_PRE_PING", cast=bool, default=False)
+DB_SSLMODE = config("DB_SSLMODE", default="require")
+PRINCIPAL_CACHE_TTL_SECONDS = config("PRINCIPAL_CACHE_TTL_SECONDS", cast=float, default=60)
+PRINCIPAL_CACHE_MAX_ENTRIES = config("PRINCIPAL_CACHE_MAX_ENTRIES", cast=int, default=10000)
+BCRYPT_ROUNDS = config("BCRYPT_ROUNDS", cast=int, default=12)
+PASSWORD_HASH_WORKERS = config("PASSWORD_HASH_WORKERS", cast=int, default=2)
+PASSWORD_HASH_QUEUE_SIZE = config("PASSWORD_HASH_QUEUE_SIZE", cast=int, default=32)
+# "warn" until every deployment runs `alembic upgrade head` (or `alembic stamp 0001` for a database created
+# before migrations existed) on deploy; set "error" where it does.
+DB_SCHEMA_CHECK = config("DB_SCHEMA_CHECK", default="warn")
+SEARCH_BACKEND = config("SEARCH_BACKEND", default="auto")
+SEARCH_INDEX_TTL_SECONDS = config("SEARCH_INDEX_TTL_SECONDS", cast=float, default=60)
+SEARCH_MAX_OFFSET = config("SEARCH_MAX_OFFSET", cast=int, default=1000)
+CATEGORY_INDEX_TTL_SECONDS = config("CATEGORY_INDEX_TTL_SECONDS", cast=float, default=60)
+IMPORT_BATCH_SIZE = config("IMPORT_BATCH_SIZE", cast=int, default=1000)
+IMPORT_MAX_ERRORS = config("IMPORT_MAX_ERRORS", cast=int, default=100)
+EXPORT_CHUNK_ORDERS = config("EXPORT_CHUNK_ORDERS", cast=int, default=1000)
+EXPORT_YIELD_PER = config("EXPORT_YIELD_PER", cast=int, default=500)
+ORDER_HISTORY_PAGE_SIZE = config("ORDER_HISTORY_PAGE_SIZE", cast=int, default=20)
+ORDER_HISTORY_MAX_PAGE_SIZE = config("ORDER_HISTORY_MAX_PAGE_SIZE", cast=int, default=100)
+ARCHIVE_BATCH_SIZE = config("ARCHIVE_BATCH_SIZE", cast=int, default=500)
+IDEMPOTENCY_KEY_TTL_SECONDS = config("IDEMPOTENCY_KEY_TTL_SECONDS", cast=int, default=24 * 60 * 60)
+IDEMPOTENCY_LOCK_SECONDS = config("IDEMPOTENCY_LOCK_SECONDS", cast=int, default=60)
+QUERY_CHECK = config("QUERY_CHECK", default="off")
+QUERY_REPEAT_THRESHOLD = config("QUERY_REPEAT_THRESHOLD", cast=int, default=3)
+SLOW_QUERY_SECONDS = config("SLOW_QUERY_SECONDS", cast=float, default=0)
+SLOW_QUERY_LOG_SIZE = config("SLOW_QUERY_LOG_SIZE", cast=int, default=100)
+SLOW_QUERY_EXPLAIN_RATE = config("SLOW_QUERY_EXPLAIN_RATE", cast=float, default=0.1)
@@ -0,0 +1,143 @@
+"""
+Resized derivatives of uploaded images.
+
+Every upload is re-encoded into the fixed set of IMAGE_VARIANTS widths in a
+process pool, so the resizing never runs on a request thread or the event
+loop. Existing images can be backfilled with::
+
+    python -m ecomweb.storage.derivatives
+"""
+import asyncio
+import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlmodel import Session, select
+
+from ecomweb.database.database import AnySession, run_db
+from ecomweb.model.model import Image, ImageVariant
+from ecomweb.service.service import service_add_image_variants
+from ecomweb.settings.setting import IMAGE_VARIANT_FORMAT, IMAGE_VARIANT_QUALITY, IMAGE_WORKERS
+from ecomweb.storage.storage import get_image_store
+
+logger = logging.getLogger(__name__)
+
+# Variant name -> maximum width in pixels, smallest first.
+IMAGE_VARIANTS = {
+    "thumbnail": 160,
+    "card": 480,
+    "full": 1200,
+}
+
+_executor:ProcessPoolExecutor | None = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def variant_for_width(width:int) -> str:
+    """
+    Return the smallest variant that is at least ``width`` pixels wide.
+    """
+    for name, variant_width in IMAGE_VARIANTS.items():
+        if variant_width >= width:
+            return name
+    return next(reversed(IMAGE_VARIANTS))
+
+
+def render_variants(source:str | bytes) -> list[dict]:
+    """
+    Resize ``source`` (a file path or the image bytes) into every variant and
+    write the results to the image store.
+
+    Runs inside the worker processes, so it only takes and returns picklable
+    values.
+    """
+    from PIL import Image as PILImage, ImageOps
+
+    store = get_image_store()
+    with PILImage.open(source if isinstance(source, str) else io.BytesIO(source)) as original:
+        original = ImageOps.exif_transpose(original)
+        if original.mode not in ("RGB", "RGBA"):
+            has_alpha = original.mode in ("LA", "PA") or "transparency" in original.info
+            original = original.convert("RGBA" if has_alpha else "RGB")
+        variants = []
+        for name, max_width in IMAGE_VARIANTS.items():
+            resized = original.copy()
+            # Never upscale: small originals are only re-encoded.
+            resized.thumbnail((max_width, max_width * 4), PILImage.LANCZOS)
+            if IMAGE_VARIANT_FORMAT == "JPEG" and resized.mode == "RGBA":
+                resized = resized.convert("RGB")
+            buffer = io.BytesIO()
+            resized.save(buffer, format=IMAGE_VARIANT_FORMAT, quality=IMAGE_VARIANT_QUALITY)
+            data = buffer.getvalue()
+            variants.append({
+                "variant": name,
+                "width": resized.width,
+                "height": resized.height,
+                "content_type": PILImage.MIME[IMAGE_VARIANT_FORMAT],
+                "content_hash": store.put(data),
+                "size": len(data),
+            })
+        return variants
+
+
+async def create_image_variants(session:AnySession, image:Image) -> list[ImageVariant]:
+    """
+    Render and record the variants of a stored image without blocking the event loop.
+
+    Failures are logged and leave the image without variants; /api/image then
+    serves the original.
+    """
+    store = get_image_store()
+    source = store.path(image.content_hash)
+    if source is None:
+        with store.open(image.content_hash) as file:
+            source = file.read()
+    loop = asyncio.get_running_loop()
+    try:
+        rendered = await loop.run_in_executor(get_executor(), render_variants, source)
+    except ImportError:
+        logger.warning("Pillow is not installed, image variants are disabled")
+        return []
+    except Exception:
+        logger.exception("Could not create variants for image %s", image.id)
+        return []
+    variants = [ImageVariant(image_id=image.id, **variant) for variant in rendered]
+    return await run_db(session, service_add_image_variants, variants)
+
+
+def backfill_variants(session:Session) -> int:
+    """
+    Create variants for every stored image that has none yet.
+    """
+    images = session.exec(
+        select(Image)
+        .where(Image.content_hash != None, Image.id.not_in(select(ImageVariant.image_id)))
+        .order_by(Image.id)
+    ).all()
+    created = 0
+    for image in images:
+        asyncio.run(create_image_variants(session, image))
+        created += 1
+        print(f"Created variants for image {image.id}")
+    return created
+
+
+if __name__ == "__main__":
+    from ecomweb.database.database import get_engine
+
+    with Session(get_engine()) as session:
+        print(f"Done, {backfill_variants(session)} images processed.")
+    shutdown_executor()
@@ -0,0 +1,93 @@
+"""
+Move legacy image blobs out of the image table into the image store.
+
+Usage::
+
+    python -m ecomweb.storage.migrate [--batch-size 100] [--keep-blobs]
+
+The script is idempotent: rows that already have a content_hash are skipped,
+so it can be re-run after an interruption.
+"""
+import argparse
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from ecomweb.database.database import get_engine
+from ecomweb.model.model import Image
+from ecomweb.storage.storage import ImageStore, get_image_store
+
+
+def add_image_columns(engine:Engine) -> None:
+    """
+    Add the image store columns to an image table created before they existed.
+    """
+    columns = {column["name"] for column in inspect(engine).get_columns("image")}
+    with engine.begin() as connection:
+        if "content_hash" not in columns:
+            connection.execute(text("ALTER TABLE image ADD COLUMN content_hash VARCHAR"))
+            connection.execute(text("CREATE INDEX ix_image_content_hash ON image (content_hash)"))
+        if "size" not in columns:
+            connection.execute(text("ALTER TABLE image ADD COLUMN size INTEGER"))
+        if engine.dialect.name == "postgresql":
+            connection.execute(text("ALTER TABLE image ALTER COLUMN image_data DROP NOT NULL"))
+
+
+def migrate_image_blobs(session:Session, store:ImageStore, batch_size:int = 100, keep_blobs:bool = False) -> int:
+    """
+    Copy every legacy blob into the image store and record its content hash.
+
+    :param session: An instance of the session object used to interact with the database.
+    :type session: Session
+    :param store: The image store to copy the blobs into.
+    :type store: ImageStore
+    :param batch_size: How many rows are loaded and committed at a time.
+    :type batch_size: int
+    :param keep_blobs: Leave image_data in place instead of clearing it.
+    :type keep_blobs: bool
+
+    :return: The number of migrated images.
+    :rtype: int
+    """
+    migrated = 0
+    last_id = 0
+    while True:
+        images = session.exec(
+            select(Image)
+            .where(Image.id > last_id, Image.content_hash == None, Image.image_data != None)
+            .order_by(Image.id)
+            .limit(batch_size)
+        ).all()
+        if not images:
+            break
+        last_id = images[-1].id
+        for image in images:
+            image.content_hash = store.put(image.image_data)
+            image.size = len(image.image_data)
+            if not keep_blobs:
+                image.image_data = None
+            session.add(image)
+        session.commit()
+        # Drop the loaded blobs before fetching the next batch.
+        session.expunge_all()
+        migrated += len(images)
+        print(f"Migrated {migrated} images (last id {last_id})")
+    return migrated
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--keep-blobs", action="store_true", help="do not clear image_data after copying")
+    args = parser.parse_args()
+
+    engine = get_engine()
+    add_image_columns(engine)
+    with Session(engine) as session:
+        migrated = migrate_image_blobs(session, get_image_store(), args.batch_size, args.keep_blobs)
+    print(f"Done, {migrated} images moved to the image store.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,404 @@
+import hashlib
+import os
+import re
+import tempfile
+from abc import ABC, abstractmethod
+from email.utils import formatdate
+from functools import lru_cache
+from typing import BinaryIO, Hashable, Mapping, NamedTuple
+
+import anyio
+from fastapi import HTTPException, UploadFile
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import FileResponse, Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from ecomweb.cache.cache import LRUByteCache
+from ecomweb.model.model import Image, ImageVariant
+from ecomweb.settings.setting import (IMAGE_CACHE_CONTROL, IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_MAX_ITEM_BYTES,
+                                      IMAGE_MAX_UPLOAD_BYTES, IMAGE_STORE_BACKEND, IMAGE_STORE_PATH,
+                                      IMAGE_UPLOAD_CHUNK_BYTES)
+
+
+class PendingUpload:
+    """
+    An upload being written chunk by chunk.
+
+    The sha256 and size are updated as chunks arrive, so the content key is
+    known before the upload is committed to the store. This default
+    implementation buffers in memory; backends override it to write
+    straight to their destination.
+    """
+
+    def __init__(self, store:"ImageStore"):
+        self.store = store
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._chunks:list[bytes] = []
+
+    @property
+    def content_hash(self) -> str:
+        return self._hash.hexdigest()
+
+    def write(self, chunk:bytes) -> None:
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        self._chunks.append(chunk)
+
+    def commit(self) -> str:
+        return self.store.put(b"".join(self._chunks))
+
+    def abort(self) -> None:
+        self._chunks.clear()
+
+
+class LocalPendingUpload(PendingUpload):
+    """
+    Streams the upload into a temporary file inside the store root and
+    renames it to its content address on commit.
+    """
+
+    def __init__(self, store:"LocalImageStore"):
+        super().__init__(store)
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.root, prefix=".upload-")
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, chunk:bytes) -> None:
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        self._file.write(chunk)
+
+    def commit(self) -> str:
+        key = self.content_hash
+        path = self.store.path(key)
+        self._file.close()
+        if os.path.exists(path):
+            os.unlink(self.tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(self.tmp_path, path)
+        return key
+
+    def abort(self) -> None:
+        self._file.close()
+        try:
+            os.unlink(self.tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+class ImageStore(ABC):
+    """
+    Interface of an image storage backend.
+
+    Objects are addressed by the sha256 hex digest of their bytes, so the
+    database only keeps that key next to the image metadata.
+    """
+
+    @abstractmethod
+    def put(self, data:bytes) -> str:
+        """
+        Store the bytes and return their content key.
+        """
+
+    def begin_upload(self) -> PendingUpload:
+        """
+        Start an incremental upload; see PendingUpload.
+        """
+        return PendingUpload(self)
+
+    @abstractmethod
+    def open(self, key:str) -> BinaryIO:
+        """
+        Open the stored object for binary reading.
+        """
+
+    def path(self, key:str) -> str | None:
+        """
+        Return a local file path for zero-copy serving, or None when the
+        backend has no local files.
+        """
+        return None
+
+    @abstractmethod
+    def exists(self, key:str) -> bool:
+        """
+        Return whether an object is stored under the key.
+        """
+
+    @abstractmethod
+    def delete(self, key:str) -> None:
+        """
+        Remove the stored object; a missing key is not an error.
+        """
+
+
+class LocalImageStore(ImageStore):
+    """
+    Content addressed store on the local filesystem.
+
+    Files live at ``<root>/<key[:2]>/<key[2:4]>/<key>`` and are written to a
+    temporary file first, then renamed into place, so readers never see a
+    partially written image.
+    """
+
+    def __init__(self, root:str):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key:str) -> str:
+        if not re.fullmatch(r"[0-9a-f]{64}", key):
+            raise ValueError(f"Invalid image key: {key!r}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, data:bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if os.path.exists(path):
+            return key
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                tmp.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return key
+
+    def begin_upload(self) -> PendingUpload:
+        return LocalPendingUpload(self)
+
+    def open(self, key:str) -> BinaryIO:
+        return open(self._path(key), "rb")
+
+    def path(self, key:str) -> str | None:
+        return self._path(key)
+
+    def exists(self, key:str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def delete(self, key:str) -> None:
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+IMAGE_STORES = {
+    "local": lambda: LocalImageStore(IMAGE_STORE_PATH),
+}
+
+
+@lru_cache(maxsize=None)
+def get_image_store() -> ImageStore:
+    """
+    Return the image store selected by the IMAGE_STORE_BACKEND setting.
+    """
+    try:
+        factory = IMAGE_STORES[IMAGE_STORE_BACKEND]
+    except KeyError:
+        raise RuntimeError(f"Unknown IMAGE_STORE_BACKEND {IMAGE_STORE_BACKEND!r}")
+    return factory()
+
+
+class FileRangeResponse(Response):
+    """
+    206 Partial Content response that streams one byte range of a file.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, path:str, start:int, end:int, size:int, media_type:str, headers:dict | None = None):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.status_code = 206
+        self.media_type = media_type
+        self.background = None
+        range_headers = dict(headers or {})
+        range_headers["content-range"] = f"bytes {start}-{end}/{size}"
+        range_headers["content-length"] = str(end - start + 1)
+        self.init_headers(range_headers)
+
+    async def __call__(self, scope:Scope, receive:Receive, send:Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope["method"].upper() == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        remaining = self.end - self.start + 1
+        async with await anyio.open_file(self.path, mode="rb") as file:
+            await file.seek(self.start)
+            while remaining > 0:
+                chunk = await file.read(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+        if remaining > 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def parse_range(range_header:str | None, size:int) -> tuple[int,int] | None:
+    """
+    Parse a single ``bytes=`` range against a file of ``size`` bytes.
+
+    Returns None when the whole file should be sent (no header, a malformed
+    header or several ranges) and raises ValueError when the range cannot be
+    satisfied.
+    """
+    if not range_header:
+        return None
+    match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header)
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    first, last = match.groups()
+    if first == "":
+        length = int(last)
+        if length == 0:
+            raise ValueError("Unsatisfiable range")
+        start, end = max(size - length, 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if start > end:
+            if last and int(last) < start:
+                return None
+            raise ValueError("Unsatisfiable range")
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+    return start, end
+
+
+def image_file_response(path:str, media_type:str, range_header:str | None = None, headers:dict | None = None) -> Response:
+    """
+    Serve a stored image file, honouring a single byte Range request.
+    """
+    stat_result = os.stat(path)
+    response_headers = {"accept-ranges": "bytes", **(headers or {})}
+    try:
+        byte_range = parse_range(range_header, stat_result.st_size)
+    except ValueError:
+        return Response(status_code=416, headers={"content-range": f"bytes */{stat_result.st_size}"})
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers=response_headers, stat_result=stat_result)
+    start, end = byte_range
+    return FileRangeResponse(path, start, end, stat_result.st_size, media_type, headers=response_headers)
+
+
+class CachedImage(NamedTuple):
+    data:bytes
+    content_type:str
+    etag:str
+    last_modified:str | None
+
+
+# Hot image bytes, keyed by (image id, variant), so repeat views skip the database and disk.
+image_cache = LRUByteCache(IMAGE_CACHE_MAX_BYTES, IMAGE_CACHE_MAX_ITEM_BYTES)
+
+
+def image_etag(content_hash:str) -> str:
+    return f'"{content_hash}"'
+
+
+def etag_matches(if_none_match:str | None, etag:str) -> bool:
+    """
+    Weak comparison of an If-None-Match header against ``etag``.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def image_headers(etag:str, last_modified:str | None = None, cache_control:str = IMAGE_CACHE_CONTROL) -> dict:
+    headers = {"etag": etag, "cache-control": cache_control}
+    if last_modified is not None:
+        headers["last-modified"] = last_modified
+    return headers
+
+
+def cached_image_response(cache_key:Hashable, request_headers:Mapping[str,str]) -> Response | None:
+    """
+    Answer an image request from the in-process cache, or return None on a miss.
+
+    Range requests are left to the file path so partial content is always
+    served from the store.
+    """
+    if "range" in request_headers:
+        return None
+    cached = image_cache.get(cache_key)
+    if cached is None:
+        return None
+    headers = image_headers(cached.etag, cached.last_modified)
+    if etag_matches(request_headers.get("if-none-match"), cached.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(cached.data, media_type=cached.content_type, headers=headers)
+
+
+def image_response(image:Image | ImageVariant, cache_key:Hashable | None, request_headers:Mapping[str,str],
+                   cache_control:str = IMAGE_CACHE_CONTROL) -> Response:
+    """
+    Serve an image or one of its variants with validators and caching
+    headers, filling the cache unless ``cache_key`` is None.
+    """
+    if_none_match = request_headers.get("if-none-match")
+    range_header = request_headers.get("range")
+
+    if not image.content_hash:
+        # Legacy Image row whose bytes still live in the image table.
+        data = image.image_data
+        etag = image_etag(hashlib.sha256(data).hexdigest())
+        if cache_key is not None:
+            image_cache.set(cache_key, CachedImage(data, image.content_type, etag, None), len(data))
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=image_headers(etag, cache_control=cache_control))
+        return Response(data, media_type=image.content_type, headers=image_headers(etag, cache_control=cache_control))
+
+    etag = image_etag(image.content_hash)
+    store = get_image_store()
+    path = store.path(image.content_hash)
+    if path is None:
+        if etag_matches(if_none_match, etag):
+            return Response(status_code=304, headers=image_headers(etag, cache_control=cache_control))
+        return StreamingResponse(store.open(image.content_hash), media_type=image.content_type, headers=image_headers(etag, cache_control=cache_control))
+
+    stat_result = os.stat(path)
+    headers = image_headers(etag, formatdate(stat_result.st_mtime, usegmt=True), cache_control)
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if not range_header and stat_result.st_size <= image_cache.max_item_bytes:
+        with open(path, "rb") as file:
+            data = file.read()
+        if cache_key is not None:
+            image_cache.set(cache_key, CachedImage(data, image.content_type, etag, headers["last-modified"]), len(data))
+        return Response(data, media_type=image.content_type, headers=headers)
+    return image_file_response(path, image.content_type, range_header, headers)
+
+
+async def receive_upload(file:UploadFile, store:ImageStore, max_bytes:int = IMAGE_MAX_UPLOAD_BYTES, chunk_size:int = IMAGE_UPLOAD_CHUNK_BYTES) -> PendingUpload:
+    """
+    Copy an uploaded file into ``store`` chunk by chunk.
+
+    The upload is aborted with 413 as soon as it grows past ``max_bytes``.
+    The returned PendingUpload still has to be committed or aborted.
+    """
+    upload = store.begin_upload()
+    try:
+        while chunk := await file.read(chunk_size):
+            if upload.size + len(chunk) > max_bytes:
+                raise HTTPException(status_code=413, detail=f"Image is larger than {max_bytes} bytes.")
+            await run_in_threadpool(upload.write, chunk)
+    except BaseException:
+        upload.abort()
+        raise
+    return upload